@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-from Lambdas import flavourSigma1,flavourSigma3
+from Lambdas import flavourSigma1,flavourSigma3,su4Norm
 import json
 import numpy as np
 
@@ -60,8 +60,10 @@ def getDoubleArray(dictData, section, valKey, valType=float, hasUnit=True):
 
 class Constants:
     def __init__(self, filename="./Parameters.json"):
+        # The file is read once; its text is kept for dump()
         with open(filename, "r") as fileJSON:
-            dictParameters = json.load(fileJSON)
+            self.text = fileJSON.read()
+            dictParameters = json.loads(self.text)
 
             # Basic physical parameters
 
@@ -81,10 +83,37 @@ class Constants:
             self.n_Nu    = getValue(dictParameters, "V-A & NSSI & MSW & AMM", "n_Nu")
             self.n_e     = getValue(dictParameters, "V-A & NSSI & MSW & AMM", "n_e")
             self.n_n     = getValue(dictParameters, "V-A & NSSI & MSW & AMM", "n_n")
+            self.mu_Nu   = getValue(dictParameters, "V-A & NSSI & MSW & AMM", "mu_Nu")
+            self.Beff    = getValue(dictParameters, "V-A & NSSI & MSW & AMM", "Beff")
 
             # Scheme
 
-            self.X = getValue(dictParameters, "Scheme", "X")
+            self.X   = getValue(dictParameters, "Scheme", "X")
+            self.Z   = getValue(dictParameters, "Scheme", "Z")
+            self.N_x = getValue(dictParameters, "Scheme", "N_x", valType=int, hasUnit=False)
+            self.N_z = getValue(dictParameters, "Scheme", "N_z", valType=int, hasUnit=False)
+
+            self.WhichNorms         = getValue(dictParameters, "Scheme", "WhichNorms", valType=bool, hasUnit=False)
+            self.PressFlag          = getValue(dictParameters, "Scheme", "PressFlag", valType=bool, hasUnit=False)
+            self.su4NormaliseFlag   = getValue(dictParameters, "Scheme", "su4NormaliseFlag", valType=bool, hasUnit=False)
+            self.RegEigenvaluesFlag = getValue(dictParameters, "Scheme", "RegEigenvaluesFlag", valType=bool, hasUnit=False)
+
+            self.xDerivativeOrder     = getValue(dictParameters, "Scheme", "xDerivativeOrder", valType=int, hasUnit=False)
+            self.su4NormalisePeriod   = getValue(dictParameters, "Scheme", "su4NormalisePeriod", valType=int, hasUnit=False)
+            self.RegEigenvaluesPeriod = getValue(dictParameters, "Scheme", "RegEigenvaluesPeriod", valType=int, hasUnit=False)
+
+            # Profile
+
+            self.ProfileFlag = getValue(dictParameters, "Profile", "toggle", valType=bool, hasUnit=False)
+            self.R           = getValue(dictParameters, "Profile", "z_0")
+
+            # Old fashioned way of perturbing the luminosity
+
+            self.OldNoiseFlag = getValue(dictParameters, "Old Fashioned Noise", "lumPerturbations", valType=bool, hasUnit=False)
+            self.lumSinLeft   = getArray(dictParameters, "Old Fashioned Noise", "lumSinLeft", hasUnit=False)
+            self.lumCosLeft   = getArray(dictParameters, "Old Fashioned Noise", "lumCosLeft", hasUnit=False)
+            self.lumSinRight  = getArray(dictParameters, "Old Fashioned Noise", "lumSinRight", hasUnit=False)
+            self.lumCosRight  = getArray(dictParameters, "Old Fashioned Noise", "lumCosRight", hasUnit=False)
 
             # Initial parameters
 
@@ -95,15 +124,30 @@ class Constants:
             self.V_Nu  = G_F * np.sqrt(2) * self.n_Nu * (hbarc)**2
             self.V_e   = G_F * np.sqrt(2) * self.n_e * (hbarc)**2
             self.V_n   = G_F * np.sqrt(2) * self.n_n * (hbarc)**2 
+            self.V_AMM = self.mu_Nu * self.Beff / hbarc
 
             # Construct the initial (mean) density matrix
             self.InitialRho = np.matrix(np.diag(self.InitialProbsLeft))
 
+            # The mean initial density matrices of the beams (as in nssi) and their su4Norm's
+            self.MeanLeft  = np.diag(self.InitialProbsLeft).astype(np.complex128)
+            self.MeanRight = np.diag(self.InitialProbsRight).astype(np.complex128)
+            self.NormMeanLeft  = su4Norm(self.MeanLeft)
+            self.NormMeanRight = su4Norm(self.MeanRight)
+
             # Functions of the angle chi
             self.cosOmega = np.cos(2.0 * self.chi)
             self.cosChi   = np.cos(self.chi)
             self.tanChi   = np.tan(self.chi)
 
+            # Functions of the mixing angle
+            self.c2theta  = np.cos(2.0 * self.theta)
+            self.s2theta  = np.sin(2.0 * self.theta)
+
+            # Steps of the grid
+            self.dz = self.Z / self.N_z
+            self.dx = self.X / self.N_x
+
             self.vacOmega = self.dm2_0/(2.0*self.E_0*hbarc)
 
             # Flag of hierarchy
@@ -116,10 +160,30 @@ class Constants:
             self.omegaVac = self.dm2_0 / (2.0 * self.E_0 * hbarc)
             self.muOverOmega = self.V_Nu * (1.0 - self.cosOmega) / self.omegaVac
 
+    # Write the JSON file with these constants
+    def dump(self, filename):
+        with open(filename, "w") as f:
+            f.write(self.text)
+
+""" Fourier harmonics of the initial perturbations of the beams """
+
+class Noise:
+    def __init__(self, filename="./Noise.json"):
+        # Similarly to Constants, the text is kept for dump()
         with open(filename, "r") as fileJSON:
             self.text = fileJSON.read()
+            dictNoise = json.loads(self.text)
 
-    # Write the JSON file with these constants
+            self.N_Noise = getValue(dictNoise, "Meta", "N_Noise", valType=int, hasUnit=False)
+
+            # The 15D vectors of the harmonics sin(2 pi k x / X) and cos(2 pi k x / X), k = 1..N_Noise,
+            # as the arrays (N_Noise, 15)
+            self.sinCoeffsLeft  = np.array(getDoubleArray(dictNoise, "Harmonics", "sinCoeffsLeft", hasUnit=False)).reshape(-1, 15)
+            self.cosCoeffsLeft  = np.array(getDoubleArray(dictNoise, "Harmonics", "cosCoeffsLeft", hasUnit=False)).reshape(-1, 15)
+            self.sinCoeffsRight = np.array(getDoubleArray(dictNoise, "Harmonics", "sinCoeffsRight", hasUnit=False)).reshape(-1, 15)
+            self.cosCoeffsRight = np.array(getDoubleArray(dictNoise, "Harmonics", "cosCoeffsRight", hasUnit=False)).reshape(-1, 15)
+
+    # Write the JSON file with these harmonics
     def dump(self, filename):
         with open(filename, "w") as f:
             f.write(self.text)
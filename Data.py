@@ -1,17 +1,140 @@
 #!/usr/bin/env python3
 
 import numpy as np
-import os, json, struct
+import os, json, time
+import zlib, lzma
 import warnings
+from functools import lru_cache
+
+from Manifest import LoadManifest
 
 # The size of the types used for operating over the
 # floating point numbers (in bytes)
 SIZE_FLOAT = 8
 
+# Default number of lines read from the binaries at once
+CHUNK_ROWS = 64
+
+# The cache of the summaries of the lines (saved at the folder 'averages');
+# the version must be increased whenever its layout changes
+CACHE_FILE = "stats.npz"
+CACHE_VERSION = 1
+
+# The x-Fourier spectra of the lines (saved at the folder 'averages' as well)
+SPECTRUM_FILE = "spectrum.npz"
+
+# Labels of the beams, in the order they are kept in the blocks of lines
+BEAMS = ("left", "right")
+
+# The codecs that can be used to compress the tiles
+codecs = {"zlib": (lambda data, level: zlib.compress(data, level), zlib.decompress),
+          "lzma": (lambda data, level: lzma.compress(data, preset=level), lzma.decompress)}
+
+# Sizes and modification times of the files a setup's data is read from
+def sourceStamps(folder):
+    stamps = {}
+    for filename in ["bin/left.bin", "bin/right.bin", "ZGrid.txt"]:
+        stat = os.stat(f"{folder}/{filename}")
+        stamps[filename] = [stat.st_size, stat.st_mtime_ns]
+    return stamps
+
+# Load the statistics from the cache of a setup; None is returned if there's
+# no cache, or if it's stale, i.e. the source files have changed since it's been written
+# or (if they're specified) it has been evaluated with other periods
+def loadCache(folder, periodN_x=None, periodN_z=None):
+    filename = f"{folder.rstrip('/')}/averages/{CACHE_FILE}"
+    if not os.path.isfile(filename):
+        return None
+
+    with np.load(filename) as cache:
+        header = json.loads(str(cache["header"]))
+        if header["version"] != CACHE_VERSION:
+            return None
+        if periodN_x is not None and header["periodN_x"] != periodN_x:
+            return None
+        if periodN_z is not None and header["periodN_z"] != periodN_z:
+            return None
+        if header["files"] != sourceStamps(folder.rstrip('/')):
+            return None
+
+        stats = Statistics(len(cache["ZGrid"]))
+        for field in Statistics.fields:
+            setattr(stats, field, cache[field])
+        return stats
+
+# The statistics of a setup read through the cache; if it's missing or stale,
+# they are evaluated (with the given periods) and the cache is written
+def cachedStatistics(folder, periodN_x=1, periodN_z=1, anyPeriods=True):
+    if anyPeriods:
+        stats = loadCache(folder)
+        if stats is not None:
+            return stats
+    return Data(folder, periodN_x=periodN_x, periodN_z=periodN_z).CachedStatistics()
+
+class Statistics:
+    """ Summaries of the lines of a setup (for each displayed z) """
+
+    # Names of the arrays holding the summaries
+    fields = ("mean", "var", "min", "max", "symm", "nunubar")
+
+    def __init__(self, Length_z):
+        # Summaries over x of each of the 8 flavour/beam fields, (8, Length_z)
+        self.mean = np.empty((8, Length_z), np.float64)
+        self.var  = np.empty((8, Length_z), np.float64)
+        self.min  = np.empty((8, Length_z), np.float64)
+        self.max  = np.empty((8, Length_z), np.float64)
+        # Left/right symmetric mean of each flavour, (4, Length_z)
+        self.symm = np.empty((4, Length_z), np.float64)
+        # And the ratio of the neutrino and antineutrino probabilities
+        self.nunubar = np.empty(Length_z, np.float64)
+
+    # Summarise a block of lines (as yielded by Data.blocks) starting at iline
+    def update(self, iline, block):
+        lines = slice(iline, iline + block.shape[1])
+        self.mean[:, lines] = np.mean(block, axis=2)
+        self.var[:, lines]  = np.var(block, axis=2)
+        self.min[:, lines]  = np.min(block, axis=2)
+        self.max[:, lines]  = np.max(block, axis=2)
+        self.symm[:, lines] = 0.5*(self.mean[:4, lines] + self.mean[4:, lines])
+        self.nunubar[lines] = (self.symm[0, lines] + self.symm[1, lines]) / (self.symm[2, lines] + self.symm[3, lines])
+
+    # Change the number of the summarised lines, retaining the already evaluated ones
+    def resize(self, Length_z):
+        for field in self.fields:
+            old = getattr(self, field)
+            new = np.empty(old.shape[:-1] + (Length_z,), np.float64)
+            n = min(Length_z, old.shape[-1])
+            new[..., :n] = old[..., :n]
+            setattr(self, field, new)
+
+class Spectrum:
+    """ Power spectra along x of the lines of a setup (for each displayed z) """
+
+    def __init__(self, Length_z, N_x, X):
+        # The lines are periodic, so the copy of the zeroth point at the end is dropped
+        # and the remaining N_x points span the period X (km); the wavenumbers are in km^-1
+        self.N_x = N_x
+        self.q = 2.0*np.pi*np.arange(N_x//2 + 1) / X
+        # Power of each of the harmonics of the 8 flavour/beam fields, (8, Length_z, Nk);
+        # normalised so that the zeroth harmonic is the squared average of the line
+        self.power = np.empty((8, Length_z, len(self.q)), np.float32)
+        # The wavenumber of the strongest harmonic (the zeroth one excluded), (8, Length_z)
+        self.dominant = np.empty((8, Length_z), np.float64)
+
+    # Transform a block of lines (as yielded by Data.blocks) starting at iline
+    def update(self, iline, block):
+        lines = slice(iline, iline + block.shape[1])
+        power = np.abs(np.fft.rfft(block[:, :, :self.N_x], axis=2))**2 / self.N_x**2
+        self.power[:, lines] = power
+        if len(self.q) > 1:
+            self.dominant[:, lines] = self.q[1 + np.argmax(power[:, :, 1:], axis=2)]
+        else:
+            self.dominant[:, lines] = 0.0
+
 class Data:
     """ Reading dumps of the calculated setups """
 
-    def __init__(self, folder, periodN_x=1, periodN_z=1):
+    def __init__(self, folder, periodN_x=1, periodN_z=1, mmap=False, chunkRows=CHUNK_ROWS, follow=False):
         # The folder in which the subfolder bin
         # must be found, containing the files bin/left.bin and bin/right.bin
         self.folder = folder.rstrip('/')
@@ -40,17 +163,53 @@ class Data:
         self._Averages = [None for i in range(8)]
         self.loadedAverages = False
 
+        # Summaries of the lines evaluated in a single pass
+        self._Statistics = None
+        self.loadedStatistics = False
+
+        # Spectra of the lines along x
+        self._Spectrum = None
+        self.loadedSpectrum = False
+
+        # Memory maps of the binaries and the strided views on them;
+        # if mmap is set, all the reading goes through these views
+        self.mmap = mmap
+        self._Views = [None for i in range(8)]
+        self.mapped = False
+
+        # Number of lines in the blocks read from the binaries at once
+        self.chunkRows = chunkRows
+
         # First step is to obtain the dimensions of the saved grids
-        # and the particular poiints at the axes
-        with open(f"{folder}/XGrid.txt") as f:
-            grid = f.read().rstrip().split(" ")
-            self.XGrid = [float(each) for each in grid]
-            self.Length_x_bin = len(self.XGrid)
-            self.N_x_bin = self.Length_x_bin - 1
-
-        with open(f"{folder}/ZGrid.txt") as f:
-            grid = f.read().rstrip().split(" ")
-            self.ZGrid = [float(each) for each in grid]
+        # and the particular poiints at the axes; they're taken from the manifest
+        # of the setup if it's up to date (and the text grids are parsed otherwise)
+        manifest = None if follow else LoadManifest(folder, make=False)
+        if manifest is not None and manifest.XGrid is not None and manifest.ZGrid is not None:
+            self.XGrid = manifest.XGrid.tolist()
+        else:
+            manifest = None
+            with open(f"{folder}/XGrid.txt") as f:
+                grid = f.read().rstrip().split(" ")
+                self.XGrid = [float(each) for each in grid]
+        self.Length_x_bin = len(self.XGrid)
+        self.N_x_bin = self.Length_x_bin - 1
+
+        # If the setup is still being calculated, the z grid is growing; then
+        # it's going to be read step by step, starting from an empty one
+        self.follow = follow
+        self._ZGridOffset = 0
+
+        if follow:
+            self.ZGrid = []
+            self.Length_z_bin = 0
+            self.N_z_bin = 0
+        else:
+            if manifest is not None:
+                self.ZGrid = manifest.ZGrid.tolist()
+            else:
+                with open(f"{folder}/ZGrid.txt") as f:
+                    grid = f.read().rstrip().split(" ")
+                    self.ZGrid = [float(each) for each in grid]
             self.Length_z_bin = len(self.ZGrid)
             self.N_z_bin = self.Length_z_bin - 1
 
@@ -82,6 +241,11 @@ class Data:
         self.XGrid_displayed = self.XGrid[::self.periodN_x]
         self.ZGrid_displayed = self.ZGrid[::self.periodN_z]
 
+        # While following a setup, none of the lines is known yet
+        if follow:
+            self.Length_z_displayed = 0
+            self._Statistics = Statistics(0)
+
     # Access to the solution grids of probabilities
     @property
     def Probabilities(self):
@@ -97,51 +261,117 @@ class Data:
         else:
             return self._Averages
 
+    @property
+    def Statistics(self):
+        if not self.loadedStatistics:
+            raise RuntimeError(f"The statistics haven't been evaluated yet at {str(self)}.")
+        else:
+            return self._Statistics
+
+    @property
+    def Spectrum(self):
+        if not self.loadedSpectrum:
+            raise RuntimeError(f"The spectrum hasn't been evaluated yet at {str(self)}.")
+        else:
+            return self._Spectrum
+
+    @property
+    def Views(self):
+        if not self.mapped:
+            raise RuntimeError(f"The binaries haven't been mapped yet at {str(self)}.")
+        else:
+            return self._Views
+
+    # Open both binaries as memory maps; each of the eight flavour/beam fields
+    # is then exposed as a strided (Length_z_displayed, Length_x_displayed) view,
+    # so the periods are applied without copying anything, and the reading itself
+    # is left to the page cache
+    def Map(self):
+        for ibeam, beam in enumerate(["left", "right"]):
+            binary = np.memmap(f"{self.folder}/bin/{beam}.bin", dtype=np.float64, mode="r",
+                               shape=(self.Length_z_bin, self.Length_x_bin, 4))
+            for f in range(4):
+                self._Views[4*ibeam + f] = binary[::self.periodN_z, ::self.periodN_x, f]
+
+        # Toggle the flag that the binaries are mapped at this instance
+        self.mapped = True
+
+    # A generator yielding the solution by blocks of lines; each block is an array
+    # of the shape (8, rows, Length_x_displayed), where the first axis goes over
+    # the flavours of the left beam and then of the right one; start and stop are
+    # the (displayed) indices of the first line and of the line after the last one
+    def blocks(self, rows=None, start=0, stop=None):
+        rows = self.chunkRows if rows is None else rows
+        stop = self.Length_z_displayed if stop is None else stop
+
+        if rows < 1:
+            raise ValueError(f"Number of rows in a block must be positive ({rows} given)")
+
+        # With the memory maps the blocks are merely gathered from the views
+        if self.mmap:
+            if not self.mapped: self.Map()
+            for iz in range(start, stop, rows):
+                yield np.stack([view[iz:min(iz+rows, stop)] for view in self.Views])
+            return
+
+        # The size of a whole saved line of the grid (in bytes)
+        rowsize = self.Length_x_bin*4*SIZE_FLOAT
+
+        # Preallocated buffers which the lines are read into; the lines
+        # from both of the files are read simultaneously, block by block
+        bufl = np.empty((rows, self.Length_x_bin, 4), np.float64)
+        bufr = np.empty((rows, self.Length_x_bin, 4), np.float64)
+
+        # Reads n lines into a buffer; if the period along z is trivial, the lines
+        # go one after another, so a single readinto is enough for the whole block
+        def read(f, buf, iz, n):
+            if self.periodN_z == 1:
+                parts = [(iz*rowsize, buf[:n])]
+            else:
+                parts = [((iz + k)*self.periodN_z*rowsize, buf[k]) for k in range(n)]
+            for offset, part in parts:
+                f.seek(offset)
+                if f.readinto(part) != part.nbytes:
+                    raise EOFError(f"Unexpected end of {f.name} at the offset {offset}")
+
+        with open(f"{self.folder}/bin/left.bin", "rb", buffering=0) as fl, \
+             open(f"{self.folder}/bin/right.bin", "rb", buffering=0) as fr:
+            for iz in range(start, stop, rows):
+                n = min(rows, stop - iz)
+                read(fl, bufl, iz, n)
+                read(fr, bufr, iz, n)
+                # The subsampling along x is done at once over the whole block
+                block = np.empty((8, n, self.Length_x_displayed), np.float64)
+                block[:4] = bufl[:n, ::self.periodN_x, :].transpose(2, 0, 1)
+                block[4:] = bufr[:n, ::self.periodN_x, :].transpose(2, 0, 1)
+                yield block
+
     # Same special function that actually is a generator
     # yielding the lines of solution one-by-one
-    def lines(self):
-        # Here we are going to directly save only the needed entries from the binaries
-        fl = open(f"{self.folder}/bin/left.bin", "rb")
-        fr = open(f"{self.folder}/bin/right.bin", "rb")
-
-        # Offset from the beginning of each file where the desired entries are saved
-        def offset(iz_displayed, ix_displayed):
-            return ((iz_displayed*self.periodN_z)*self.Length_x_bin + ix_displayed*self.periodN_x)*4*SIZE_FLOAT
-
-        # And then let's pick out exactly the desired values
-        for iz in range(self.Length_z_displayed):
-            line = [np.empty(self.Length_x_displayed, np.float64) for i in range(8)]
-
-            # Evaluate the elements of the line
-            for ix in range(self.Length_x_displayed):
-                # Move to the needed entry
-                fl.seek(offset(iz, ix))
-                fr.seek(offset(iz, ix))
-                # Read at each file 4 floats containing the probabilities of each of the
-                # 4 floavours (in total: 8 floats) and let's unpack then simultaneously
-                probsl = struct.unpack("dddd", fl.read(4*SIZE_FLOAT))
-                probsr = struct.unpack("dddd", fr.read(4*SIZE_FLOAT))
-                probs = probsl + probsr
-                # And finally, let's save them in the matrices
-                for i in range(8):
-                    line[i][ix] = probs[i]
-
-            # Finally, return this part of the solution
-            yield line
-        
-        fl.close()
-        fr.close()
+    def lines(self, rows=None):
+        for block in self.blocks(rows):
+            for line in block.transpose(1, 0, 2):
+                yield line
 
     # Load the data contained in the binaries left.bin and right.bin
     def LoadBin(self):
+        # The memory mapped views already are the matrices of probabilities
+        if self.mmap:
+            if not self.mapped: self.Map()
+            self._Probabilities = self.Views
+            self.loadedBin = True
+            return
+
         # Firsly, let's initialize the empty matrices
         for i in range(8):
             self._Probabilities[i] = np.empty((self.Length_z_displayed, self.Length_x_displayed), np.float64)
 
-        # Let's use the generator for reading the binaries line by line
-        for iline, line in enumerate(self.lines()):
+        # Let's use the generator for reading the binaries block by block
+        iline = 0
+        for block in self.blocks():
             for i in range(8):
-                self._Probabilities[i][iline] = line[i]
+                self._Probabilities[i][iline:iline+block.shape[1]] = block[i]
+            iline += block.shape[1]
 
         # Toggle the flag that the binaries are loaded at this instance
         self.loadedBin = True
@@ -149,7 +379,7 @@ class Data:
     # Evaluate the average probabilities (dependent on the z coordinate)
     def EvaluateAverages(self):
         # Evaluate the averages
-        self._Averages = [[sum(line)/len(line) for line in sol] for sol in self.Probabilities]
+        self._Averages = [np.mean(sol, axis=1) for sol in self.Probabilities]
         # And toggle the flag that the average probabilities have been evaluated
         self.loadedAverages = True
 
@@ -178,17 +408,406 @@ class Data:
     # The method that reads in a lazy way the binary data  line by line an evaluates
     # for each line the average probabilities
     def LazyEvaluateAverages(self):
+        # The views are reduced directly, that touches the pages of the
+        # maps only once and never holds the whole binaries in RAM
+        if self.mmap:
+            if not self.mapped: self.Map()
+            self._Averages = [np.mean(view, axis=1) for view in self.Views]
+            self.loadedAverages = True
+            return
+
         # Allocate the empty matrices
         self._Averages = [np.empty(self.Length_z_displayed, np.float64) for i in range(8)]
 
-        # Read the lines and save the average probabilities
-        for iline, line in enumerate(self.lines()):
+        # Read the blocks and save the average probabilities
+        iline = 0
+        for block in self.blocks():
             for i in range(8):
-                self._Averages[i][iline] = sum(line[i]) / len(line[i])
+                self._Averages[i][iline:iline+block.shape[1]] = np.mean(block[i], axis=1)
+            iline += block.shape[1]
 
         # And toggle flag that now we possess the averages probabilities
         self.loadedAverages = True
 
+    # Blocks of lines to be reduced: if the binaries have already been loaded,
+    # there's no need to read them again
+    def _source(self, rows=None):
+        if self.loadedBin:
+            rows = self.chunkRows if rows is None else rows
+            return (np.stack([sol[iz:iz+rows] for sol in self.Probabilities])
+                    for iz in range(0, self.Length_z_displayed, rows))
+        return self.blocks(rows)
+
+    # Evaluate all the summaries of the lines (mean, variance, min, max, symmetric
+    # mean and nu/nubar ratio) reading the binaries only once, block by block;
+    # the averages are obtained on the way as well
+    def EvaluateStatistics(self, rows=None):
+        self._Statistics = Statistics(self.Length_z_displayed)
+
+        iline = 0
+        for block in self._source(rows):
+            self._Statistics.update(iline, block)
+            iline += block.shape[1]
+
+        self._Averages = list(self._Statistics.mean)
+        self.loadedStatistics = True
+        self.loadedAverages = True
+
+    # The header of the cache of statistics; it identifies the binaries (and the z grid)
+    # the statistics have been evaluated from, as well as the periods used
+    def CacheHeader(self):
+        return {"version": CACHE_VERSION,
+                "periodN_x": self.periodN_x,
+                "periodN_z": self.periodN_z,
+                "files": sourceStamps(self.folder)}
+
+    # Dump the summaries of the lines into the cache averages/stats.npz
+    def DumpStatistics(self):
+        averagesfolder = f"{self.folder}/averages"
+        if not os.path.isdir(averagesfolder):
+            os.mkdir(averagesfolder)
+
+        np.savez(f"{averagesfolder}/{CACHE_FILE}", header=np.array(json.dumps(self.CacheHeader())),
+                 ZGrid=np.array(self.ZGrid_displayed),
+                 **{field: getattr(self.Statistics, field) for field in Statistics.fields})
+
+    # Load the summaries of the lines from the cache, provided that it's not stale,
+    # i.e. the binaries haven't changed since and the periods are the same;
+    # returns whether the statistics have been loaded
+    def LoadStatistics(self):
+        cached = loadCache(self.folder, self.periodN_x, self.periodN_z)
+        if cached is None:
+            return False
+
+        self._Statistics = cached
+        self._Averages = list(cached.mean)
+        self.loadedStatistics = True
+        self.loadedAverages = True
+        return True
+
+    # Obtain the statistics through the cache: they are loaded if the cache is fresh,
+    # otherwise they are evaluated and the cache is re-written
+    def CachedStatistics(self, rows=None):
+        if not self.LoadStatistics():
+            self.EvaluateStatistics(rows)
+            self.DumpStatistics()
+        return self.Statistics
+
+    # Evaluate the power spectra along x of all the displayed lines in a single pass,
+    # transforming whole blocks of lines at once
+    def EvaluateSpectrum(self, rows=None):
+        self._Spectrum = Spectrum(self.Length_z_displayed, self.N_x_displayed, self.XGrid[-1] - self.XGrid[0])
+
+        iline = 0
+        for block in self._source(rows):
+            self._Spectrum.update(iline, block)
+            iline += block.shape[1]
+
+        self.loadedSpectrum = True
+
+    # Dump the spectra into averages/spectrum.npz
+    def DumpSpectrum(self):
+        averagesfolder = f"{self.folder}/averages"
+        if not os.path.isdir(averagesfolder):
+            os.mkdir(averagesfolder)
+
+        np.savez(f"{averagesfolder}/{SPECTRUM_FILE}", header=np.array(json.dumps(self.CacheHeader())),
+                 ZGrid=np.array(self.ZGrid_displayed), q=self.Spectrum.q,
+                 power=self.Spectrum.power, dominant=self.Spectrum.dominant)
+
+    # Read the points appended to ZGrid.txt since the previous call; only the
+    # complete ones are taken (each point is followed by a separator)
+    def _readNewZ(self):
+        with open(f"{self.folder}/ZGrid.txt", "rb") as f:
+            f.seek(self._ZGridOffset)
+            text = f.read()
+        complete = text[:text.rfind(b" ") + 1]
+        self._ZGridOffset += len(complete)
+        return [float(each) for each in complete.split()]
+
+    # Take into account the lines that have been completely written since the
+    # previous call (and summarise them); returns the number of the new lines
+    def _grow(self, rows=None):
+        self.ZGrid += self._readNewZ()
+
+        # A line is complete if it's fully written to both of the binaries
+        # and its position has been appended to the z grid; the partially
+        # written last line is left for the next call
+        rowsize = self.Length_x_bin*4*SIZE_FLOAT
+        written = min(os.path.getsize(f"{self.folder}/bin/{beam}.bin") for beam in ["left", "right"]) // rowsize
+        Length_z_bin = min(len(self.ZGrid), written)
+        Length_z_displayed = (Length_z_bin + self.periodN_z - 1) // self.periodN_z
+
+        previous = self.Length_z_displayed
+        if Length_z_displayed == previous:
+            return 0
+
+        # Update the dimensions along z
+        self.Length_z_bin = Length_z_bin
+        self.N_z_bin = Length_z_bin - 1
+        self.Length_z_displayed = Length_z_displayed
+        self.N_z_displayed = Length_z_displayed - 1
+        self.ZGrid_displayed = self.ZGrid[:Length_z_bin:self.periodN_z]
+
+        # The maps have to cover the new lines as well
+        if self.mmap: self.Map()
+
+        # And finally, summarise only the new lines
+        self._Statistics.resize(Length_z_displayed)
+        iline = previous
+        for block in self.blocks(rows, start=previous):
+            self._Statistics.update(iline, block)
+            iline += block.shape[1]
+
+        self._Averages = list(self._Statistics.mean)
+        self.loadedStatistics = True
+        self.loadedAverages = True
+
+        return Length_z_displayed - previous
+
+    # A generator following a setup that is still being calculated by nssi; it checks the
+    # files every interval seconds and yields the number of the new lines, as soon as they
+    # are summarised (the statistics and averages are updated incrementally); it stops after
+    # timeout seconds without any new lines (or never, if timeout is None)
+    def Follow(self, interval=10.0, timeout=None, rows=None):
+        if not self.follow:
+            raise RuntimeError(f"Following hasn't been requested at {str(self)}.")
+
+        idle = 0.0
+        while True:
+            new = self._grow(rows)
+            if new:
+                idle = 0.0
+                yield new
+            elif timeout is not None and idle >= timeout:
+                return
+            else:
+                time.sleep(interval)
+                idle += interval
+
+    # Indices [i0, i1) of the points of a displayed grid lying within [lo, hi]
+    @staticmethod
+    def _indices(grid, lims, axis):
+        i0 = int(np.searchsorted(grid, lims[0], side="left"))
+        i1 = int(np.searchsorted(grid, lims[1], side="right"))
+        if i0 >= i1:
+            raise ValueError(f"No points of the {axis} grid found within [{lims[0]}, {lims[1]}]")
+        return i0, i1
+
+    # Checks the beams and flavours picked out and returns the corresponding beam indices
+    @staticmethod
+    def _beams(flavours, beams):
+        if any(f not in range(4) for f in flavours):
+            raise ValueError(f"Flavours must be picked out from 0..3 ({list(flavours)} given)")
+        if any(beam not in BEAMS for beam in beams):
+            raise ValueError(f"Beams must be picked out from {BEAMS} ({list(beams)} given)")
+        return [BEAMS.index(beam) for beam in beams]
+
+    # Returns the probabilities in the window x_range x z_range (both in km) of the displayed grid,
+    # as an array of the shape (len(beams), len(flavours), Nz, Nx), alongside the points of the grids
+    # in the window; only the bytes of the window are read (one read per line of the window)
+    def region(self, x_range, z_range, flavours=(0, 1, 2, 3), beams=BEAMS):
+        ibeams = self._beams(flavours, beams)
+        ix0, ix1 = self._indices(self.XGrid_displayed, x_range, "x")
+        iz0, iz1 = self._indices(self.ZGrid_displayed, z_range, "z")
+        values = np.empty((len(beams), len(flavours), iz1 - iz0, ix1 - ix0), np.float64)
+
+        if self.mmap:
+            if not self.mapped: self.Map()
+            for k, ibeam in enumerate(ibeams):
+                for n, f in enumerate(flavours):
+                    values[k, n] = self.Views[4*ibeam + f][iz0:iz1, ix0:ix1]
+            return self.XGrid_displayed[ix0:ix1], self.ZGrid_displayed[iz0:iz1], values
+
+        # Bytes covering the window in each line of the binaries
+        cols = (ix1 - ix0 - 1)*self.periodN_x + 1
+        buf = np.empty((iz1 - iz0, cols, 4), np.float64)
+
+        for k, ibeam in enumerate(ibeams):
+            with open(f"{self.folder}/bin/{BEAMS[ibeam]}.bin", "rb", buffering=0) as f:
+                for iz in range(iz0, iz1):
+                    offset = (iz*self.periodN_z*self.Length_x_bin + ix0*self.periodN_x)*4*SIZE_FLOAT
+                    f.seek(offset)
+                    if f.readinto(buf[iz - iz0]) != buf[iz - iz0].nbytes:
+                        raise EOFError(f"Unexpected end of {f.name} at the offset {offset}")
+            values[k] = buf[:, ::self.periodN_x, list(flavours)].transpose(2, 0, 1)
+
+        return self.XGrid_displayed[ix0:ix1], self.ZGrid_displayed[iz0:iz1], values
+
+    # Returns the probabilities along the whole z axis at the columns of the displayed grid nearest
+    # to x_positions (in km), as an array of the shape (len(beams), len(flavours), Length_z, len(x_positions)),
+    # alongside the positions of these columns; the offsets of all the entries are sorted and the entries
+    # lying closer than maxGap bytes to each other are read at once
+    def probes(self, x_positions, flavours=(0, 1, 2, 3), beams=BEAMS, maxGap=4096):
+        ibeams = self._beams(flavours, beams)
+        grid = np.array(self.XGrid_displayed)
+        positions = np.atleast_1d(np.asarray(x_positions, np.float64))
+
+        # Nearest columns of the displayed grid
+        right = np.clip(np.searchsorted(grid, positions), 1, len(grid) - 1)
+        nearest = np.where(positions - grid[right - 1] <= grid[right] - positions, right - 1, right)
+        columns, inverse = np.unique(nearest, return_inverse=True)
+
+        values = np.empty((len(beams), len(flavours), self.Length_z_displayed, len(columns)), np.float64)
+
+        if self.mmap:
+            if not self.mapped: self.Map()
+            for k, ibeam in enumerate(ibeams):
+                for n, f in enumerate(flavours):
+                    values[k, n] = self.Views[4*ibeam + f][:, columns]
+            return grid[nearest], values[..., inverse]
+
+        # Offsets of the entries (row by row, the columns are sorted, so the offsets are sorted as well)
+        rows = np.arange(self.Length_z_displayed)*self.periodN_z*self.Length_x_bin
+        offsets = ((rows[:, None] + columns[None, :]*self.periodN_x)*4*SIZE_FLOAT).ravel()
+
+        # Batches of the entries that are read at once
+        entry = 4*SIZE_FLOAT
+        batches = np.split(np.arange(len(offsets)), np.nonzero(np.diff(offsets) > maxGap)[0] + 1)
+
+        for k, ibeam in enumerate(ibeams):
+            entries = np.empty((len(offsets), 4), np.float64)
+            with open(f"{self.folder}/bin/{BEAMS[ibeam]}.bin", "rb", buffering=0) as f:
+                for batch in batches:
+                    start, end = offsets[batch[0]], offsets[batch[-1]] + entry
+                    f.seek(start)
+                    chunk = f.read(end - start)
+                    if len(chunk) != end - start:
+                        raise EOFError(f"Unexpected end of {f.name} at the offset {start}")
+                    floats = np.frombuffer(chunk, np.float64)
+                    entries[batch] = floats[((offsets[batch] - start)//SIZE_FLOAT)[:, None] + np.arange(4)]
+            entries = entries.reshape(self.Length_z_displayed, len(columns), 4)
+            values[k] = entries[:, :, list(flavours)].transpose(2, 0, 1)
+
+        return grid[nearest], values[..., inverse]
+
+    # Re-pack the (displayed) data into a store of 2D tiles of the shape (tileRows, tileCols),
+    # each of which is compressed separately and saved at tiles/tiles.bin; the index of the tiles
+    # alongside the minimal, maximal and mean values in each of them is saved at tiles/index.npz.
+    # The conversion is done in a single pass over the binaries, by blocks of tileRows lines.
+    def Tile(self, tileRows=256, tileCols=256, codec="zlib", level=6):
+        if codec not in codecs:
+            raise ValueError(f"Unknown codec '{codec}' (possible ones are {', '.join(codecs)})")
+        compress = codecs[codec][0]
+
+        tilesfolder = f"{self.folder}/tiles"
+        if not os.path.isdir(tilesfolder):
+            os.mkdir(tilesfolder)
+
+        # Number of the tiles along each of the axes
+        Nz = (self.Length_z_displayed + tileRows - 1) // tileRows
+        Nx = (self.Length_x_displayed + tileCols - 1) // tileCols
+
+        offsets = np.empty((Nz, Nx), np.int64)
+        sizes   = np.empty((Nz, Nx), np.int64)
+        mins    = np.empty((8, Nz, Nx), np.float64)
+        maxs    = np.empty((8, Nz, Nx), np.float64)
+        means   = np.empty((8, Nz, Nx), np.float64)
+
+        offset = 0
+        with open(f"{tilesfolder}/tiles.bin", "wb") as f:
+            for iz, block in enumerate(self.blocks(tileRows)):
+                for ix in range(Nx):
+                    tile = np.ascontiguousarray(block[:, :, ix*tileCols:(ix+1)*tileCols])
+                    mins[:, iz, ix]  = np.min(tile, axis=(1, 2))
+                    maxs[:, iz, ix]  = np.max(tile, axis=(1, 2))
+                    means[:, iz, ix] = np.mean(tile, axis=(1, 2))
+
+                    compressed = compress(tile.tobytes(), level)
+                    f.write(compressed)
+                    offsets[iz, ix] = offset
+                    sizes[iz, ix] = len(compressed)
+                    offset += len(compressed)
+
+        header = {"codec": codec, "tileRows": tileRows, "tileCols": tileCols,
+                  "periodN_x": self.periodN_x, "periodN_z": self.periodN_z}
+        np.savez(f"{tilesfolder}/index.npz", header=np.array(json.dumps(header)),
+                 XGrid=np.array(self.XGrid_displayed), ZGrid=np.array(self.ZGrid_displayed),
+                 offsets=offsets, sizes=sizes, min=mins, max=maxs, mean=means)
+
+class Tiles:
+    """ Reading the tiled stores made by Data.Tile """
+
+    def __init__(self, folder, cachedTiles=64):
+        self.folder = folder.rstrip('/')
+
+        if not os.path.isfile(f"{self.folder}/tiles/index.npz"):
+            raise FileNotFoundError(f"No tiled store found at {self.folder}/tiles")
+
+        with np.load(f"{self.folder}/tiles/index.npz") as index:
+            header = json.loads(str(index["header"]))
+            self.XGrid   = index["XGrid"]
+            self.ZGrid   = index["ZGrid"]
+            self.offsets = index["offsets"]
+            self.sizes   = index["sizes"]
+            # Per-tile summaries, of the shape (8, number of tiles along z, along x)
+            self.min  = index["min"]
+            self.max  = index["max"]
+            self.mean = index["mean"]
+
+        self.codec    = header["codec"]
+        self.tileRows = header["tileRows"]
+        self.tileCols = header["tileCols"]
+        self.periodN_x = header["periodN_x"]
+        self.periodN_z = header["periodN_z"]
+
+        self.Length_x = len(self.XGrid)
+        self.Length_z = len(self.ZGrid)
+
+        # The decompressed tiles that have been recently used are kept in memory
+        self.tile = lru_cache(maxsize=cachedTiles)(self._tile)
+
+    # Read and decompress the tile at the position (iz, ix) in the grid of tiles
+    def _tile(self, iz, ix):
+        with open(f"{self.folder}/tiles/tiles.bin", "rb") as f:
+            f.seek(self.offsets[iz, ix])
+            compressed = f.read(self.sizes[iz, ix])
+        rows = min(self.tileRows, self.Length_z - iz*self.tileRows)
+        cols = min(self.tileCols, self.Length_x - ix*self.tileCols)
+        return np.frombuffer(codecs[self.codec][1](compressed), np.float64).reshape(8, rows, cols)
+
+    # Returns all 8 fields in the rectangular region [z0, z1) x [x0, x1) (in the indices
+    # of the grid), as an array of the shape (8, z1-z0, x1-x0); only the tiles
+    # overlapping with the region are read
+    def region(self, z0, z1, x0, x1):
+        if not (0 <= z0 < z1 <= self.Length_z and 0 <= x0 < x1 <= self.Length_x):
+            raise IndexError(f"Region [{z0},{z1})x[{x0},{x1}) is out of the grid {self.Length_z}x{self.Length_x}")
+
+        result = np.empty((8, z1 - z0, x1 - x0), np.float64)
+        for iz in range(z0 // self.tileRows, (z1 - 1) // self.tileRows + 1):
+            for ix in range(x0 // self.tileCols, (x1 - 1) // self.tileCols + 1):
+                # Intersection of the tile with the region (in the indices of the grid)
+                tz0, tz1 = max(z0, iz*self.tileRows), min(z1, (iz + 1)*self.tileRows)
+                tx0, tx1 = max(x0, ix*self.tileCols), min(x1, (ix + 1)*self.tileCols)
+                result[:, tz0-z0:tz1-z0, tx0-x0:tx1-x0] = \
+                    self.tile(iz, ix)[:, tz0-iz*self.tileRows:tz1-iz*self.tileRows, tx0-ix*self.tileCols:tx1-ix*self.tileCols]
+        return result
+
+    # A line at fixed z, of the shape (8, Length_x)
+    def row(self, iz):
+        return self.region(iz, iz + 1, 0, self.Length_x)[:, 0, :]
+
+    # A column at fixed x, of the shape (8, Length_z)
+    def column(self, ix):
+        return self.region(0, self.Length_z, ix, ix + 1)[:, :, 0]
+
+    # Coarse summary (minimal, maximal and mean values of each of the 8 fields) over the tiles
+    # overlapping with the region [z0, z1) x [x0, x1), the whole grid by default; it's evaluated
+    # from the metadata only, without decompressing anything
+    def summary(self, z0=0, z1=None, x0=0, x1=None):
+        z1 = self.Length_z if z1 is None else z1
+        x1 = self.Length_x if x1 is None else x1
+        tz = slice(z0 // self.tileRows, (z1 - 1) // self.tileRows + 1)
+        tx = slice(x0 // self.tileCols, (x1 - 1) // self.tileCols + 1)
+
+        # Means of the tiles are weighted with the number of points in them
+        rows = np.minimum(self.tileRows, self.Length_z - self.tileRows*np.arange(self.offsets.shape[0]))[tz]
+        cols = np.minimum(self.tileCols, self.Length_x - self.tileCols*np.arange(self.offsets.shape[1]))[tx]
+        weights = np.outer(rows, cols)
+        mean = np.sum(self.mean[:, tz, tx]*weights, axis=(1, 2)) / np.sum(weights)
+
+        return np.min(self.min[:, tz, tx], axis=(1, 2)), np.max(self.max[:, tz, tx], axis=(1, 2)), mean
+
 if __name__ == "__main__":
     data = Data("build/Data/NSSI NLM Mon Aug  2 14:18:26 2021/", periodN_x=1)
     #data.EvaluateAverages()
@@ -197,4 +816,4 @@ if __name__ == "__main__":
     #data.DumpAverages()
     #print(data[0])
     data.LazyEvaluateAverages()
-    print(data.Averages[0])
\ No newline at end of file
+    print(data.Averages[0])
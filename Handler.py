@@ -3,8 +3,9 @@
 import numpy as np
 import os, sys, json, argparse
 
-from Data import Data
-from Modules import FourPlots1D, OnePlot2D_EPS
+from Data import Data, CHUNK_ROWS
+from Pyramid import LoadPyramid
+from Modules import FourPlots1D, OnePlot2D_EPS, PlotSpectrogram
 
 # The labels that are connected to the solution curves and 2d-plots
 legendlabels = [r"$\nu_e$", r"$\nu_x$", r"$\bar{\nu}_e$", r"$\bar{\nu}_x$"]
@@ -32,7 +33,32 @@ help_periodN_z = "Same as --periodN_x, but along z axis."
 help_noplots = "If it is set, it guides the script to omit the stage of loading the whole binaries"\
                "to the RAM and, hence, omit drawing two-dimensional plots. Instead, only the averages probabilities"\
                "will be evaulated, in a 'lazy' way, i.e. the script reads binaries line-by-line, saving just the average"\
-               "values."
+               "values (alongside the other summaries of the lines, saved at averages/stats.npz)."
+
+help_mmap = "If it is set, the binaries are opened as memory maps and the probabilities are read "\
+            "through strided views on them (taking into account the periods), without copying them "\
+            "into the RAM; the I/O is then left to the page cache of the OS."
+
+help_chunkRows = "Number of the (displayed) lines of the grid that are read from the binaries at once. "\
+                 "Bigger blocks mean fewer, but larger, reads."
+
+help_follow = "If it is set, the script follows a setup that is still being calculated by nssi: "\
+              "it periodically checks the binaries and updates the average probabilities (and their "\
+              "plots) as soon as new complete lines are written; the partially written last line is "\
+              "skipped until it's complete. Stop it with Ctrl+C; the averages are dumped then."
+
+help_interval = "In the --follow mode, specifies the period (in seconds) of checking the binaries."
+
+help_timeout = "In the --follow mode, the script stops after this number of seconds without new lines."
+
+help_pixels = "If it is set, the two-dimensional plots are drawn from the level of the multi-resolution "\
+              "pyramid of the setup (block-averaged fields) with the dimensions closest to PIXELS x PIXELS, "\
+              "instead of loading the whole binaries; the pyramid is built (in a single pass) if it's "\
+              "missing or stale. The periods are not needed then."
+
+help_spectrum = "If it is set, the power spectra along x of all the lines are evaluated in a single pass "\
+                "(the lines are periodic), saved at averages/spectrum.npz together with the dominant "\
+                "wavenumber at each z, and plotted as spectrograms (the zeroth harmonic excluded)."
 
 if __name__ == "__main__":
     # A little bit of parsing command line arguments, including auto generated help page
@@ -41,6 +67,13 @@ if __name__ == "__main__":
     parser.add_argument("--periodN_x", default=1, help=help_periodN_x, type=int)
     parser.add_argument("--periodN_z", default=1, help=help_periodN_z, type=int)
     parser.add_argument("--noplots", action='store_true', help=help_noplots)
+    parser.add_argument("--mmap", action='store_true', help=help_mmap)
+    parser.add_argument("--chunkRows", default=CHUNK_ROWS, help=help_chunkRows, type=int)
+    parser.add_argument("--follow", action='store_true', help=help_follow)
+    parser.add_argument("--pixels", default=None, help=help_pixels, type=int)
+    parser.add_argument("--interval", default=10.0, help=help_interval, type=float)
+    parser.add_argument("--timeout", default=None, help=help_timeout, type=float)
+    parser.add_argument("--spectrum", action='store_true', help=help_spectrum)
     args = parser.parse_args()
     
     # The arguments themselves
@@ -48,13 +81,49 @@ if __name__ == "__main__":
     periodN_x = args.periodN_x
     periodN_z = args.periodN_z
     noplots   = args.noplots
+    mmap      = args.mmap
+    chunkRows = args.chunkRows
+    follow    = args.follow
+
+    """ Section: follow a setup that is still being calculated """
+
+    if follow:
+        data = Data(folder=dir, periodN_x=periodN_x, periodN_z=periodN_z, mmap=mmap, chunkRows=chunkRows, follow=True)
+        if not os.path.isdir(f"{dir}/plots"): os.mkdir(f"{dir}/plots")
+
+        try:
+            for new in data.Follow(interval=args.interval, timeout=args.timeout):
+                # Report the averages at the last known line
+                symm = data.Statistics.symm[:, -1]
+                print(f"z = {data.ZGrid_displayed[-1]} km ({new} new lines): " +
+                      ", ".join(f"{label} {value:.4f}" for label, value in zip(filelabels, symm)) +
+                      f", nu/nubar {data.Statistics.nunubar[-1]:.4f}")
+                # And re-draw the plots of averages
+                if data.Length_z_displayed > 1:
+                    FourPlots1D(data.ZGrid_displayed, data.Averages[:4], f"{dir}/plots/avsL.eps", legendlabels)
+                    FourPlots1D(data.ZGrid_displayed, data.Averages[4:], f"{dir}/plots/avsR.eps", legendlabels)
+        except KeyboardInterrupt:
+            print("Following has been stopped.")
+
+        if data.loadedStatistics:
+            data.DumpAverages()
+            data.DumpStatistics()
+        sys.exit(0)
 
     # The main object that handles the files put in the setup folder
-    data = Data(folder=dir, periodN_x=periodN_x, periodN_z=periodN_z)
+    data = Data(folder=dir, periodN_x=periodN_x, periodN_z=periodN_z, mmap=mmap, chunkRows=chunkRows)
 
     """ Section: draw the plots """
 
-    if not noplots:
+    if not noplots and args.pixels:
+        # The plots are drawn from the closest level of the pyramid
+        level = LoadPyramid(dir, mmap=mmap).closest(args.pixels, args.pixels)
+        if not os.path.isdir(f"{dir}/plots"): os.mkdir(f"{dir}/plots")
+        filenames = [f"{each}L.eps" for each in filelabels] + [f"{each}R.eps" for each in filelabels]
+        for i in range(8):
+            OnePlot2D_EPS(level.XGrid, level.ZGrid, level.mean[i], f"{dir}/plots/{filenames[i]}")
+
+    elif not noplots:
         # Firsly, let's load the binaries
         data.LoadBin()
         # Make a directory of plots if it doesn't exist
@@ -66,14 +135,22 @@ if __name__ == "__main__":
 
     """ Section: cook the average probabilities, save them and plot """
 
-    # Firsly, let's obtain these average values; and in case we haven't loaded the binaries
-    # let's use 'lazy' generator
-    if noplots: data.LazyEvaluateAverages()
-    else:       data.EvaluateAverages()
+    # Firsly, let's obtain these average values; they are read through the cache of
+    # statistics, and if it's stale, in case we haven't loaded the binaries,
+    # they are evaluated in a 'lazy' way
+    data.CachedStatistics()
 
     # Then, let's dump these values
     data.DumpAverages()
     # And finally, make the plots
     FourPlots1D(data.ZGrid_displayed, data.Averages[:4], f"{dir}/plots/avsL.eps", legendlabels)
     FourPlots1D(data.ZGrid_displayed, data.Averages[4:], f"{dir}/plots/avsR.eps", legendlabels)
-    
\ No newline at end of file
+
+    """ Section: the spectra of the lines along x """
+
+    if args.spectrum:
+        data.EvaluateSpectrum()
+        data.DumpSpectrum()
+        filenames = [f"spectrum{each}L.eps" for each in filelabels] + [f"spectrum{each}R.eps" for each in filelabels]
+        for i in range(8):
+            PlotSpectrogram(data.Spectrum.q[1:], data.ZGrid_displayed, data.Spectrum.power[i, :, 1:], f"{dir}/plots/{filenames[i]}")
@@ -102,27 +102,31 @@ flavourSigma3 = np.diag([1.0, -1.0, 1.0, -1.0])
 G = np.diag([1.0, 1.0, -1.0, -1.0])
 
 
+# Masks of the diagonal and the offdiagonal blocks
+su4DiagMask = np.array([[1.0, 1.0, 0.0, 0.0],
+						[1.0, 1.0, 0.0, 0.0],
+						[0.0, 0.0, 1.0, 1.0],
+						[0.0, 0.0, 1.0, 1.0]])
+su4OffdiagMask = 1.0 - su4DiagMask
+
+# Permutation of the flavours standing in the charge conjugation
+su4Conjugation = [2, 3, 0, 1]
+
+# Note: the functions below act on single matrices as well as on the stacks of them
+# (arrays of the shape (..., 4, 4))
+
 # Returns the diagonal blocks
 def su4Diag(m):
-	return np.array([[m[0,0], m[0,1], 0.0,    0.0   ],
-					 [m[1,0], m[1,1], 0.0,    0.0   ],
-					 [0.0,    0.0,    m[2,2], m[2,3]],
-					 [0.0,    0.0,    m[3,2], m[3,3]]])
+	return m * su4DiagMask
 
 # Returns the offdiagonal blocks
 def su4Offdiag(m):
-	return np.array([[0.0,     0.0,   m[0,2], m[0,3]],
-					 [0.0,     0.0,   m[1,2], m[1,3]],
-					 [m[2,0], m[2,1], 0.0,    0.0   ],
-					 [m[3,0], m[3,1], 0.0,    0.0   ]])
+	return m * su4OffdiagMask
 
 # Evaluate the round matrix
 def su4Round(m):
-	# The matrix that corresponds to (rho^C)^T
-	mCT = np.array([[m[2,2], m[3,2], m[0,2], m[1,2]],
-		            [m[2,3], m[3,3], m[0,3], m[1,3]],
-		            [m[2,0], m[3,0], m[0,0], m[1,0]],
-		            [m[2,1], m[3,1], m[0,1], m[1,1]]])
+	# The matrix that corresponds to (rho^C)^T, i.e. mCT[a,b] = m[c(b),c(a)]
+	mCT = np.swapaxes(m[..., su4Conjugation, :][..., :, su4Conjugation], -1, -2)
 
 	return m - mCT
 
@@ -134,4 +138,33 @@ def com(a,b):
 def BiggestRealEigPart(m):
     # Eigenvalues
     eigs = np.linalg.eig(m)[0]
-    return np.max([np.real(e) for e in eigs])
\ No newline at end of file
+    return np.max([np.real(e) for e in eigs])
+
+# The basis as an array (15, 4, 4)
+su4BasisArray = np.array(su4Basis)
+
+# Evaluate the (stacks of the) matrices of the 15D vectors in the basis (..., 15) (the trace is zero)
+def su4ComposeTraceless(v):
+	return np.einsum("...k,kab->...ab", v, su4BasisArray)
+
+# The length of the 15D vector of a matrix, i.e. the Frobenius norm of its traceless part
+def su4Norm(m):
+	traceless = m - 0.25*np.trace(m, axis1=-2, axis2=-1)[..., None, None]*np.eye(4)
+	return np.sqrt(np.sum(np.abs(traceless)**2, axis=(-2, -1)))
+
+# Put the matrices back to the hermitian ones with the unit trace, and rescale their traceless parts to the given norms
+def su4Normalise(m, norms):
+	hermitian = 0.5*(m + np.conj(np.swapaxes(m, -1, -2)))
+	traceless = hermitian - 0.25*np.trace(hermitian, axis1=-2, axis2=-1)[..., None, None]*np.eye(4)
+	norm = su4Norm(traceless)
+	# (the zero traceless parts are left as they are)
+	scale = np.divide(norms, norm, out=np.ones_like(norm), where=norm != 0.0)
+	return traceless*scale[..., None, None] + 0.25*np.eye(4)
+
+# Replace the eigenvalues of the matrices m by the ones of pre, matched by their order; m is taken
+# by its hermitian part (the lines aren't hermitian exactly unless they are normalised, and eigh
+# would read only their lower triangles otherwise)
+def su4SetEigenvalues(m, pre):
+	values = np.linalg.eigvalsh(pre)
+	vectors = np.linalg.eigh(0.5*(m + np.conj(np.swapaxes(m, -1, -2))))[1]
+	return (vectors * values[..., None, :]) @ np.conj(np.swapaxes(vectors, -1, -2))
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import os, re, json, hashlib, argparse
+
+from Constants import Constants
+
+# The manifest of a setup is a small binary file (manifest.npz) in its folder, holding the grids,
+# their dimensions, the periods used while dumping, the key physical parameters and a hash of
+# the contents of the files it has been made of; the sizes and modification times of these files
+# are saved as well, so a stale manifest is noticed without reading them
+MANIFEST_FILE = "manifest.npz"
+MANIFEST_VERSION = 1
+
+# The files a manifest is made of (all of them are optional)
+SOURCES = ["XGrid.txt", "ZGrid.txt", "Parameters.json"]
+
+# Sizes and modification times of the sources (None for the missing ones)
+def manifestStamps(folder):
+    stamps = {}
+    for filename in SOURCES:
+        if os.path.isfile(f"{folder}/{filename}"):
+            stat = os.stat(f"{folder}/{filename}")
+            stamps[filename] = [stat.st_size, stat.st_mtime_ns]
+        else:
+            stamps[filename] = None
+    return stamps
+
+# Parse a grid dumped by nssi (the points are separated by spaces)
+def parseGrid(text):
+    return np.array([float(each) for each in text.split()], np.float64)
+
+class Manifest:
+    """ Everything needed to open a setup, read from its manifest """
+
+    # Key physical parameters saved in the manifests
+    parameters = ("eta", "muOverOmega", "gPlus", "chi")
+
+    def __init__(self, folder):
+        self.folder = folder.rstrip('/')
+        with np.load(f"{self.folder}/{MANIFEST_FILE}") as manifest:
+            header = json.loads(str(manifest["header"]))
+            self.XGrid = manifest["XGrid"] if header["XGrid"] else None
+            self.ZGrid = manifest["ZGrid"] if header["ZGrid"] else None
+
+        self.version = header["version"]
+        self.files   = header["files"]
+        self.hash    = header["hash"]
+        # Periods used by nssi while dumping (None, if they can't be figured out)
+        self.periodN_x = header["periodN_x"]
+        self.periodN_z = header["periodN_z"]
+        # Physical parameters as given by Constants (None, if there's no Parameters.json)
+        for key in self.parameters:
+            setattr(self, key, header[key])
+
+        self.Length_x_bin = None if self.XGrid is None else len(self.XGrid)
+        self.Length_z_bin = None if self.ZGrid is None else len(self.ZGrid)
+
+    # Whether the sources have been changed since the manifest was made
+    def stale(self):
+        return self.version != MANIFEST_VERSION or self.files != manifestStamps(self.folder)
+
+# Make the manifest of a setup out of its grids and Parameters.json
+def MakeManifest(folder):
+    folder = folder.rstrip('/')
+    stamps = manifestStamps(folder)
+    texts  = {}
+    for filename in SOURCES:
+        if stamps[filename] is not None:
+            with open(f"{folder}/{filename}") as f:
+                texts[filename] = f.read()
+
+    XGrid = parseGrid(texts["XGrid.txt"]) if "XGrid.txt" in texts else np.empty(0)
+    ZGrid = parseGrid(texts["ZGrid.txt"]) if "ZGrid.txt" in texts else np.empty(0)
+
+    header = {"version": MANIFEST_VERSION, "files": stamps,
+              "XGrid": "XGrid.txt" in texts, "ZGrid": "ZGrid.txt" in texts,
+              "hash": hashlib.sha256("\0".join(texts.get(each, "") for each in SOURCES).encode()).hexdigest(),
+              "periodN_x": None, "periodN_z": None}
+
+    if "Parameters.json" in texts:
+        c = Constants(f"{folder}/Parameters.json")
+        for key in Manifest.parameters:
+            header[key] = float(getattr(c, key))
+
+        # The periods are the ratios of the steps of the saved grids and the steps of the scheme
+        # (the grids are dumped in km)
+        scheme = json.loads(texts["Parameters.json"]).get("Scheme", {})
+        for axis, grid in [("x", XGrid), ("z", ZGrid)]:
+            N, L = f"N_{axis}", axis.upper()
+            if len(grid) > 1 and N in scheme and L in scheme and scheme[L][1] == "km":
+                header[f"period{N}"] = int(round((grid[1] - grid[0]) / (scheme[L][0] / scheme[N])))
+    else:
+        for key in Manifest.parameters:
+            header[key] = None
+
+    np.savez(f"{folder}/{MANIFEST_FILE}", header=np.array(json.dumps(header)), XGrid=XGrid, ZGrid=ZGrid)
+    return Manifest(folder)
+
+# Open the manifest of a setup; if it's missing or stale, it's (re-)made,
+# unless make is False, in which case None is returned
+def LoadManifest(folder, make=True):
+    folder = folder.rstrip('/')
+    if os.path.isfile(f"{folder}/{MANIFEST_FILE}"):
+        manifest = Manifest(folder)
+        if not manifest.stale():
+            return manifest
+    return MakeManifest(folder) if make else None
+
+# Make the manifests of all the setups found at dir (recursively), e.g. for old scans
+def Backfill(dir, force=False):
+    made = 0
+    for root, dirs, files in os.walk(dir):
+        for each in dirs:
+            if re.search(r"NSSI NLM .*", each):
+                folder = f"{root}/{each}"
+                if force: MakeManifest(folder)
+                else:     LoadManifest(folder)
+                made += 1
+    return made
+
+help_dir = "Specifies the directory that is searched (recursively) for the folders of setups ('NSSI NLM <...>')."
+help_force = "If it is set, the manifests are re-made even if they are up to date."
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfills the manifests of the setups found in a directory.")
+    parser.add_argument("--dir", help=help_dir)
+    parser.add_argument("--force", action='store_true', help=help_force)
+    args = parser.parse_args()
+
+    print(f"Manifests of {Backfill(args.dir, args.force)} setups are up to date.")
@@ -132,6 +132,23 @@ def OnePlot2D_EPS(xCoordinates, zCoordinates, Mesh, filePlot, dpi=200, dims=defa
     fig.colorbar(plot)
     fig.savefig(filePlot, fmt="eps", bbox_inches='tight', dpi=dpi)
 
+# Spectrogram: the (logarithmic) power of the x-harmonics of a field along z
+def PlotSpectrogram(qs, zCoordinates, power, filePlot, title=None, fmt="eps", dpi=200, dims=defaultDims):
+    qArray, zArray = np.meshgrid(np.array(qs), np.array(zCoordinates))
+
+    fig = Figure(figsize=dims)
+    FigureCanvas(fig)
+
+    axs  = fig.add_subplot(111)
+    plot = axs.pcolor(qArray, zArray, np.log10(np.maximum(power, 1e-30)), cmap=cm.get_cmap("inferno"), rasterized=True)
+
+    if title: axs.set_title(title, fontsize=MainFontSize)
+    axs.set_xlabel(r"$q$, km$^{-1}$", fontsize=MainFontSize)
+    axs.set_ylabel(r"$z$, km", fontsize=MainFontSize)
+
+    fig.colorbar(plot)
+    fig.savefig(filePlot, format=fmt, bbox_inches='tight', dpi=dpi)
+
 # Obtain the grids
 def Grids(dir):
     XGrid = []
@@ -280,7 +297,8 @@ def PlotSurface(xs, xlims, ys, ylims, zs, zlims, flav, fileplot, fmt="eps", dims
     fig.colorbar(plot)
     fig.savefig(fileplot, fmt=fmt, bbox_inches='tight')
 
-def PlotStability(xs, xlims, xlabel, ys, ylims, ylabel, zs, fileplot, hrchy, fmt="eps", dims=defaultDims):
+def PlotStability(xs, xlims, xlabel, ys, ylims, ylabel, zs, fileplot, hrchy, fmt="eps", dims=defaultDims,
+                  cblabel=r"$\kappa_{\mathrm{max}} / \omega$"):
     fig = Figure(figsize=dims)
     FigureCanvas(fig)
 
@@ -300,5 +318,48 @@ def PlotStability(xs, xlims, xlabel, ys, ylims, ylabel, zs, fileplot, hrchy, fmt
 
     plot = axs.pcolor(xArray, yArray, zArray, cmap=cm.get_cmap('cividis'), rasterized=True)
     cb = fig.colorbar(plot)
-    cb.ax.set_title(r"$\kappa_{\mathrm{max}} / \omega$", fontsize=MainFontSize)
-    fig.savefig(fileplot, fmt=fmt, bbox_inches='tight', dpi=192)
\ No newline at end of file
+    cb.ax.set_title(cblabel, fontsize=MainFontSize)
+    fig.savefig(fileplot, fmt=fmt, bbox_inches='tight', dpi=192)
+
+# Dispersion curves: the growth rates of the branches along x (only the branches that grow somewhere are labelled)
+def PlotDispersion(xs, xlims, xlabel, branches, labels, fileplot, hrchy, fmt="eps", dims=defaultDims, threshold=1e-10):
+    fig = Figure(figsize=dims)
+    FigureCanvas(fig)
+
+    axs = fig.add_subplot(111)
+    axs.set_xlabel(xlabel, fontsize=MainFontSize)
+    axs.set_ylabel(r"$\mathrm{Re}\,k / \omega$", fontsize=MainFontSize)
+    axs.set_xlim(xlims)
+    axs.set_title(hrchy, fontsize=MainFontSize)
+
+    branches = np.array(branches)
+    for i, label in enumerate(labels):
+        if np.max(branches[:,i]) > threshold:
+            axs.plot(xs, branches[:,i], label=label)
+        else:
+            axs.plot(xs, branches[:,i], color="grey", linewidth=0.5)
+
+    if np.max(branches) > threshold:
+        axs.legend(fontsize=MainFontSize)
+    fig.savefig(fileplot, format=fmt, bbox_inches='tight')
+
+# The growth of the perturbations along z predicted by the linearized equations: the amplitudes
+# of the modes (thin lines) and their total, i.e. the rms over x (thick line), at the log scale
+def PlotLinearGrowth(zs, zlims, modes, labels, total, fileplot, hrchy, fmt="eps", dims=defaultDims):
+    fig = Figure(figsize=dims)
+    FigureCanvas(fig)
+
+    axs = fig.add_subplot(111)
+    axs.set_xlabel(r"$z$ [km]", fontsize=MainFontSize)
+    axs.set_ylabel(r"$|\delta \rho|$", fontsize=MainFontSize)
+    axs.set_xlim(zlims)
+    axs.set_yscale("log")
+    axs.set_title(hrchy, fontsize=MainFontSize)
+
+    modes = np.array(modes)
+    for i, label in enumerate(labels):
+        axs.plot(zs, modes[:,i], label=label, linewidth=0.75)
+    axs.plot(zs, total, color="black", linewidth=1.5, label="rms")
+
+    axs.legend(fontsize=MainFontSize)
+    fig.savefig(fileplot, format=fmt, bbox_inches='tight')
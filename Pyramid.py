@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import os, json, argparse
+
+from Data import Data, sourceStamps
+
+# The pyramid of a setup is saved at the folder 'pyramid': each level is a subfolder
+# named after its factor, holding the block-averaged (mean.npy), block-minimal (min.npy)
+# and block-maximal (max.npy) fields of the shape (8, Length_z, Length_x), and the grids
+# of the centres of the blocks (XGrid.npy, ZGrid.npy); the levels are listed at index.json
+
+class Level:
+    """ A level of a pyramid; the arrays are memory mapped """
+
+    def __init__(self, folder, factor):
+        self.factor = factor
+        levelfolder = f"{folder}/{factor}"
+        self.XGrid = np.load(f"{levelfolder}/XGrid.npy")
+        self.ZGrid = np.load(f"{levelfolder}/ZGrid.npy")
+        self.mean  = np.load(f"{levelfolder}/mean.npy", mmap_mode="r")
+        self.min   = np.load(f"{levelfolder}/min.npy",  mmap_mode="r")
+        self.max   = np.load(f"{levelfolder}/max.npy",  mmap_mode="r")
+        self.Length_z, self.Length_x = self.mean.shape[1:]
+
+class Pyramid:
+    """ Multi-resolution pyramid of block-averaged levels of a setup """
+
+    def __init__(self, folder):
+        self.folder = folder.rstrip('/')
+        pyramidfolder = f"{self.folder}/pyramid"
+
+        if not os.path.isfile(f"{pyramidfolder}/index.json"):
+            raise FileNotFoundError(f"No pyramid found at {pyramidfolder}")
+
+        with open(f"{pyramidfolder}/index.json") as f:
+            index = json.load(f)
+
+        self.files   = index["files"]
+        self.factors = index["factors"]
+        self.levels  = {factor: Level(pyramidfolder, factor) for factor in self.factors}
+
+    # Whether the binaries have been changed since the pyramid was built
+    def stale(self):
+        return self.files != sourceStamps(self.folder)
+
+    # The level whose dimensions are the closest (in the logarithmic sense)
+    # to the desired number of pixels along the axes
+    def closest(self, Nx, Nz):
+        def distance(level):
+            return max(abs(np.log(level.Length_x / Nx)), abs(np.log(level.Length_z / Nz)))
+        return min(self.levels.values(), key=distance)
+
+# Factors of the levels: the powers of two, starting from the one at which the larger
+# side of the level doesn't exceed maxSide, up to the one at which it doesn't exceed minSide;
+# if the whole setup fits within maxSide, the finest level is the setup itself (the factor 1)
+def pyramidFactors(Length_x, Length_z, minSide, maxSide):
+    side = lambda factor: max(-(-Length_x // factor), -(-Length_z // factor))
+    factor = 1
+    while side(factor) > maxSide:
+        factor *= 2
+    factors = [factor]
+    while side(factor) > minSide:
+        factor *= 2
+        factors.append(factor)
+    return factors
+
+# Build the pyramid of a setup in a single pass over the binaries; the blocks along
+# the edges may be incomplete, so the dimensions don't need to be divisible by anything
+def BuildPyramid(folder, minSide=64, maxSide=2048, dtype=np.float32, mmap=False):
+    data = Data(folder, mmap=mmap)
+    Length_x, Length_z = data.Length_x_bin, data.Length_z_bin
+    XGrid, ZGrid = np.array(data.XGrid), np.array(data.ZGrid)
+
+    pyramidfolder = f"{data.folder}/pyramid"
+    if not os.path.isdir(pyramidfolder):
+        os.mkdir(pyramidfolder)
+
+    # The finest level is reduced from the binaries directly, and all the coarser ones
+    # are reduced from it (their factors are multiples of the finest one)
+    factors = pyramidFactors(Length_x, Length_z, minSide, maxSide)
+    finest  = factors[0]
+    xstarts = np.arange(0, Length_x, finest)
+
+    levels = []
+    for factor in factors:
+        Nz = -(-Length_z // factor)
+        Nx = -(-Length_x // factor)
+        levelfolder = f"{pyramidfolder}/{factor}"
+        if not os.path.isdir(levelfolder):
+            os.mkdir(levelfolder)
+
+        # Centres of the blocks
+        xblocks = np.arange(0, Length_x, factor)
+        zblocks = np.arange(0, Length_z, factor)
+        np.save(f"{levelfolder}/XGrid.npy", np.add.reduceat(XGrid, xblocks) / np.diff(np.append(xblocks, Length_x)))
+        np.save(f"{levelfolder}/ZGrid.npy", np.add.reduceat(ZGrid, zblocks) / np.diff(np.append(zblocks, Length_z)))
+
+        levels.append({
+            "factor": factor,
+            # The finest blocks merged into a block of this level along x
+            "xstarts": np.arange(0, len(xstarts), factor // finest),
+            # Numbers of the points along x in the blocks
+            "cols": np.diff(np.append(xblocks, Length_x)),
+            "mean": np.lib.format.open_memmap(f"{levelfolder}/mean.npy", "w+", dtype, (8, Nz, Nx)),
+            "min":  np.lib.format.open_memmap(f"{levelfolder}/min.npy",  "w+", dtype, (8, Nz, Nx)),
+            "max":  np.lib.format.open_memmap(f"{levelfolder}/max.npy",  "w+", dtype, (8, Nz, Nx)),
+            # Accumulators of the current line of blocks
+            "sum": np.zeros((8, Nx)), "accmin": np.full((8, Nx), np.inf), "accmax": np.full((8, Nx), -np.inf),
+        })
+
+    Nblocks = -(-Length_z // finest)
+    for iblock, block in enumerate(data.blocks(finest)):
+        # Reduce the lines of the block to the finest blocks
+        bsum = np.add.reduceat(block, xstarts, axis=2).sum(axis=1)
+        bmin = np.minimum.reduceat(block, xstarts, axis=2).min(axis=1)
+        bmax = np.maximum.reduceat(block, xstarts, axis=2).max(axis=1)
+
+        for level in levels:
+            level["sum"] += np.add.reduceat(bsum, level["xstarts"], axis=1)
+            np.minimum(level["accmin"], np.minimum.reduceat(bmin, level["xstarts"], axis=1), out=level["accmin"])
+            np.maximum(level["accmax"], np.maximum.reduceat(bmax, level["xstarts"], axis=1), out=level["accmax"])
+
+            # The line of blocks of this level is complete
+            merged = level["factor"] // finest
+            if (iblock + 1) % merged == 0 or iblock == Nblocks - 1:
+                iz = iblock // merged
+                rows = min(level["factor"], Length_z - iz*level["factor"])
+                level["mean"][:, iz] = level["sum"] / (rows*level["cols"])
+                level["min"][:, iz]  = level["accmin"]
+                level["max"][:, iz]  = level["accmax"]
+                level["sum"][:] = 0.0; level["accmin"][:] = np.inf; level["accmax"][:] = -np.inf
+
+    for level in levels:
+        for key in ["mean", "min", "max"]:
+            level[key].flush()
+
+    with open(f"{pyramidfolder}/index.json", "w") as f:
+        json.dump({"factors": factors, "files": sourceStamps(data.folder)}, f, indent=4)
+
+    return Pyramid(folder)
+
+# Open the pyramid of a setup, (re-)building it if it's missing or stale
+def LoadPyramid(folder, **kwargs):
+    try:
+        pyramid = Pyramid(folder)
+        if not pyramid.stale():
+            return pyramid
+    except FileNotFoundError:
+        pass
+    return BuildPyramid(folder, **kwargs)
+
+help_dir = "Specifies the directory of a setup (containing the folder 'bin' and the files 'XGrid.txt' and 'ZGrid.txt')."
+help_minSide = "The coarsest level of the pyramid has no more than this number of points along each of the axes."
+help_maxSide = "The finest level of the pyramid has no more than this number of points along each of the axes."
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds the multi-resolution pyramid of a setup.")
+    parser.add_argument("--dir", help=help_dir)
+    parser.add_argument("--minSide", default=64, help=help_minSide, type=int)
+    parser.add_argument("--maxSide", default=2048, help=help_maxSide, type=int)
+    parser.add_argument("--mmap", action='store_true')
+    args = parser.parse_args()
+
+    pyramid = BuildPyramid(args.dir, minSide=args.minSide, maxSide=args.maxSide, mmap=args.mmap)
+    for factor in pyramid.factors:
+        level = pyramid.levels[factor]
+        print(f"Level {factor}: {level.Length_x}x{level.Length_z}")
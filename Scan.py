@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 
 import os, json, re
-from Constants import Constants
+import numpy as np
+from Manifest import LoadManifest
+from Data import cachedStatistics
 from Modules import PlotAverageFlavours, PlotAverageNuNubars
 
 class NoAveragesFound(Exception):
@@ -39,39 +41,44 @@ def findSetups(dir):
 # Extract the asymptotic probabilities
 # from a specified setup folder
 def extractProbs(setupfolder, percentage=0.1):
-    # First let's chech whether these averages have already been
-    # evaluated and saved by ./Plots.py at a special directory
-    if not(findFolder(setupfolder, "averages")):
-        raise NoAveragesFound(setupfolder)
-    averagesdir = setupfolder + "/averages"
-    # Then let's extract the average probabilities;
-    # in order to obtain clear asymptotic probabilities without possible
+    # In order to obtain clear asymptotic probabilities without possible
     # fluctuations they should be averaged as well; next we evaluate exactly
     # these mean probabilities at the termalisation stage, averaging them over 
     # last percentage of points
     probs = []
-    for filename in ["avsL.json", "avsR.json"]:
-        with open(f"{averagesdir}/{filename}") as f:
-            d = json.load(f)
-            numpoints = int(percentage * len(d["ZGridRare"]))
-            probs.append([sum(flav[-numpoints:])/numpoints for flav in d["avs"]])
+    # If the binaries are there, the averages are read through their binary cache
+    # (which is re-evaluated automatically if it's stale)
+    if findFolder(setupfolder, "bin"):
+        avs = cachedStatistics(setupfolder).mean
+        numpoints = int(percentage * avs.shape[1])
+        for beam in [avs[:4], avs[4:]]:
+            probs.append([float(np.mean(flav[-numpoints:])) for flav in beam])
+    else:
+        # Otherwise, let's chech whether these averages have already been
+        # evaluated and saved by ./Plots.py at a special directory
+        if not(findFolder(setupfolder, "averages")):
+            raise NoAveragesFound(setupfolder)
+        averagesdir = setupfolder + "/averages"
+        # Then let's extract the average probabilities
+        for filename in ["avsL.json", "avsR.json"]:
+            with open(f"{averagesdir}/{filename}") as f:
+                d = json.load(f)
+                numpoints = int(percentage * len(d["ZGridRare"]))
+                probs.append([sum(flav[-numpoints:])/numpoints for flav in d["avs"]])
     # Average left-right probabilitie
     meanLR = [0.5*(probs[0][f] + probs[1][f]) for f in range(4)]
     # And nu-nubar ratio
     nunubar = (meanLR[0] + meanLR[1]) / (meanLR[2] + meanLR[3])
     return meanLR + [nunubar,]
 
-# Extract the level of mu
+# Extract the level of mu (from the manifest of the setup,
+# which is made out of Parameters.json at the first call)
 def extractMu(setupfolder):
-    # First, let's initialise the Constants object
-    c = Constants(f"{setupfolder}/Parameters.json")
-    return c.muOverOmega
+    return LoadManifest(setupfolder).muOverOmega
 
 # Extract the coupling constant gPlus
 def extractgPlus(setupfolder):
-    # First, let's initialise the Constants object
-    c = Constants(f"{setupfolder}/Parameters.json")
-    return c.gPlus
+    return LoadManifest(setupfolder).gPlus
 
 class Scan:
     """
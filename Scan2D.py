@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
-from Scan import Scan, extractMu, extractgPlus, extractProbs, labels, filelabels
+from Scan import Scan, extractProbs, labels, filelabels
+from Manifest import LoadManifest
 from Modules import PlotAverageFlavours, PlotAverageNuNubars, PlotSurface
 import os
 
@@ -20,8 +21,10 @@ class Setup:
         about a calculated setup (it saves mu and gPlus).
     """
     def __init__(self, setupfolder, roundMu=2):
-        self.mu     = round(extractMu(setupfolder), roundMu)
-        self.gPlus  = extractgPlus(setupfolder)
+        # Both of the parameters come from the manifest of the setup
+        manifest    = LoadManifest(setupfolder)
+        self.mu     = round(manifest.muOverOmega, roundMu)
+        self.gPlus  = manifest.gPlus
         self.probs  = extractProbs(setupfolder)
         self.folder = setupfolder
         # Note: roundMu is needed when mu values are a bit ugly
@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import os, time, argparse
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from threading import BrokenBarrierError
+
+from Constants import Constants, Noise, km, hbarc
+from Lambdas import su4Diag, su4Offdiag, su4Round, com, flavourSigma1, flavourSigma3, G, AMMLike
+from Lambdas import su4ComposeTraceless, su4Norm, su4Normalise, su4SetEigenvalues
+from Elapsed import elapsed
+
+# A NumPy version of the scheme of nssi (RK4 in z and the central differences in x); the lines
+# of both of the beams are kept in a single array (2, N_x, 4, 4), where [LEFT] is the left beam
+# and [RIGHT] is the right one, and all the functions below act on all the points at once
+LEFT, RIGHT = 0, 1
+
+# The signs of the x-derivatives of the beams in the equations
+PM = np.array([1.0, -1.0])[:, None, None, None]
+
+# Profiles, when they're needed
+def profileNu(z, R):
+    return R**4 / (z + R)**4
+
+def profileMSW(z, R):
+    return R**2 / (z + R)**2
+
+def profileAMM(z, R):
+    return R**2 / (z + R)**2
+
+# Points of the x grid (without the periodic continuation); the functions below taking points
+# act only on the points of the grid with these indices (all of them by default)
+def xGrid(c, points=None):
+    return (np.arange(c.N_x) if points is None else np.asarray(points)) * c.dx
+
+# Origins of the left and the right beams going through the points (x,z)
+def originLeft(c, x, z):
+    return x + z*c.tanChi
+
+def originRight(c, x, z):
+    return x - z*c.tanChi
+
+# The sums of the Fourier harmonics of the 15D vectors (N_Noise, 15) at the points x; returns the matrices (len(x), 4, 4)
+def FourierVector(x, X, sinVecs, cosVecs):
+    phases = 2.0*np.pi/X * np.outer(x, np.arange(1, len(sinVecs) + 1))
+    return su4ComposeTraceless(np.sin(phases) @ sinVecs + np.cos(phases) @ cosVecs)
+
+# The sums of the Fourier harmonics of the luminosity at the points x
+def FourierLum(x, X, sinCoeffs, cosCoeffs):
+    phases = 2.0*np.pi/X * np.outer(x, np.arange(1, len(sinCoeffs) + 1))
+    return 1.0 + np.sin(phases) @ np.asarray(sinCoeffs) + np.cos(phases) @ np.asarray(cosCoeffs)
+
+# The initial lines carried along the beams to the position z (z = 0 gives the initial conditions themselves)
+def ShiftedInitial(c, n, z, points=None):
+    x = xGrid(c, points)
+    rho = np.empty((2, len(x), 4, 4), dtype=np.complex128)
+    rho[LEFT]  = c.MeanLeft  + FourierVector(originLeft(c, x, z),  c.X, n.sinCoeffsLeft,  n.cosCoeffsLeft)
+    rho[RIGHT] = c.MeanRight + FourierVector(originRight(c, x, z), c.X, n.sinCoeffsRight, n.cosCoeffsRight)
+    return rho
+
+# The initial lines; with PressFlag all the matrices of a beam are put at the same S^14
+def InitialConditions(c, n):
+    rho = ShiftedInitial(c, n, 0.0)
+    if c.PressFlag:
+        rho = su4Normalise(rho, np.array([c.NormMeanLeft, c.NormMeanRight])[:, None])
+    return rho
+
+# The su4Norm's of the initial lines, as an array (2, N_x)
+def InitialNorms(c, rho):
+    if c.PressFlag:
+        return np.repeat(np.array([[c.NormMeanLeft], [c.NormMeanRight]]), c.N_x, axis=1)
+    return su4Norm(rho)
+
+# The norms at the position z, linearly interpolated between the initial norms shifted along the beams
+def ApproximateNorms(c, initNorms, z, points=None):
+    if c.PressFlag:
+        return initNorms.copy() if points is None else initNorms[:, points]
+    x = xGrid(c, points)
+    norms = np.empty((2, len(x)))
+    for beam, origin in [(LEFT, originLeft(c, x, z)), (RIGHT, originRight(c, x, z))]:
+        scaled = origin / c.dx
+        lNode = np.floor(scaled).astype(np.int64)
+        norms[beam] = (lNode + 1 - scaled)*initNorms[beam][lNode % c.N_x] + (scaled - lNode)*initNorms[beam][(lNode + 1) % c.N_x]
+    return norms
+
+# Same as above, but the norms are evaluated directly from the noise
+def TrueNorms(c, n, initNorms, z, points=None):
+    if c.PressFlag:
+        return initNorms.copy() if points is None else initNorms[:, points]
+    return su4Norm(ShiftedInitial(c, n, z, points))
+
+# If needed, su4Normalise the lines at the position z to the initial norms (either the true or the approximate ones)
+def NormaliseLines(c, n, initNorms, rho, z, points=None):
+    if not c.su4NormaliseFlag:
+        return rho
+    if c.WhichNorms:
+        return su4Normalise(rho, TrueNorms(c, n, initNorms, z, points))
+    return su4Normalise(rho, ApproximateNorms(c, initNorms, z, points))
+
+# Regularization that sets the eigenvalues to the ones of the initial density matrices carried to the position z
+def RegEigenvalues(c, n, rho, z, points=None):
+    return su4SetEigenvalues(rho, ShiftedInitial(c, n, z, points))
+
+# Matrix flavour Hamiltonians; the collective ones are given by the lines of the opposite beams
+# and the factors of the luminosity (either scalars or arrays broadcast against (2, N_x))
+def VacuumHamiltonian(c):
+    return (c.dm2/(4.0*c.E_0*hbarc)) * (c.s2theta*flavourSigma1 - c.c2theta*flavourSigma3)
+
+def MSWHamiltonian(c, z):
+    tmp = np.diag([c.V_e - 0.5*c.V_n, -0.5*c.V_n, -c.V_e + 0.5*c.V_n, 0.5*c.V_n])
+    return tmp*profileMSW(z, c.R) if c.ProfileFlag else tmp
+
+def AMMHamiltonian(c, z):
+    return AMMLike * (profileAMM(z, c.R)*c.V_AMM if c.ProfileFlag else c.V_AMM)
+
+def VAHamiltonian(c, rhoOpp, z, factor):
+    trace = np.trace(rhoOpp @ G, axis1=-2, axis2=-1)
+    tmp = trace[..., None, None]*G + su4Diag(su4Round(rhoOpp))
+    strength = c.V_Nu*(1 - c.cosOmega)*(profileNu(z, c.R) if c.ProfileFlag else 1.0)
+    return tmp * (strength*np.asarray(factor))[..., None, None]
+
+def NSSIHamiltonian(c, rhoOpp, z, factor):
+    round = su4Round(rhoOpp)
+    tmp = np.swapaxes(c.gMinus*su4Diag(round) + c.gPlus*su4Offdiag(round), -1, -2)
+    strength = c.V_Nu*(1 - c.cosOmega)*(profileNu(z, c.R) if c.ProfileFlag else 1.0)
+    return tmp * (strength*np.asarray(factor))[..., None, None]
+
+# The total Hamiltonians of the lines; note that the beam opposite to the left one is the right one
+def Hamiltonians(c, rho, z, points=None):
+    rhoOpp = rho[::-1]
+    if c.OldNoiseFlag:
+        x = xGrid(c, points)
+        lumLeft  = FourierLum(originLeft(c, x, z),  c.X, c.lumSinLeft,  c.lumCosLeft)
+        lumRight = FourierLum(originRight(c, x, z), c.X, c.lumSinRight, c.lumCosRight)
+        factor = np.array([lumRight, lumLeft])
+    else:
+        factor = 1.0
+    return (VacuumHamiltonian(c) + MSWHamiltonian(c, z) + AMMHamiltonian(c, z) +
+            VAHamiltonian(c, rhoOpp, z, factor) + NSSIHamiltonian(c, rhoOpp, z, factor))
+
+# The central 2nd or 4th order approximation of the x-derivative of the (periodic) lines
+def CentralDerivative(rho, step, order):
+    shift = lambda k: np.roll(rho, -k, axis=-3)
+    if order == 2:
+        return (0.5*shift(1) - 0.5*shift(-1)) / step
+    return (-shift(2)/12.0 + 2.0*shift(1)/3.0 - 2.0*shift(-1)/3.0 + shift(-2)/12.0) / step
+
+# The pseudo-spectral x-derivative of the (periodic) lines of the length X; the real and the imaginary
+# parts of all the entries of the matrices of both of the beams are transformed at once (the Nyquist
+# harmonic of an even N_x is dropped, as its derivative isn't defined by the samples)
+def SpectralDerivative(rho, X):
+    N = rho.shape[-3]
+    components = np.ascontiguousarray(rho).view(np.float64)
+    k = 2.0*np.pi*np.fft.rfftfreq(N, d=X/N)
+    if N % 2 == 0:
+        k[-1] = 0.0
+    spectrum = np.fft.rfft(components, axis=-3) * (1.0j*k)[:, None, None]
+    return np.ascontiguousarray(np.fft.irfft(spectrum, n=N, axis=-3)).view(np.complex128)
+
+# The x-derivatives used in the scheme: "central" (of the order xDerivativeOrder) or "spectral"
+DERIVATIVES = ("central", "spectral")
+
+# The stepping in z: "fixed" (RK4, as in nssi) or "adaptive" (see DormandPrince)
+STEPPINGS = ("fixed", "adaptive")
+
+# RHS in the equation that defines the z-derivatives
+def RHSCentral(c, rho, z):
+    return c.tanChi*PM*CentralDerivative(rho, c.dx, c.xDerivativeOrder) + com(Hamiltonians(c, rho, z), rho)*(-1.0j/c.cosChi)
+
+# Same as above, but with the pseudo-spectral approximation of the x-derivative
+def RHSSpectral(c, rho, z):
+    return c.tanChi*PM*SpectralDerivative(rho, c.X) + com(Hamiltonians(c, rho, z), rho)*(-1.0j/c.cosChi)
+
+# The next line in the scheme RK4 (in z direction) with the given RHS
+def RK4(c, rho, z, rhs):
+    K1 = rhs(c, rho, z)
+    K2 = rhs(c, rho + K1*(c.dz/2.0), z + c.dz/2.0)
+    K3 = rhs(c, rho + K2*(c.dz/2.0), z + c.dz/2.0)
+    K4 = rhs(c, rho + K3*c.dz, z + c.dz)
+    return rho + (K1 + 2.0*K2 + 2.0*K3 + K4)*(c.dz/6.0)
+
+# The Dormand-Prince 5(4) pair: the nodes of the stages, their coefficients, the weights of the 5th order
+# solution and the differences of the weights of the 5th and the 4th order ones (the 7th stage is taken
+# at the 5th order solution itself)
+DP_C = [0.0, 1/5, 3/10, 4/5, 8/9, 1.0, 1.0]
+DP_A = [[],
+        [1/5],
+        [3/40, 9/40],
+        [44/45, -56/15, 32/9],
+        [19372/6561, -25360/2187, 64448/6561, -212/729],
+        [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+        [35/384, 0.0, 500/1113, 125/192, -2187/6784, 11/84]]
+DP_E = [71/57600, 0.0, -71/16695, 71/1920, -17253/339200, 22/525, -1/40]
+
+# Controls of the adaptive steps: the safety factor and the limits of the change of a step
+SAFETY = 0.9
+FACTOR_MIN = 0.2
+FACTOR_MAX = 5.0
+
+# A step h of the Dormand-Prince pair with the given RHS; returns the next line and the estimate of its local error
+def DormandPrince(c, rho, z, h, rhs):
+    K = []
+    for i in range(7):
+        stage = rho + h*sum(a*k for a, k in zip(DP_A[i], K)) if i else rho
+        K.append(rhs(c, stage, z + DP_C[i]*h))
+    return stage, h*sum(e*k for e, k in zip(DP_E, K))
+
+# The largest error relative to the tolerances (the step is accepted if it's not bigger than 1)
+def errorNorm(error, rho, rtol, atol):
+    return np.max(np.abs(error) / (atol + rtol*np.abs(rho)))
+
+# The RHS of the central scheme at a slab of the points of the lines; ext holds the slab together
+# with the halo points from both sides of it (as many as the stencil of the x-derivative needs)
+def RHSSlab(c, ext, z, points, halo):
+    rho = ext[:, halo:-halo]
+    xDer = CentralDerivative(ext, c.dx, c.xDerivativeOrder)[:, halo:-halo]
+    return c.tanChi*PM*xDer + com(Hamiltonians(c, rho, z, points), rho)*(-1.0j/c.cosChi)
+
+# The bounds of the slabs of the x grid given to the workers
+def slabBounds(N_x, workers):
+    return np.linspace(0, N_x, workers + 1).astype(np.int64)
+
+# A worker of the parallel scheme, solving the lines at the slab [start, stop) of the x grid
+#
+# The lines and the inputs of the stages of RK4 are kept in the shared memory (the blocks given by names),
+# so each of the workers writes its own slab there and reads the halo points of its neighbours from there;
+# the workers wait for each other (at the barrier stages) every time an input of a stage is written, and
+# for the main process (at the barrier lines) around each of the saved lines; the inputs of the stages
+# alternate between two buffers, so a buffer is never written while the previous stage still reads it
+def SlabWorker(fParams, fNoise, names, start, stop, stages, lines, periodN_z):
+    # (only the blocks opened so far are closed, whatever fails)
+    blocks, rho, A, B = [], None, None, None
+    try:
+        c, n = Constants(fParams), Noise(fNoise)
+        for name in names:
+            blocks.append(shared_memory.SharedMemory(name=name))
+        rho, A, B = [np.ndarray((2, c.N_x, 4, 4), dtype=np.complex128, buffer=block.buf) for block in blocks]
+
+        halo = c.xDerivativeOrder // 2
+        points = np.arange(start, stop)
+        ext = np.arange(start - halo, stop + halo) % c.N_x
+        initNorms = InitialNorms(c, InitialConditions(c, n))
+        rhs = lambda lines, z: RHSSlab(c, lines[:, ext], z, points, halo)
+
+        for j in range(c.N_z):
+            z = j*c.dz
+            rho0 = rho[:, start:stop].copy()
+            K1 = rhs(rho, z)
+            A[:, start:stop] = rho0 + K1*(c.dz/2.0); stages.wait()
+            K2 = rhs(A, z + c.dz/2.0)
+            B[:, start:stop] = rho0 + K2*(c.dz/2.0); stages.wait()
+            K3 = rhs(B, z + c.dz/2.0)
+            A[:, start:stop] = rho0 + K3*c.dz; stages.wait()
+            K4 = rhs(A, z + c.dz)
+            rho[:, start:stop] = NormaliseLines(c, n, initNorms, rho0 + (K1 + 2.0*K2 + 2.0*K3 + K4)*(c.dz/6.0), z + c.dz, points)
+            # The main process saves the lines in between
+            if (j + 1) % periodN_z == 0:
+                lines.wait(); lines.wait()
+            if (j + 1) % c.RegEigenvaluesPeriod == 0 and c.RegEigenvaluesFlag:
+                rho[:, start:stop] = RegEigenvalues(c, n, rho[:, start:stop], z + c.dz, points)
+            stages.wait()
+    except BrokenBarrierError:
+        pass
+    except BaseException:
+        # Don't leave the others waiting
+        stages.abort(); lines.abort()
+        raise
+    finally:
+        del rho, A, B
+        for block in blocks:
+            block.close()
+
+# Make the folder of a setup (with the inner folders for the binaries and the plots), named as in nssi
+def setDir(root):
+    dir = f"{root.rstrip('/')}/NSSI NLM {time.ctime()}/"
+    os.makedirs(f"{dir}bin")
+    os.makedirs(f"{dir}plots")
+    return dir
+
+# The points of the saved x grid; the (N_x+1)th point is the periodic continuation of the first one
+def savedPoints(c, periodN_x):
+    return np.arange(0, c.N_x + 1, periodN_x)
+
+# Dump the x grid (in km)
+def dumpXGrid(c, periodN_x, dir):
+    with open(f"{dir}XGrid.txt", "w") as out:
+        out.write("".join(f"{i*c.dx/km:g} " for i in savedPoints(c, periodN_x)))
+
+# Append the position z (in km) and the probabilities of the lines (as the float64 quadruples for each of the saved points)
+def dumpTwoLines(c, z, periodN_x, rho, dir):
+    with open(f"{dir}ZGrid.txt", "a") as out:
+        out.write(f"{z/km:g} ")
+    probs = np.real(np.diagonal(rho[:, savedPoints(c, periodN_x) % c.N_x], axis1=-2, axis2=-1))
+    for beam, filename in [(LEFT, "left.bin"), (RIGHT, "right.bin")]:
+        with open(f"{dir}bin/{filename}", "ab") as out:
+            out.write(np.ascontiguousarray(probs[beam], dtype=np.float64).tobytes())
+
+def stdoutLog(message):
+    print(f"[{time.ctime()}] {message}", flush=True)
+
+class Scheme:
+    """ The two-beam scheme of nssi, writing the setups in the same layout """
+    # The setup is written at the new folder "NSSI NLM <time stamp>" at root, or at folder, if it's given;
+    # the x-derivative is either "central" or "spectral" (the latter resolves the same harmonics
+    # with a few times fewer points N_x)
+    #
+    # The stepping in z is either "fixed" (RK4 with the step dz = Z/N_z, as in nssi) or "adaptive"
+    # (the Dormand-Prince pair with the local errors kept within rtol and atol); the adaptive steps
+    # land exactly at the saved lines, so both give the same ZGrid (every periodN_z-th multiple of dz)
+    #
+    # With workers > 1 the x grid is split into slabs solved by the pool of processes (see SlabWorker);
+    # this is available for the fixed stepping and the central differences only, as the other ones
+    # need all the points of the lines at once
+    def __init__(self, fParams, fNoise, root="./Data/", periodN_x=1, periodN_z=1, folder=None, verbose=True, derivative="central",
+                 stepping="fixed", rtol=1e-6, atol=1e-9, workers=1):
+        if derivative not in DERIVATIVES:
+            raise ValueError(f"Unknown x-derivative '{derivative}' (must be one of {DERIVATIVES})")
+        if stepping not in STEPPINGS:
+            raise ValueError(f"Unknown stepping '{stepping}' (must be one of {STEPPINGS})")
+        if workers > 1 and (derivative != "central" or stepping != "fixed"):
+            raise ValueError("The parallel scheme supports only the fixed stepping and the central differences")
+        self.fParams, self.fNoise = fParams, fNoise
+        self.c = Constants(fParams)
+        self.n = Noise(fNoise)
+        if workers > 1 and self.c.N_x // workers < self.c.xDerivativeOrder // 2:
+            raise ValueError(f"Too many workers ({workers}) for the x grid of {self.c.N_x} points")
+        self.workers = workers
+        self.rhs = RHSCentral if derivative == "central" else RHSSpectral
+        self.stepping = stepping
+        self.rtol = rtol
+        self.atol = atol
+        self.periodN_x = periodN_x
+        self.periodN_z = periodN_z
+        self.verbose = verbose
+
+        self.log("Initialization")
+        if folder is None:
+            self.dir = setDir(root)
+        else:
+            self.dir = f"{folder.rstrip('/')}/"
+            os.makedirs(f"{self.dir}bin", exist_ok=True)
+            os.makedirs(f"{self.dir}plots", exist_ok=True)
+        self.log(f"Located at {self.dir}")
+
+        self.c.dump(f"{self.dir}Parameters.json")
+        self.n.dump(f"{self.dir}Noise.json")
+        dumpXGrid(self.c, self.periodN_x, self.dir)
+
+        self.RhoPrev = InitialConditions(self.c, self.n)
+        self.InitNorms = InitialNorms(self.c, self.RhoPrev)
+        dumpTwoLines(self.c, 0.0, self.periodN_x, self.RhoPrev, self.dir)
+
+    def log(self, message):
+        if self.verbose:
+            stdoutLog(message)
+
+    def location(self):
+        return self.dir
+
+    def normalise(self, rho, z):
+        return NormaliseLines(self.c, self.n, self.InitNorms, rho, z)
+
+    # Subsequently find all the lines, from z=c.dz to z=c.Z
+    @elapsed
+    def Solve(self):
+        self.log("Starting the calculations")
+        if self.workers > 1:
+            self.SolveParallel()
+        elif self.stepping == "fixed":
+            self.SolveFixed()
+        else:
+            self.SolveAdaptive()
+
+    def SolveFixed(self):
+        c = self.c
+        for j in range(c.N_z):
+            z = j*c.dz
+            # Note that RhoNext is placed at z+c.dz
+            RhoNext = self.normalise(RK4(c, self.RhoPrev, z, self.rhs), z + c.dz)
+            if (j + 1) % self.periodN_z == 0:
+                self.log(f"Saving data at z = {(z + c.dz)/km} km")
+                dumpTwoLines(c, z + c.dz, self.periodN_x, RhoNext, self.dir)
+            if (j + 1) % c.RegEigenvaluesPeriod == 0 and c.RegEigenvaluesFlag:
+                RhoNext = RegEigenvalues(c, self.n, RhoNext, z + c.dz)
+            self.RhoPrev = RhoNext
+
+    # The adaptive steps start from c.dz; the eigenvalues are regularized every RegEigenvaluesPeriod accepted steps
+    def SolveAdaptive(self):
+        c = self.c
+        z, h = 0.0, c.dz
+        self.accepted, self.rejected = 0, 0
+        for jOut in range(1, c.N_z // self.periodN_z + 1):
+            zOut = jOut*self.periodN_z*c.dz
+            while z < zOut:
+                # The last step before a saved line is cut to land at it exactly
+                last = z + h >= zOut
+                step = zOut - z if last else h
+                RhoNext, error = DormandPrince(c, self.RhoPrev, z, step, self.rhs)
+                norm = errorNorm(error, RhoNext, self.rtol, self.atol)
+                factor = FACTOR_MAX if norm == 0.0 else min(FACTOR_MAX, max(FACTOR_MIN, SAFETY*norm**-0.2))
+                if norm > 1.0:
+                    self.rejected += 1
+                    h = step*factor
+                    if h < 1e-12*c.Z:
+                        raise RuntimeError(f"The step at z = {z/km} km is too small for the tolerances")
+                    continue
+
+                z = zOut if last else z + step
+                self.accepted += 1
+                self.RhoPrev = self.normalise(RhoNext, z)
+                if last:
+                    self.log(f"Saving data at z = {z/km} km")
+                    dumpTwoLines(c, z, self.periodN_x, self.RhoPrev, self.dir)
+                if self.accepted % c.RegEigenvaluesPeriod == 0 and c.RegEigenvaluesFlag:
+                    self.RhoPrev = RegEigenvalues(c, self.n, self.RhoPrev, z)
+                # (a cut step doesn't tell much about the longer ones)
+                h = max(h, step*factor) if last else step*factor
+        self.log(f"Adaptive stepping: {self.accepted} steps accepted, {self.rejected} rejected")
+
+    # Same as SolveFixed, but the slabs of the x grid are solved by the workers
+    def SolveParallel(self):
+        c = self.c
+        blocks = [shared_memory.SharedMemory(create=True, size=self.RhoPrev.nbytes) for i in range(3)]
+        try:
+            rho = np.ndarray(self.RhoPrev.shape, dtype=np.complex128, buffer=blocks[0].buf)
+            rho[:] = self.RhoPrev
+            stages, lines = mp.Barrier(self.workers), mp.Barrier(self.workers + 1)
+            bounds = slabBounds(c.N_x, self.workers)
+            processes = [mp.Process(target=SlabWorker, args=(self.fParams, self.fNoise, [block.name for block in blocks],
+                                                            bounds[i], bounds[i+1], stages, lines, self.periodN_z))
+                         for i in range(self.workers)]
+            for process in processes:
+                process.start()
+
+            try:
+                for j in range(self.periodN_z, c.N_z + 1, self.periodN_z):
+                    lines.wait()
+                    self.log(f"Saving data at z = {j*c.dz/km} km")
+                    dumpTwoLines(c, j*c.dz, self.periodN_x, rho, self.dir)
+                    lines.wait()
+            except BrokenBarrierError:
+                pass
+            for process in processes:
+                process.join()
+            if any(process.exitcode != 0 for process in processes):
+                raise RuntimeError("A worker of the parallel scheme has failed")
+            self.RhoPrev = rho.copy()
+            del rho
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+help_parameters = "Specifies the JSON file with the parameters of the setup."
+help_noise = "Specifies the JSON file with the harmonics of the initial perturbations."
+help_root = "Specifies the directory where the folder of the setup is made."
+help_periodN_x = "Specifies the period of the saved points of the x grid."
+help_periodN_z = "Specifies the period of the saved lines along the z axis."
+help_spectral = "If it is set, the x-derivatives are evaluated pseudo-spectrally (via rFFT) instead of the central differences."
+help_adaptive = "If it is set, the steps in z are chosen adaptively (Dormand-Prince pair) instead of the fixed dz = Z/N_z."
+help_rtol = "Specifies the relative tolerance of the local errors of the adaptive steps."
+help_atol = "Specifies the absolute tolerance of the local errors of the adaptive steps."
+help_workers = "Specifies the number of the processes solving the slabs of the x grid."
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solves the two-beam scheme of nssi with NumPy.")
+    parser.add_argument("--parameters", default="./Parameters.json", help=help_parameters)
+    parser.add_argument("--noise", default="./Noise.json", help=help_noise)
+    parser.add_argument("--root", default="./Data/", help=help_root)
+    parser.add_argument("--periodN_x", type=int, default=1, help=help_periodN_x)
+    parser.add_argument("--periodN_z", type=int, default=1, help=help_periodN_z)
+    parser.add_argument("--spectral", action='store_true', help=help_spectral)
+    parser.add_argument("--adaptive", action='store_true', help=help_adaptive)
+    parser.add_argument("--rtol", type=float, default=1e-6, help=help_rtol)
+    parser.add_argument("--atol", type=float, default=1e-9, help=help_atol)
+    parser.add_argument("--workers", type=int, default=1, help=help_workers)
+    args = parser.parse_args()
+
+    setup = Scheme(args.parameters, args.noise, args.root, args.periodN_x, args.periodN_z,
+                   derivative="spectral" if args.spectral else "central",
+                   stepping="adaptive" if args.adaptive else "fixed", rtol=args.rtol, atol=args.atol,
+                   workers=args.workers)
+    setup.Solve()
+    print(f"Location: {setup.location()}")
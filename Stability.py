@@ -2,9 +2,15 @@
 
 import numpy as np
 from copy import deepcopy
-from Lambdas import su4Diag, su4Offdiag, su4Round, com, BiggestRealEigPart, flavourSigma3, G
-from Modules import PlotStability
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from Lambdas import su4Diag, su4Offdiag, su4Round, com, BiggestRealEigPart, flavourSigma3, G, su4ComposeTraceless
+from Modules import PlotStability, PlotDispersion, PlotLinearGrowth
+from Constants import Constants, Noise, deg, km
+from scipy.interpolate import griddata
+from scipy.optimize import linear_sum_assignment
+from scipy.linalg import expm
 from Elapsed import elapsed
+from StabilityStore import GridStore, KMaxMemo, VolumeStore, VOLUME_AXES, VOLUME_CHUNKS
 
 # In all the further fomulae zeta=+1 corresponds to the 'left' beam
 # and zeta=-1 to the 'right' one; the matrices will be packed as (left,right)
@@ -82,6 +88,62 @@ class Pair:
     def __str__(self):
         return str(self.pair[0]) + "\n" + str(self.pair[1])
 
+# The table sending the indices 0..31 (in the same ordering as in Pair) to the positions
+# in the buffer of ArrayPair: (beam, row, column)
+pairTable = np.array([((index // 8) % 2, *indexMapper[index // 16][index % 8]) for index in range(32)]).T
+
+class ArrayPair:
+    """ A pair of matrices (or a stack of pairs) kept in one (..., 2, 4, 4) complex buffer """
+
+    __slots__ = ("buffer",)
+
+    def __init__(self, left, right):
+        self.buffer = np.stack(np.broadcast_arrays(np.asarray(left), np.asarray(right)), axis=-3).astype(np.complex128)
+
+    # Alternative constructor that wraps a buffer (without copying it)
+    @classmethod
+    def fromBuffer(cls, buffer):
+        pair = cls.__new__(cls)
+        pair.buffer = buffer
+        return pair
+
+    @property
+    def left(self):
+        return self.buffer[...,0,:,:]
+
+    @property
+    def right(self):
+        return self.buffer[...,1,:,:]
+
+    # Matrix elements at the index (or the array of the indices) positions
+    def __getitem__(self, index):
+        return self.buffer[..., pairTable[0][index], pairTable[1][index], pairTable[2][index]]
+
+    def __setitem__(self, index, value):
+        self.buffer[..., pairTable[0][index], pairTable[1][index], pairTable[2][index]] = value
+
+    # All the 32 components at once, (..., 32)
+    def gather(self):
+        return self.buffer[..., pairTable[0], pairTable[1], pairTable[2]]
+
+    # Alternative constructor that sets all the 32 components at once from (..., 32)
+    @classmethod
+    def scatter(cls, components):
+        components = np.asarray(components)
+        buffer = np.zeros(components.shape[:-1] + (2,4,4), dtype=np.complex128)
+        buffer[..., pairTable[0], pairTable[1], pairTable[2]] = components
+        return cls.fromBuffer(buffer)
+
+    # Alternative constructor that sets only one nonzero matrix element at the index position;
+    # for an array of the indices, the stack of such pairs is returned
+    @classmethod
+    def singleEntry(cls, index):
+        index = np.asarray(index)
+        return cls.scatter(np.eye(32)[index])
+
+    def __str__(self):
+        return str(self.left) + "\n" + str(self.right)
+
 class Setup:
     def __init__(self, eta, q, mu, gPlus, chi, rhoInit):
         self.eta = eta
@@ -97,12 +159,14 @@ def VacHam(setup):
     return -0.5 * setup.eta * flavourSigma3
 
 # A function that states in the collective part of the total Hamiiltonian
+# (rho may be a stack of matrices as well)
 def CollHam(setup, rho):
-    SMPart   = np.trace(rho @ G)*G + su4Diag(su4Round(rho))
-    NSSIPart = setup.gPlus * su4Offdiag(su4Round(rho)).T
+    SMPart   = np.trace(rho @ G, axis1=-2, axis2=-1)[...,None,None]*G + su4Diag(su4Round(rho))
+    NSSIPart = setup.gPlus * np.swapaxes(su4Offdiag(su4Round(rho)), -1, -2)
     return setup.mu * (SMPart + NSSIPart)
 
-# Returns a corresponding pair of z-derivatives in the linearized equations.
+# Returns a corresponding pair of z-derivatives in the linearized equations
+# (of the same type as the given pair; ArrayPair may hold a stack of pairs)
 def L(setup, pair):
     # Let's subsequently define all the parts of the L operator
     # first: i*\zeta*q*tan(\chi) \delta \rho_{\zeta}
@@ -118,51 +182,473 @@ def L(setup, pair):
     lCommutator2 = (-1.0j/setup.cos)*com(CollHam(setup, pair.right), setup.rhoInit)
     rCommutator2 = (-1.0j/setup.cos)*com(CollHam(setup, pair.left),  setup.rhoInit)
 
-    # And finally, the Pair instance containg the matrices
-    return Pair(lDerivativeX + lCommutator1 + lCommutator2,
-                rDerivativeX + rCommutator1 + rCommutator2)
+    # And finally, the pair containg the matrices
+    return pair.__class__(lDerivativeX + lCommutator1 + lCommutator2,
+                          rDerivativeX + rCommutator1 + rCommutator2)
 
 def LMatrix(setup):
     # A matrix of the linear map of L, acting on the entire
-    # space of the \delta \rho matrices
-    LM = np.zeros((32,32), dtype=np.complex128)
-    for i in range(32):
-        tmp = L(setup, Pair.singleEntry(i))
-        for j in range(32):
-            LM[j,i] = tmp[j]
-    return LM
+    # space of the \delta \rho matrices; L acts on the stack of
+    # all the basis pairs at once, and the i-th column is L of the i-th one
+    return L(setup, ArrayPair.singleEntry(np.arange(32))).gather().T
 
 def LMatrixOffdiagonal(setup):
     #A matrix of the linear map of L, acting on the subspace
     # of the offdiagonal matrices \delta \rho
-    LOff = np.zeros((16,16), dtype=np.complex128)
-    for i in range(16):
-        tmp = L(setup, Pair.singleEntry(i))
-        for j in range(16):
-            LOff[j,i] = tmp[j]
-    return LOff
+    return L(setup, ArrayPair.singleEntry(np.arange(16))).gather()[:,:16].T
 
 # Returns max Re(k/\omega_{vac})
 def KMax(setup):
     return BiggestRealEigPart(LMatrixOffdiagonal(setup))
 
+# Default number of the operators diagonalised at once in the batched evaluation
+BATCH_SIZE = 4096
+
+# L is linear in eta, q, mu and mu*gPlus (at the fixed chi and rhoInit), so the matrix
+# of the map on the offdiagonal subspace is a combination of the four constant ones
+# returned here, (4,16,16), evaluated once at the unit setups
+def LMatrixOffdiagonalTerms(chi, rhoInit):
+    return LMatrixTerms(chi, rhoInit)[:,:16,:16]
+
+# The same four constant matrices for the full operator, (4,32,32)
+def LMatrixTerms(chi, rhoInit):
+    unit = lambda eta, q, mu, gPlus: LMatrix(Setup(eta=eta, q=q, mu=mu, gPlus=gPlus, chi=chi, rhoInit=rhoInit))
+    muTerm = unit(0.0, 0.0, 1.0, 0.0)
+    return np.stack([unit(1.0, 0.0, 0.0, 0.0), unit(0.0, 1.0, 0.0, 0.0), muTerm, unit(0.0, 0.0, 1.0, 1.0) - muTerm])
+
+# The combination of the terms for the arrays of the parameters (broadcast against each other)
+def assembleTerms(terms, eta, q, mu, gPlus):
+    eta, q, mu, gPlus = np.broadcast_arrays(*[np.asarray(each, dtype=np.float64) for each in (eta, q, mu, gPlus)])
+    coefficients = np.stack([eta, q, mu, mu*gPlus], axis=-1)
+    return np.einsum("...t,tij->...ij", coefficients, terms)
+
+# A stack of the matrices LMatrixOffdiagonal for the arrays of the parameters
+# (broadcast against each other), of the shape (..., 16, 16)
+def LMatrixOffdiagonalBatch(eta, q, mu, gPlus, chi, rhoInit, terms=None):
+    if terms is None:
+        terms = LMatrixOffdiagonalTerms(chi, rhoInit)
+    return assembleTerms(terms, eta, q, mu, gPlus)
+
+# A stack of the full matrices LMatrix, (..., 32, 32)
+def LMatrixBatch(eta, q, mu, gPlus, chi, rhoInit, terms=None):
+    if terms is None:
+        terms = LMatrixTerms(chi, rhoInit)
+    return assembleTerms(terms, eta, q, mu, gPlus)
+
+# The sectors of the full operator: the offdiagonal and the diagonal components of the pairs
+sectors = {"offdiagonal": np.arange(16), "diagonal": np.arange(16, 32), "full": np.arange(32)}
+
+# The elements of a term below this fraction of its largest one are the round-off residues
+BLOCKS_TOLERANCE = 1e-12
+
+# The independent blocks of the operator within a sector: the connected components of the
+# pattern of the nonzero elements of any of the terms (for the diagonal rhoInit the sectors
+# don't couple, and each of them splits further); returns the list of the arrays of the indices
+def LMatrixBlocks(terms, indices=sectors["full"], tol=BLOCKS_TOLERANCE):
+    scales = np.max(np.abs(terms), axis=(1, 2), keepdims=True)
+    coupled = np.any(np.abs(terms) > tol*scales, axis=0)
+    coupled = coupled | coupled.T
+    blocks, left = [], set(int(each) for each in indices)
+    while left:
+        block, front = set(), [min(left)]
+        while front:
+            i = front.pop()
+            if i in block:
+                continue
+            block.add(i)
+            front += [int(j) for j in np.flatnonzero(coupled[i]) if j not in block]
+        if not block <= set(int(each) for each in indices):
+            raise ValueError("The sector is coupled to the rest of the operator")
+        blocks.append(np.array(sorted(block)))
+        left -= block
+    return blocks
+
+# KMax for the arrays of the parameters (broadcast against each other); the operators
+# are assembled and diagonalised in batches of batchSize, so the memory stays bounded
+def KMaxBatch(eta, q, mu, gPlus, chi, rhoInit, batchSize=BATCH_SIZE):
+    terms = LMatrixOffdiagonalTerms(chi, rhoInit)
+    eta, q, mu, gPlus = np.broadcast_arrays(*[np.asarray(each, dtype=np.float64) for each in (eta, q, mu, gPlus)])
+    shape = q.shape
+    eta, q, mu, gPlus = [each.ravel() for each in (eta, q, mu, gPlus)]
+
+    Grid = np.empty(len(q), dtype=np.float64)
+    for start in range(0, len(q), batchSize):
+        batch = slice(start, start + batchSize)
+        LOff = LMatrixOffdiagonalBatch(eta[batch], q[batch], mu[batch], gPlus[batch], chi, rhoInit, terms)
+        Grid[batch] = np.max(np.real(np.linalg.eigvals(LOff)), axis=-1)
+    return Grid.reshape(shape)
+
+# Default number of the rows (values of q) of a diagram in a chunk of work; it doesn't
+# depend on the number of workers, so the serial and parallel evaluations make exactly
+# the same calls and their results are identical bit for bit
+CHUNK_Q = 8
+
+# KMax at the points given by the arrays of the parameters (broadcast against each other)
+def KMaxPoints(engine, eta, qs, mus, gPluses, chi, rhoInit):
+    if engine == "batch":
+        return KMaxBatch(eta, qs, mus, gPluses, chi, rhoInit)
+    if engine == "blocks":
+        return KMaxBlocks(eta, qs, mus, gPluses, chi, rhoInit)
+    if engine in ("diagonal", "full"):
+        return KMaxSector(eta, qs, mus, gPluses, chi, rhoInit, sector=engine)
+    if engine == "point":
+        qs, mus, gPluses = np.broadcast_arrays(qs, mus, gPluses)
+        Grid = np.zeros(qs.shape)
+        for index in np.ndindex(qs.shape):
+            setup = Setup(eta=eta, q=qs[index], mu=mus[index], gPlus=gPluses[index], chi=chi, rhoInit=rhoInit)
+            Grid[index] = KMax(setup)
+        return Grid
+    raise ValueError(f"Unknown engine '{engine}' (must be one of 'batch', 'blocks', 'diagonal', 'full', 'point')")
+
+# The rows of a diagram for the given values of q; the columns go over the values of mu
+# and/or gPlus (each is either a scalar or a list of the values of the columns)
+def KMaxRows(engine, eta, qs, mus, gPluses, chi, rhoInit):
+    qs = np.asarray(qs, dtype=np.float64)[:,None]
+    mus = np.atleast_1d(np.asarray(mus, dtype=np.float64))[None,:]
+    gPluses = np.atleast_1d(np.asarray(gPluses, dtype=np.float64))[None,:]
+    return KMaxPoints(engine, eta, qs, mus, gPluses, chi, rhoInit)
+
+# A whole diagram, evaluated by the chunks of chunkRows rows; with workers > 1 the chunks
+# are distributed over a pool of processes and the grid is assembled in their order
+#
+# With a memo (StabilityStore.KMaxMemo) given, the points evaluated before are taken from it,
+# and only the rest of them are evaluated (in chunks of chunkRows rows' worth of points)
+def KMaxGrid(engine, eta, qs, mus, gPluses, chi, rhoInit, workers=1, chunkRows=CHUNK_Q, progress=True, memo=None):
+    if memo is not None:
+        qs, mus, gPluses = np.broadcast_arrays(np.asarray(qs, dtype=np.float64)[:,None],
+                                               np.atleast_1d(np.asarray(mus, dtype=np.float64))[None,:],
+                                               np.atleast_1d(np.asarray(gPluses, dtype=np.float64))[None,:])
+        function = lambda q, mu, gPlus: KMaxFlat(engine, eta, q, mu, gPlus, chi, rhoInit, workers, chunkRows*qs.shape[1])
+        return memo.evaluate(function, engine, eta, qs, mus, gPluses, chi, rhoInit)
+
+    qs = list(qs)
+    chunks = [qs[start:start+chunkRows] for start in range(0, len(qs), chunkRows)]
+    rows = [None for chunk in chunks]
+
+    def report(done):
+        if progress:
+            print(f"\rEvaluated {done}/{len(qs)} values of q", end="" if done < len(qs) else "\n", flush=True)
+
+    done = 0
+    if workers == 1:
+        for ichunk, chunk in enumerate(chunks):
+            rows[ichunk] = KMaxRows(engine, eta, chunk, mus, gPluses, chi, rhoInit)
+            done += len(chunk)
+            report(done)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(KMaxRows, engine, eta, chunk, mus, gPluses, chi, rhoInit): ichunk
+                       for ichunk, chunk in enumerate(chunks)}
+            for future in as_completed(futures):
+                rows[futures[future]] = future.result()
+                done += len(chunks[futures[future]])
+                report(done)
+
+    return np.concatenate(rows, axis=0)
+
+# A diagram refined adaptively: the points lie on the lattice of (N0-1)*2^levels+1 points
+# along each of the axes (q and either mu or gPlus, given by column, while the other one
+# is fixed); it starts from the coarse grid of N0 x N0 points, and at each of the levels
+# the cells whose corners straddle the threshold (i.e. the boundary of the unstable region)
+# or differ by more than tol (relative to the range of the coarse grid) are split into four;
+# returns the evaluated points as the arrays of q, of the column parameter and of KMax;
+# the evaluations go through the memo (StabilityStore.KMaxMemo), if it's given
+def KMaxAdaptive(engine, eta, qlims, xlims, column, fixed, chi, rhoInit, N0=17, levels=6, tol=0.05, threshold=1e-10, memo=None):
+    if column not in ("mu", "gPlus"):
+        raise ValueError(f"Unknown column parameter '{column}' (must be either 'mu' or 'gPlus')")
+
+    size = 2**levels
+    qAxis = np.linspace(qlims[0], qlims[1], (N0 - 1)*size + 1)
+    xAxis = np.linspace(xlims[0], xlims[1], (N0 - 1)*size + 1)
+
+    # The evaluated points, by their indices at the lattice
+    values = {}
+    def evaluate(points):
+        new = sorted(set(points) - values.keys())
+        if new:
+            iq, ix = np.array(new).T
+            if column == "mu": args = (qAxis[iq], xAxis[ix], fixed)
+            else:              args = (qAxis[iq], fixed, xAxis[ix])
+            if memo is None:
+                res = KMaxPoints(engine, eta, *args, chi, rhoInit)
+            else:
+                function = lambda q, mu, gPlus: KMaxPoints(engine, eta, q, mu, gPlus, chi, rhoInit)
+                res = memo.evaluate(function, engine, eta, *args, chi, rhoInit)
+            values.update(zip(new, res))
+
+    corners = lambda cell, size: [cell, (cell[0]+size, cell[1]), (cell[0], cell[1]+size), (cell[0]+size, cell[1]+size)]
+
+    coarse = range(0, len(qAxis), size)
+    evaluate([(iq, ix) for iq in coarse for ix in coarse])
+    span = max(values.values()) - min(values.values())
+
+    # Cells are given by their corners with the lowest indices
+    cells = [(iq, ix) for iq in coarse[:-1] for ix in coarse[:-1]]
+    while size > 1 and cells:
+        refined = []
+        for cell in cells:
+            vals = [values[each] for each in corners(cell, size)]
+            if min(vals) <= threshold < max(vals) or max(vals) - min(vals) > tol*span:
+                refined.append(cell)
+
+        size //= 2
+        cells = [(cell[0]+dq, cell[1]+dx) for cell in refined for dq in (0, size) for dx in (0, size)]
+        evaluate([each for cell in cells for each in corners(cell, size)])
+
+    iq, ix = np.array(list(values.keys())).T
+    return qAxis[iq], xAxis[ix], np.array(list(values.values()))
+
+# Resample the scattered points of an adaptive diagram to the regular grid (Nq, Nx)
+def ResampleAdaptive(qs, xs, kmaxs, qlims, xlims, Nq, Nx):
+    qGrid = np.linspace(qlims[0], qlims[1], Nq)
+    xGrid = np.linspace(xlims[0], xlims[1], Nx)
+    Q, X = np.meshgrid(qGrid, xGrid, indexing="ij")
+    return griddata((qs, xs), kmaxs, (Q, X), method="linear", rescale=True)
+
+# KMax at the points given by the flat arrays of the parameters; with workers > 1,
+# the chunks of the points are evaluated in a pool of processes
+def KMaxFlat(engine, eta, qs, mus, gPluses, chi, rhoInit, workers=1, chunk=CHUNK_Q*256):
+    if workers == 1:
+        return KMaxPoints(engine, eta, qs, mus, gPluses, chi, rhoInit)
+    chunks = [slice(start, start+chunk) for start in range(0, len(qs), chunk)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(KMaxPoints, engine, eta, qs[each], mus[each], gPluses[each], chi, rhoInit) for each in chunks]
+        return np.concatenate([future.result() for future in futures])
+
+# KMax over a chunk of a volume (StabilityStore.VolumeStore), given by the arrays of the values
+# along each of its axes; the points of (q, mu, gPlus) are evaluated at once for each of
+# the values of (eta, chi) and of the initial probabilities (the diagonal of rhoInit)
+def VolumeChunk(engine, qs, mus, gPluses, etas, chis, probs):
+    qs, mus, gPluses = np.asarray(qs)[:,None,None], np.asarray(mus)[None,:,None], np.asarray(gPluses)[None,None,:]
+    chunk = np.zeros((qs.shape[0], mus.shape[1], gPluses.shape[2], len(etas), len(chis), len(probs)))
+    for ieta, eta in enumerate(etas):
+        for ichi, chi in enumerate(chis):
+            for iprob, prob in enumerate(probs):
+                chunk[..., ieta, ichi, iprob] = KMaxPoints(engine, eta, qs, mus, gPluses, chi, np.diag(prob))
+    return chunk
+
+# Scan a volume of the parameters chunk by chunk; the chunks saved before are skipped,
+# so an interrupted scan is resumed by calling it again with the same axes; with
+# workers > 1 the chunks are evaluated in a pool of processes and saved as they come
+#
+# The axes are given as a dictionary of the lists of the values along each of VOLUME_AXES
+# (see StabilityStore), e.g. {"q": qs, "mu": mus, "gPlus": [1.0], "eta": [1.0, -1.0],
+# "chi": [15.0], "probs": [[0.5, 0.1, 0.3, 0.1]]}; returns the VolumeStore
+def ScanVolume(dir, axes, chunks=VOLUME_CHUNKS, engine="blocks", workers=1, progress=True):
+    volume = VolumeStore(dir, axes, chunks)
+    todo = [index for index in volume.chunkIndices() if not volume.done(index)]
+    total = len(volume.chunkIndices())
+
+    def report(done):
+        if progress:
+            print(f"\rEvaluated {done}/{total} chunks", end="" if done < total else "\n", flush=True)
+
+    done = total - len(todo)
+    args = lambda index: [volume.chunkAxes(index)[name] for name in VOLUME_AXES]
+    if workers == 1:
+        for index in todo:
+            volume.write(index, VolumeChunk(engine, *args(index)))
+            done += 1
+            report(done)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(VolumeChunk, engine, *args(index)): index for index in todo}
+            for future in as_completed(futures):
+                volume.write(futures[future], future.result())
+                done += 1
+                report(done)
+    return volume
+
+# The maximum of KMax over q (within qlims) and the q at which it's reached, for the arrays
+# of mu and gPlus (broadcast against each other); the coarse scan of Ncoarse values of q
+# brackets the maximum for each of the points, and then the brackets are narrowed down
+# by the golden-section search (for all the points at once) to the width of xtol;
+# the points with no growth at the coarse scan get kappa = 0 and q_star = nan (note that
+# the bands of instability narrower than the step of the scan may be missed by it);
+# returns (kappa, q_star, number of the evaluations of KMax per point)
+def KMaxEnvelope(engine, eta, qlims, mus, gPluses, chi, rhoInit, Ncoarse=32, xtol=1e-3, threshold=1e-10, memo=None):
+    mus, gPluses = np.broadcast_arrays(np.asarray(mus, dtype=np.float64), np.asarray(gPluses, dtype=np.float64))
+    shape = mus.shape
+    mus, gPluses = mus.ravel(), gPluses.ravel()
+
+    def evaluate(qs, mus, gPluses):
+        if memo is None:
+            return KMaxPoints(engine, eta, qs, mus, gPluses, chi, rhoInit)
+        function = lambda q, mu, gPlus: KMaxPoints(engine, eta, q, mu, gPlus, chi, rhoInit)
+        return memo.evaluate(function, engine, eta, qs, mus, gPluses, chi, rhoInit)
+
+    # Coarse scan
+    qs = np.linspace(qlims[0], qlims[1], Ncoarse)
+    coarse = evaluate(qs[:,None], mus[None,:], gPluses[None,:])
+    best = np.argmax(coarse, axis=0)
+    kappa = coarse[best, np.arange(len(mus))]
+    qstar = qs[best]
+
+    # Golden-section search within the brackets around the best points of the scan
+    a = qs[np.maximum(best - 1, 0)]
+    b = qs[np.minimum(best + 1, Ncoarse - 1)]
+    ratio = (np.sqrt(5.0) - 1.0) / 2.0
+    c = b - ratio*(b - a)
+    d = a + ratio*(b - a)
+    fc = evaluate(c, mus, gPluses)
+    fd = evaluate(d, mus, gPluses)
+    evaluations = Ncoarse + 2
+
+    while np.max(b - a) > xtol:
+        left = fc > fd
+        # The maximum is within [a, d] where f(c) > f(d), and within [c, b] otherwise
+        b = np.where(left, d, b)
+        a = np.where(left, a, c)
+        c, d, fc, fd = (np.where(left, b - ratio*(b - a), d), np.where(left, c, a + ratio*(b - a)),
+                        np.where(left, np.nan, fd), np.where(left, fc, np.nan))
+        new = np.where(left, c, d)
+        fnew = evaluate(new, mus, gPluses)
+        fc = np.where(left, fnew, fc)
+        fd = np.where(left, fd, fnew)
+        evaluations += 1
+
+    # The refined maximum is taken unless the scan has found a better one (KMax isn't unimodal in general)
+    refined = np.maximum(fc, fd)
+    better = refined > kappa
+    kappa = np.where(better, refined, kappa)
+    qstar = np.where(better, np.where(fc > fd, c, d), qstar)
+    qstar = np.where(kappa > threshold, qstar, np.nan)
+
+    return kappa.reshape(shape), qstar.reshape(shape), evaluations
+
+# The blocks of the direct formula, as the indices of the offdiagonal subspace (see pmt)
+blocksOffdiagonal = {"A": inds[0:4], "B": inds[4:8], "C": inds[8:12], "D": inds[12:16]}
+
+# Continuation of the eigenvalues of LMatrixOffdiagonal along a path in the parameters (the arrays
+# of q, mu and gPlus, broadcast against each other to a line of points): the eigenpairs of all
+# the points are evaluated at once, and then the eigenvalues at each of the points are ordered
+# so that each of the branches follows the eigenvector with the largest overlap with its
+# eigenvector at the previous point; returns the branches k_i, (Npoints, 16), whose real parts
+# are the growth rates, and their labels (the block of the direct formula the mode lives in)
+def EigenContinuation(eta, qs, mus, gPluses, chi, rhoInit):
+    qs, mus, gPluses = [each.ravel() for each in np.broadcast_arrays(*[np.asarray(each, dtype=np.float64) for each in (qs, mus, gPluses)])]
+    ks, vs = np.linalg.eig(LMatrixOffdiagonalBatch(eta, qs, mus, gPluses, chi, rhoInit))
+
+    for n in range(1, len(qs)):
+        overlap = np.abs(vs[n-1].conj().T @ vs[n])
+        _, order = linear_sum_assignment(-overlap)
+        ks[n] = ks[n][order]
+        vs[n] = vs[n][:,order]
+
+    labels = []
+    for i in range(16):
+        weights = {block: np.sum(np.abs(vs[0][indices,i])**2) for block, indices in blocksOffdiagonal.items()}
+        block = max(weights, key=weights.get)
+        labels.append(f"{block}{sum(label[0] == block for label in labels) + 1}")
+    return ks, labels
+
+# The harmonics of the noise (Constants.Noise) are the modes of the linearized equations: the harmonic k
+# has the wavenumber q_k = 2 pi k / X (in the units of omega_vac), and sin(q_k x) S + cos(q_k x) C splits
+# into exp(+i q_k x) (C - iS)/2 and exp(-i q_k x) (C + iS)/2; returns the array of q_k and the amplitudes
+# of these modes as the components of the pairs (in the ordering of Pair), (N_Noise, 2, 32)
+def NoiseModes(c, n):
+    qs = 2.0*np.pi*np.arange(1, len(n.sinCoeffsLeft) + 1) / c.X / c.omegaVac
+    S = [su4ComposeTraceless(n.sinCoeffsLeft), su4ComposeTraceless(n.sinCoeffsRight)]
+    C = [su4ComposeTraceless(n.cosCoeffsLeft), su4ComposeTraceless(n.cosCoeffsRight)]
+    plus  = ArrayPair(0.5*(C[0] - 1.0j*S[0]), 0.5*(C[1] - 1.0j*S[1])).gather()
+    minus = ArrayPair(0.5*(C[0] + 1.0j*S[0]), 0.5*(C[1] + 1.0j*S[1])).gather()
+    return qs, np.stack([plus, minus], axis=1)
+
+# The full linearized operators of the setup given by Constants at the wavenumbers qs, (..., 32, 32);
+# as in the rest of the linear analysis, the vacuum mixing angle, the MSW and AMM terms and g_{-}
+# are neglected, and the mean density matrices of both of the beams must be the same
+def SetupOperators(c, qs):
+    if not np.allclose(c.MeanLeft, c.MeanRight):
+        raise ValueError("The linearized equations need the same initial probabilities of both of the beams")
+    return LMatrixBatch(c.eta, qs, c.muOverOmega, c.gPlus, c.chi/deg, c.MeanLeft)
+
+# The modes of the noise propagated along z by the exact exponentials exp(L(+-q_k) dz) of the full
+# linearized operators, at the lines saved by the nonlinear scheme (every periodN_z-th multiple of dz);
+# returns q_k, the positions z (in cm) and the amplitudes of the modes there, (len(zs), N_Noise, 2, 32)
+def LinearModes(c, n, periodN_z=1):
+    qs, amplitudes = NoiseModes(c, n)
+    zs = np.arange(0, c.N_z + 1, periodN_z) * c.dz
+    steps = expm(SetupOperators(c, np.stack([qs, -qs], axis=1)) * (periodN_z*c.dz*c.omegaVac))
+
+    modes = np.empty((len(zs),) + amplitudes.shape, dtype=np.complex128)
+    modes[0] = amplitudes
+    for j in range(1, len(zs)):
+        modes[j] = np.einsum("...ij,...j->...i", steps, modes[j-1])
+    return qs, zs, modes
+
+# The amplitudes of the perturbations: of each of the harmonics, (len(zs), N_Noise), and the rms over x
+# of the norms of the perturbations of both of the beams, (len(zs),) (the harmonics are orthogonal)
+def ModeAmplitudes(modes):
+    harmonics = np.sqrt(np.sum(np.abs(modes)**2, axis=(-2, -1)))
+    return harmonics, np.sqrt(np.sum(harmonics**2, axis=-1))
+
+# The labels of the axes of the volumes at the plots
+VOLUME_LABELS = {"q": r"$q/\omega$", "mu": r"$\mu/\omega$", "gPlus": r"$g_{+}$", "eta": r"$\eta$", "chi": r"$\chi$"}
+
 class Stability:
     """ And finally the class containing different stability diagrams """
-    def __init__(self, dir):
-        self.rhoInit = np.diag([0.5, 0.1, 0.3, 0.1])
+    def __init__(self, dir, store=None, memo=None, chi=15.0, rhoInit=None):
+        # The angle chi (in degrees) and the unperturbed density matrix of the diagrams
+        self.chi = chi
+        self.rhoInit = np.diag([0.5, 0.1, 0.3, 0.1]) if rhoInit is None else rhoInit
         self.dir = dir
-
+        # The grids of the diagrams are saved at the store (StabilityStore.GridStore), if it's given,
+        # and taken from it when a diagram with the same parameters is asked for again;
+        # the single evaluations go through the memo (StabilityStore.KMaxMemo), if it's given
+        self.store = store
+        self.memo  = memo
+
+    # Parameters of a diagram identifying it in the store
+    def meta(self, kind, eta, qlims, Nq, xlims, Nx, fixed, engine, levels, N0, tol):
+        # (all the engines but "diagonal" and "full" give the growth rates of the offdiagonal sector)
+        meta = {"kind": kind, "eta": float(eta), "chi": float(self.chi),
+                "sector": engine if engine in ("diagonal", "full") else "offdiagonal",
+                "rhoInit": [[float(each) for each in row] for row in np.real(self.rhoInit)],
+                "qlims": [float(each) for each in qlims], "Nq": Nq,
+                "xlims": [float(each) for each in xlims], "Nx": Nx, "fixed": float(fixed)}
+        if levels > 0:
+            meta["adaptive"] = {"levels": levels, "N0": N0, "tol": tol}
+        return meta
+
+    # The grid of a diagram, taken from the store or evaluated (and then saved at the store)
+    def diagram(self, kind, eta, qlims, Nq, xlims, Nx, fixed, engine, workers, chunkRows, levels, N0, tol):
+        meta = self.meta(kind, eta, qlims, Nq, xlims, Nx, fixed, engine, levels, N0, tol)
+        if self.store is not None:
+            saved = self.store.load(meta)
+            if saved is not None:
+                return saved["Grid"]
+
+        column = "mu" if kind == "MuQ" else "gPlus"
+        xs = np.linspace(xlims[0], xlims[1], Nx)
+        qs = np.linspace(qlims[0], qlims[1], Nq)
+        if levels > 0:
+            points = KMaxAdaptive(engine, eta, qlims, xlims, column, fixed, chi=self.chi, rhoInit=self.rhoInit,
+                                  N0=N0, levels=levels, tol=tol, memo=self.memo)
+            print(f"Adaptive diagram: {len(points[2])} points evaluated")
+            Grid = ResampleAdaptive(*points, qlims, xlims, Nq, Nx)
+        elif column == "mu":
+            Grid = KMaxGrid(engine, eta, qs, xs, fixed, chi=self.chi, rhoInit=self.rhoInit, workers=workers, chunkRows=chunkRows, memo=self.memo)
+        else:
+            Grid = KMaxGrid(engine, eta, qs, fixed, xs, chi=self.chi, rhoInit=self.rhoInit, workers=workers, chunkRows=chunkRows, memo=self.memo)
+
+        if self.store is not None:
+            self.store.save(meta, Grid, qs=qs, xs=xs)
+        return Grid
+
+    # The engine is either "batch" (all the points of a diagram are evaluated at once,
+    # see KMaxBatch), "blocks" (the same, but only the 4x4 blocks of the operator are
+    # diagonalised, see KMaxBlocks), "diagonal" or "full" (the growth rates of the diagonal sector
+    # or of the whole operator, see KMaxSector) or "point" (KMax is called at each of the points);
+    # with workers > 1 the rows of the diagram are evaluated in parallel (see KMaxGrid);
+    # with levels > 0 the diagram is refined adaptively (see KMaxAdaptive) and then
+    # resampled to the grid Nq x Nmu
     @elapsed
-    def MuQ(self, mulims, qlims, eta, gPlus, Nmu=100, Nq=100, filetitle="MuQ"):
-        Grid = np.zeros((Nq,Nmu))
+    def MuQ(self, mulims, qlims, eta, gPlus, Nmu=100, Nq=100, filetitle="MuQ", engine="batch", workers=1, chunkRows=CHUNK_Q,
+            levels=0, N0=17, tol=0.05):
         mus = list(np.linspace(mulims[0], mulims[1], Nmu))
         qs  = list(np.linspace(qlims[0], qlims[1], Nq))
         
-        for iq,q in enumerate(qs):
-            print(f"Evaluating {q=:.2f} in the range ({qlims[0]},{qlims[1]}), {iq}/{Nq} points")
-            for imu,mu in enumerate(mus):
-                setup = Setup(eta=eta,q=q,mu=mu,gPlus=gPlus,chi=15.0,rhoInit=self.rhoInit)
-                Grid[iq,imu] = KMax(setup)
+        Grid = self.diagram("MuQ", eta, qlims, Nq, mulims, Nmu, gPlus, engine, workers, chunkRows, levels, N0, tol)
 
         hrchy = "NH" if eta == 1.0 else "IH"
 
@@ -170,18 +656,15 @@ class Stability:
                       qs, qlims, r"$q/\omega$",
                       Grid, f"{self.dir}/{filetitle}.eps",
                       hrchy)
+        return Grid
 
     @elapsed
-    def gPlusQ(self, gPluslims, qlims, eta, mu, NgPlus=100, Nq=100, filetitle="gPlusQ"):
-        Grid = np.zeros((Nq,NgPlus))
+    def gPlusQ(self, gPluslims, qlims, eta, mu, NgPlus=100, Nq=100, filetitle="gPlusQ", engine="batch", workers=1, chunkRows=CHUNK_Q,
+               levels=0, N0=17, tol=0.05):
         gPluses = list(np.linspace(gPluslims[0], gPluslims[1], NgPlus))
         qs  = list(np.linspace(qlims[0], qlims[1], Nq))
         
-        for iq,q in enumerate(qs):
-            print(f"Evaluating {q=:.2f} in the range ({qlims[0]},{qlims[1]}), {iq}/{Nq} points")
-            for igPlus,gPlus in enumerate(gPluses):
-                setup = Setup(eta=eta,q=q,mu=mu,gPlus=gPlus,chi=15.0,rhoInit=self.rhoInit)
-                Grid[iq,igPlus] = KMax(setup)
+        Grid = self.diagram("gPlusQ", eta, qlims, Nq, gPluslims, NgPlus, mu, engine, workers, chunkRows, levels, N0, tol)
 
         hrchy = "NH" if eta == 1.0 else "IH"
 
@@ -189,16 +672,87 @@ class Stability:
                       qs, qlims, r"$q/\omega$",
                       Grid, f"{self.dir}/{filetitle}.eps",
                       hrchy)
+        return Grid
+
+    # The envelope maps over (mu, gPlus): the maximal growth rate over q within qlims
+    # and the q at which it's reached (see KMaxEnvelope); the grids are (NgPlus, Nmu)
+    @elapsed
+    def Envelope(self, mulims, gPluslims, qlims, eta, Nmu=100, NgPlus=100, filetitle="Envelope", engine="blocks", Ncoarse=32, xtol=1e-3):
+        mus = list(np.linspace(mulims[0], mulims[1], Nmu))
+        gPluses = list(np.linspace(gPluslims[0], gPluslims[1], NgPlus))
+
+        kappa, qstar, evaluations = KMaxEnvelope(engine, eta, qlims, np.array(mus)[None,:], np.array(gPluses)[:,None],
+                                                 chi=self.chi, rhoInit=self.rhoInit, Ncoarse=Ncoarse, xtol=xtol, memo=self.memo)
+        print(f"Envelope: {evaluations} evaluations per point")
+
+        hrchy = "NH" if eta == 1.0 else "IH"
+
+        PlotStability(mus, mulims, r"$\mu/\omega$",
+                      gPluses, gPluslims, r"$g_{+}$",
+                      kappa, f"{self.dir}/{filetitle}_kappa.eps",
+                      hrchy)
+        PlotStability(mus, mulims, r"$\mu/\omega$",
+                      gPluses, gPluslims, r"$g_{+}$",
+                      qstar, f"{self.dir}/{filetitle}_qstar.eps",
+                      hrchy, cblabel=r"$q_{*} / \omega$")
+        return kappa, qstar
+
+    # The dispersion curves: the growth rates of the tracked branches along q (see EigenContinuation)
+    @elapsed
+    def Dispersion(self, qlims, eta, mu, gPlus, Nq=500, filetitle="Dispersion"):
+        qs = np.linspace(qlims[0], qlims[1], Nq)
+        ks, labels = EigenContinuation(eta, qs, mu, gPlus, chi=self.chi, rhoInit=self.rhoInit)
+
+        hrchy = "NH" if eta == 1.0 else "IH"
+
+        PlotDispersion(qs, qlims, r"$q/\omega$", np.real(ks), labels, f"{self.dir}/{filetitle}.eps", hrchy)
+        return ks, labels
+
+    # A cut of a volume (StabilityStore.VolumeStore) along the axes x and y, with all the other axes
+    # fixed at the given positions (e.g. PlotCut(volume, "mu", "q", gPlus=0, eta=1)); the initial
+    # probabilities can't be along x or y
+    @elapsed
+    def PlotCut(self, volume, x, y, filetitle="Cut", **fixed):
+        if "probs" in (x, y):
+            raise ValueError("The initial probabilities can't be along the axes of a cut")
+        xs, ys, Grid = volume.cut(x, y, **fixed)
+        eta = volume.axes["eta"][fixed.get("eta", 0)] if "eta" not in (x, y) else None
+        hrchy = "NH" if eta == 1.0 else "IH" if eta == -1.0 else ""
+
+        PlotStability(xs, (xs[0], xs[-1]), VOLUME_LABELS[x],
+                      ys, (ys[0], ys[-1]), VOLUME_LABELS[y],
+                      Grid, f"{self.dir}/{filetitle}.eps",
+                      hrchy)
+        return Grid
 
-# Draw the basic stability diagrams used in the article
-def StabilityDiagrams(N, dir):
-    stab = Stability(dir=dir)
+    # The growth of the perturbations given by the noise predicted by the linearized equations (see LinearModes)
+    # for a setup given by its Parameters.json and Noise.json; the rates are the largest growth rates of the
+    # harmonics (in km^-1); it's much cheaper than the nonlinear scheme, so it's a quick way to tell
+    # whether a setup is worth the full run
+    @elapsed
+    def LinearGrowth(self, fParams, fNoise, periodN_z=1, filetitle="LinearGrowth"):
+        c, n = Constants(fParams), Noise(fNoise)
+        qs, zs, modes = LinearModes(c, n, periodN_z)
+        harmonics, total = ModeAmplitudes(modes)
+        rates = np.max(np.real(np.linalg.eigvals(SetupOperators(c, qs))), axis=-1) * c.omegaVac * km
+
+        PlotLinearGrowth(zs/km, (0.0, zs[-1]/km), harmonics, [f"$k = {k}$" for k in range(1, len(qs) + 1)], total,
+                         f"{self.dir}/{filetitle}.eps", c.Hierarchy)
+        return zs/km, harmonics, total, rates
+
+# Draw the basic stability diagrams used in the article; the grids are saved at the store
+# at dir/store (so re-drawing them is cheap) and the evaluations are memoized at dir/memo.sqlite
+def StabilityDiagrams(N, dir, engine="batch", workers=1, persistent=True):
+    if persistent:
+        stab = Stability(dir=dir, store=GridStore(f"{dir}/store"), memo=KMaxMemo(f"{dir}/memo.sqlite"))
+    else:
+        stab = Stability(dir=dir)
 
-    stab.MuQ(mulims=(0,50), qlims=(0,100), eta=1.0,  gPlus=1.0, Nmu=N, Nq=N, filetitle="MuQ_NH")
-    stab.MuQ(mulims=(0,50), qlims=(0,100), eta=-1.0, gPlus=1.0, Nmu=N, Nq=N, filetitle="MuQ_IH")
+    stab.MuQ(mulims=(0,50), qlims=(0,100), eta=1.0,  gPlus=1.0, Nmu=N, Nq=N, filetitle="MuQ_NH", engine=engine, workers=workers)
+    stab.MuQ(mulims=(0,50), qlims=(0,100), eta=-1.0, gPlus=1.0, Nmu=N, Nq=N, filetitle="MuQ_IH", engine=engine, workers=workers)
 
-    stab.gPlusQ(gPluslims=(0,1.0), qlims=(0,100), eta=1.0,  mu=20.0, NgPlus=N, Nq=N, filetitle="gPlusQ_NH")
-    stab.gPlusQ(gPluslims=(0,1.0), qlims=(0,100), eta=-1.0, mu=20.0, NgPlus=N, Nq=N, filetitle="gPlusQ_IH")
+    stab.gPlusQ(gPluslims=(0,1.0), qlims=(0,100), eta=1.0,  mu=20.0, NgPlus=N, Nq=N, filetitle="gPlusQ_NH", engine=engine, workers=workers)
+    stab.gPlusQ(gPluslims=(0,1.0), qlims=(0,100), eta=-1.0, mu=20.0, NgPlus=N, Nq=N, filetitle="gPlusQ_IH", engine=engine, workers=workers)
 
 # A short function that casts 16x16 matrices to text changing the order of the indices
 # with some formatting
@@ -271,6 +825,88 @@ def LMatrixOffdiagonal_Direct(setup):
                      [zeros, zeros, L_C,   zeros],
                      [zeros, zeros, zeros, L_D]])
 
+# KMax of a sector of the full operator (see sectors) for the arrays of the parameters (broadcast
+# against each other); each of the independent blocks of the sector is assembled and diagonalised
+# separately, in batches of batchSize
+def KMaxSector(eta, q, mu, gPlus, chi, rhoInit, sector="diagonal", batchSize=BATCH_SIZE):
+    terms  = LMatrixTerms(chi, rhoInit)
+    blocks = LMatrixBlocks(terms, sectors[sector])
+
+    eta, q, mu, gPlus = np.broadcast_arrays(*[np.asarray(each, dtype=np.float64) for each in (eta, q, mu, gPlus)])
+    shape = q.shape
+    eta, q, mu, gPlus = [each.ravel() for each in (eta, q, mu, gPlus)]
+
+    Grid = np.full(len(q), -np.inf)
+    for block in blocks:
+        blockTerms = terms[:,block][:,:,block]
+        for start in range(0, len(q), batchSize):
+            batch = slice(start, start + batchSize)
+            LBlock = assembleTerms(blockTerms, eta[batch], q[batch], mu[batch], gPlus[batch])
+            # (the blocks 1x1 are their own eigenvalues)
+            eigs = LBlock[...,0] if len(block) == 1 else np.linalg.eigvals(LBlock)
+            Grid[batch] = np.maximum(Grid[batch], np.max(np.real(eigs), axis=-1))
+    return Grid.reshape(shape)
+
+# The blocks of the direct formula for the arrays of the parameters (broadcast against each other):
+# the dense blocks L_A and L_B, (..., 4, 4), and the diagonals of L_C and L_D, (..., 4);
+# as the direct formula itself, it's valid for the diagonal rhoInit only
+def LMatrixOffdiagonalBlocks(eta, q, mu, gPlus, chi, rhoInit):
+    if np.any(rhoInit != np.diag(np.diag(rhoInit))):
+        raise ValueError("The block structure of the operator holds for the diagonal rhoInit only")
+
+    eta, q, mu, gPlus = np.broadcast_arrays(*[np.asarray(each, dtype=np.float64) for each in (eta, q, mu, gPlus)])
+    tan = np.tan(chi * np.pi / 180.0)
+    cos = np.cos(chi * np.pi / 180.0)
+
+    # The same constants as in LMatrixOffdiagonal_Direct
+    delta = -q*tan
+    OmegaPlus  = delta + eta/cos
+    OmegaMinus = delta - eta/cos
+    mub = mu / cos
+
+    se, sx, seb, sxb = np.real(np.diag(rhoInit))
+    De = se - seb
+    Dx = sx - sxb
+    Offex = mub*gPlus*(se - sxb)
+    Offxe = mub*gPlus*(sx - seb)
+    Diag  = mub*(De + Dx)
+
+    L_A = np.zeros(q.shape + (4,4))
+    L_A[...,0,0] =  OmegaMinus + 3.0*Diag; L_A[...,0,2] =  Offex; L_A[...,0,3] = -Offex
+    L_A[...,1,1] =  OmegaPlus  + 3.0*Diag; L_A[...,1,2] = -Offxe; L_A[...,1,3] =  Offxe
+    L_A[...,2,2] = -OmegaPlus  - 3.0*Diag; L_A[...,2,0] = -Offxe; L_A[...,2,1] =  Offxe
+    L_A[...,3,3] = -OmegaMinus - 3.0*Diag; L_A[...,3,0] =  Offex; L_A[...,3,1] = -Offex
+
+    L_B = np.zeros(q.shape + (4,4))
+    L_B[...,0,0] =  OmegaMinus - 3.0*Diag; L_B[...,0,2] = -Offxe; L_B[...,0,3] =  Offxe
+    L_B[...,1,1] =  OmegaPlus  - 3.0*Diag; L_B[...,1,2] =  Offex; L_B[...,1,3] = -Offex
+    L_B[...,2,2] = -OmegaPlus  + 3.0*Diag; L_B[...,2,0] =  Offex; L_B[...,2,1] = -Offex
+    L_B[...,3,3] = -OmegaMinus + 3.0*Diag; L_B[...,3,0] = -Offxe; L_B[...,3,1] =  Offxe
+
+    shifts = np.array([2.0*De + Dx, De + 2.0*Dx, -2.0*De - Dx, -De - 2.0*Dx])
+    L_C = delta[...,None] + 2.0*mub[...,None]*shifts
+    L_D = -delta[...,None] + 2.0*mub[...,None]*shifts
+
+    return L_A, L_B, L_C, L_D
+
+# KMax for the arrays of the parameters exploiting the block structure of the operator:
+# LMatrixOffdiagonal is -i times the direct formula (up to the permutation of the indices),
+# so the growth rates are the imaginary parts of the eigenvalues of the blocks; the diagonal
+# blocks L_C and L_D are real and contribute zero, and the dense 4x4 blocks L_A and L_B
+# are diagonalised in batches (for the diagonal rhoInit only)
+def KMaxBlocks(eta, q, mu, gPlus, chi, rhoInit, batchSize=BATCH_SIZE):
+    eta, q, mu, gPlus = np.broadcast_arrays(*[np.asarray(each, dtype=np.float64) for each in (eta, q, mu, gPlus)])
+    shape = q.shape
+    eta, q, mu, gPlus = [each.ravel() for each in (eta, q, mu, gPlus)]
+
+    Grid = np.empty(len(q), dtype=np.float64)
+    for start in range(0, len(q), batchSize):
+        batch = slice(start, start + batchSize)
+        L_A, L_B, L_C, L_D = LMatrixOffdiagonalBlocks(eta[batch], q[batch], mu[batch], gPlus[batch], chi, rhoInit)
+        eigs = np.linalg.eigvals(np.stack([L_A, L_B], axis=1))
+        Grid[batch] = np.maximum(0.0, np.max(np.imag(eigs), axis=(1, 2)))
+    return Grid.reshape(shape)
+
 # Save particular matrix elements of the operator used to conduct the stability analysis
 def SaveL(eta, q, mu, gPlus, fileout):
     setup = Setup(eta=eta, q=q, mu=mu, gPlus=gPlus, chi=15.0, rhoInit=np.diag([0.5, 0.1, 0.3, 0.1]))
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import os, json, hashlib, sqlite3, itertools
+
+# The grids of a store are saved at its folder as <key>.npz, where the key is the hash of
+# the parameters of a diagram; the version must be increased whenever the layout changes
+STORE_VERSION = 1
+
+# The memo of KMax is a sqlite database; the parameters are quantized with this step
+# (in the units of omega_vac, degrees for chi), and the least recently used evaluations
+# are evicted as soon as there are more than MEMO_ENTRIES of them
+MEMO_QUANTUM = 1e-9
+MEMO_ENTRIES = 10**7
+
+# The axes of the volumes of the parameters, in the order of the dimensions of the arrays;
+# the values along the axis "probs" are the initial probabilities (the diagonal of rhoInit)
+VOLUME_AXES = ("q", "mu", "gPlus", "eta", "chi", "probs")
+VOLUME_CHUNKS = (64, 64, 64, 1, 1, 1)
+
+# The key of a diagram given by its parameters (a JSON-serialisable dictionary)
+def gridKey(meta):
+    return hashlib.sha1(json.dumps(meta, sort_keys=True).encode()).hexdigest()[:20]
+
+class GridStore:
+    """ Growth-rate grids of the stability diagrams saved with their parameters """
+
+    def __init__(self, dir):
+        self.dir = dir.rstrip('/')
+        if not os.path.isdir(self.dir):
+            os.makedirs(self.dir)
+
+    # Save a grid together with the points along its axes (as keyword arguments)
+    def save(self, meta, Grid, **axes):
+        header = {"version": STORE_VERSION, "meta": meta}
+        np.savez(f"{self.dir}/{gridKey(meta)}.npz", header=np.array(json.dumps(header)), Grid=Grid, **axes)
+
+    # The grid (and the axes) of a diagram with the given parameters, or None if there's none
+    def load(self, meta):
+        filename = f"{self.dir}/{gridKey(meta)}.npz"
+        if not os.path.isfile(filename):
+            return None
+        with np.load(filename) as saved:
+            header = json.loads(str(saved["header"]))
+            if header["version"] != STORE_VERSION or header["meta"] != json.loads(json.dumps(meta)):
+                return None
+            return {key: saved[key] for key in saved.files if key != "header"}
+
+    # Parameters of all the saved diagrams
+    def list(self):
+        metas = []
+        for each in sorted(os.listdir(self.dir)):
+            if each.endswith(".npz"):
+                with np.load(f"{self.dir}/{each}") as saved:
+                    metas.append(json.loads(str(saved["header"]))["meta"])
+        return metas
+
+class KMaxMemo:
+    """ Disk-backed memo of the evaluations of KMax """
+
+    def __init__(self, filename, maxEntries=MEMO_ENTRIES, quantum=MEMO_QUANTUM):
+        self.maxEntries = maxEntries
+        self.quantum = quantum
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS kmax (setup TEXT, q INTEGER, mu INTEGER, gPlus INTEGER, "
+                                "value REAL, used INTEGER, UNIQUE(setup, q, mu, gPlus))")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS kmax_used ON kmax(used)")
+        # The counter of the calls, ordering the evaluations by their last use
+        self.tick = self.connection.execute("SELECT COALESCE(MAX(used), 0) FROM kmax").fetchone()[0]
+
+    def quantize(self, values):
+        return np.round(np.asarray(values, dtype=np.float64) / self.quantum).astype(np.int64)
+
+    # The key of the parameters common to all the points of a call; the engines differ in what
+    # they evaluate (the sector of the operator, the clamping of the stable points at zero),
+    # so the engine is a part of the key as well
+    def setup(self, engine, eta, chi, rhoInit):
+        quantized = self.quantize(np.concatenate([[eta, chi], np.real(rhoInit).ravel(), np.imag(rhoInit).ravel()]))
+        return hashlib.sha1(engine.encode() + b"\0" + quantized.tobytes()).hexdigest()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM kmax").fetchone()[0]
+
+    # KMax at the points given by the arrays of the parameters (broadcast against each other);
+    # the points that haven't been evaluated yet by the engine are passed to function(qs, mus, gPluses),
+    # which returns their KMax as an array
+    def evaluate(self, function, engine, eta, qs, mus, gPluses, chi, rhoInit):
+        qs, mus, gPluses = np.broadcast_arrays(*[np.asarray(each, dtype=np.float64) for each in (qs, mus, gPluses)])
+        shape = qs.shape
+        qs, mus, gPluses = [each.ravel() for each in (qs, mus, gPluses)]
+        keys = np.stack([self.quantize(qs), self.quantize(mus), self.quantize(gPluses)], axis=1).tolist()
+        setup = self.setup(engine, eta, chi, rhoInit)
+        self.tick += 1
+
+        # Look up all the points at once through a temporary table
+        cursor = self.connection.cursor()
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (i INTEGER, q INTEGER, mu INTEGER, gPlus INTEGER)")
+        cursor.execute("DELETE FROM wanted")
+        cursor.executemany("INSERT INTO wanted VALUES (?, ?, ?, ?)", [[i] + key for i, key in enumerate(keys)])
+        found = cursor.execute("SELECT wanted.i, kmax.value FROM wanted JOIN kmax ON kmax.setup = ? AND kmax.q = wanted.q "
+                               "AND kmax.mu = wanted.mu AND kmax.gPlus = wanted.gPlus", (setup,)).fetchall()
+
+        Grid = np.full(len(qs), np.nan)
+        hit = np.zeros(len(qs), dtype=bool)
+        if found:
+            indices, values = np.array(found).T
+            Grid[indices.astype(np.int64)] = values
+            hit[indices.astype(np.int64)] = True
+            cursor.execute("UPDATE kmax SET used = ? WHERE setup = ? AND (q, mu, gPlus) IN (SELECT q, mu, gPlus FROM wanted)",
+                           (self.tick, setup))
+
+        missing = np.flatnonzero(~hit)
+        if len(missing):
+            Grid[missing] = function(qs[missing], mus[missing], gPluses[missing])
+            cursor.executemany("INSERT OR REPLACE INTO kmax VALUES (?, ?, ?, ?, ?, ?)",
+                               [(setup, *keys[i], float(Grid[i]), self.tick) for i in missing])
+
+        # Evict the least recently used evaluations
+        excess = len(self) - self.maxEntries
+        if excess > 0:
+            cursor.execute("DELETE FROM kmax WHERE rowid IN (SELECT rowid FROM kmax ORDER BY used LIMIT ?)", (excess,))
+
+        self.connection.commit()
+        return Grid.reshape(shape)
+
+    def close(self):
+        self.connection.close()
+
+class VolumeStore:
+    """ Growth rates over a Cartesian product of the parameters, kept as a chunked array on disk """
+
+    # The volume at dir is opened if axes aren't given, and created otherwise
+    # (axes is a dictionary of the lists of the values along each of VOLUME_AXES)
+    def __init__(self, dir, axes=None, chunks=VOLUME_CHUNKS):
+        self.dir = dir.rstrip('/')
+        if axes is None:
+            if not os.path.isfile(f"{self.dir}/index.json"):
+                raise FileNotFoundError(f"No volume found at {self.dir}")
+            with open(f"{self.dir}/index.json") as f:
+                index = json.load(f)
+            self.axes, self.chunks = index["axes"], tuple(index["chunks"])
+        else:
+            missing = [name for name in VOLUME_AXES if name not in axes]
+            if missing:
+                raise ValueError(f"No values given along the axes {missing}")
+            self.axes = {name: np.asarray(axes[name], dtype=np.float64).tolist() for name in VOLUME_AXES}
+            self.chunks = tuple(int(each) for each in chunks)
+            index = {"version": STORE_VERSION, "axes": self.axes, "chunks": self.chunks}
+            if os.path.isfile(f"{self.dir}/index.json"):
+                with open(f"{self.dir}/index.json") as f:
+                    old = json.load(f)
+                if old["axes"] != self.axes or tuple(old["chunks"]) != self.chunks:
+                    raise ValueError(f"Another volume is already saved at {self.dir}")
+            else:
+                os.makedirs(self.dir, exist_ok=True)
+                with open(f"{self.dir}/index.json", "w") as f:
+                    json.dump(index, f)
+
+        self.shape = tuple(len(self.axes[name]) for name in VOLUME_AXES)
+        self.Nchunks = tuple(-(-n // c) for n, c in zip(self.shape, self.chunks))
+
+    # Chunks are indexed by their positions along each of the axes
+    def chunkIndices(self):
+        return list(itertools.product(*[range(n) for n in self.Nchunks]))
+
+    def chunkFile(self, index):
+        return f"{self.dir}/chunk_{'_'.join(str(each) for each in index)}.npy"
+
+    # The positions of the points of a chunk along each of the axes
+    def chunkSlices(self, index):
+        return tuple(slice(i*c, min((i + 1)*c, n)) for i, c, n in zip(index, self.chunks, self.shape))
+
+    # The values of the parameters of a chunk, as a dictionary of the arrays
+    def chunkAxes(self, index):
+        return {name: np.array(self.axes[name][each]) for name, each in zip(VOLUME_AXES, self.chunkSlices(index))}
+
+    def done(self, index):
+        return os.path.isfile(self.chunkFile(index))
+
+    # Write a chunk (through a temporary file, so a chunk is either complete or missing)
+    def write(self, index, array):
+        tmp = f"{self.chunkFile(index)}.tmp.npy"
+        np.save(tmp, np.asarray(array, dtype=np.float64))
+        os.replace(tmp, self.chunkFile(index))
+
+    # A part of the volume; each of the axes is selected with an integer (the axis is dropped then),
+    # a slice, a list of the positions or None (all the points), e.g. read(eta=0, q=slice(0, 10));
+    # only the chunks intersecting the part are read
+    def read(self, **selection):
+        for name in selection:
+            if name not in VOLUME_AXES:
+                raise ValueError(f"Unknown axis '{name}' (must be one of {VOLUME_AXES})")
+
+        positions, drop = [], []
+        for name, n in zip(VOLUME_AXES, self.shape):
+            each = selection.get(name)
+            if each is None:
+                positions.append(np.arange(n))
+            elif isinstance(each, (int, np.integer)):
+                positions.append(np.array([range(n)[each]])); drop.append(len(positions) - 1)
+            else:
+                positions.append(np.arange(n)[each])
+
+        result = np.full(tuple(len(each) for each in positions), np.nan)
+        chunkRanges = [np.unique(each // c) for each, c in zip(positions, self.chunks)]
+        for index in itertools.product(*chunkRanges):
+            if not self.done(index):
+                continue
+            chunk = np.load(self.chunkFile(index), mmap_mode="r")
+            inside = [(each // c) == i for each, c, i in zip(positions, self.chunks, index)]
+            local  = [each[mask] - i*c for each, mask, c, i in zip(positions, inside, self.chunks, index)]
+            result[np.ix_(*[np.flatnonzero(mask) for mask in inside])] = chunk[np.ix_(*local)]
+        return result.squeeze(axis=tuple(drop)) if drop else result
+
+    # A cut of the volume along the axes x (and y), with all the other axes fixed at the given positions;
+    # returns the values along x (and y) and the grid (Ny, Nx) (or (Nx,))
+    def cut(self, x, y=None, **fixed):
+        free = [name for name in VOLUME_AXES if name not in fixed and name not in (x, y)]
+        free = [name for name in free if len(self.axes[name]) > 1]
+        if free:
+            raise ValueError(f"The axes {free} must be fixed for the cut")
+        fixed = dict({name: 0 for name in VOLUME_AXES if name not in (x, y)}, **fixed)
+        grid = self.read(**fixed)
+        if y is None:
+            return self.axes[x], grid
+        # The remaining axes of grid are x and y, in the order of VOLUME_AXES
+        if VOLUME_AXES.index(x) < VOLUME_AXES.index(y):
+            grid = grid.T
+        return self.axes[x], self.axes[y], grid
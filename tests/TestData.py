@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+import unittest, sys, os, shutil, tempfile
+import numpy as np
+
+sys.path.append("..")
+from Data import Data, Tiles, loadCache, cachedStatistics
+
+# Makes a folder with a fake run in the same layout as the one dumped by nssi;
+# returns the raw probabilities as an array of the shape (Length_z, Length_x, 8)
+def makeTestRun(folder, Length_x, Length_z, seed=0):
+    os.makedirs(f"{folder}/bin", exist_ok=True)
+    rng = np.random.default_rng(seed)
+    raw = rng.random((Length_z, Length_x, 8))
+
+    with open(f"{folder}/XGrid.txt", "w") as f:
+        f.write("".join(f"{0.1*ix} " for ix in range(Length_x)))
+    with open(f"{folder}/ZGrid.txt", "w") as f:
+        f.write("".join(f"{0.2*iz} " for iz in range(Length_z)))
+
+    raw[:, :, :4].tofile(f"{folder}/bin/left.bin")
+    raw[:, :, 4:].tofile(f"{folder}/bin/right.bin")
+    return raw
+
+class TestData(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.raw = makeTestRun(self.folder, Length_x=13, Length_z=21)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_Map(self):
+        data = Data(self.folder, periodN_x=3, periodN_z=4, mmap=True)
+        data.Map()
+        for i in range(8):
+            self.assertEqual(data.Views[i].shape, (data.Length_z_displayed, data.Length_x_displayed))
+            np.testing.assert_array_equal(data.Views[i], self.raw[::4, ::3, i])
+
+    def test_LoadBin(self):
+        # Both ways of reading the binaries must lead to the same matrices
+        plain  = Data(self.folder, periodN_x=3, periodN_z=4)
+        mapped = Data(self.folder, periodN_x=3, periodN_z=4, mmap=True)
+        plain.LoadBin()
+        mapped.LoadBin()
+        for i in range(8):
+            np.testing.assert_array_equal(plain.Probabilities[i], self.raw[::4, ::3, i])
+            np.testing.assert_array_equal(mapped.Probabilities[i], self.raw[::4, ::3, i])
+
+    def test_Averages(self):
+        plain  = Data(self.folder, periodN_x=2, periodN_z=5)
+        mapped = Data(self.folder, periodN_x=2, periodN_z=5, mmap=True)
+        plain.LazyEvaluateAverages()
+        mapped.LazyEvaluateAverages()
+        for i in range(8):
+            expected = np.mean(self.raw[::5, ::2, i], axis=1)
+            np.testing.assert_allclose(plain.Averages[i], expected, rtol=1e-14)
+            np.testing.assert_allclose(mapped.Averages[i], expected, rtol=1e-14)
+
+    def test_blocks(self):
+        # Blocks of any size must cover the whole displayed grid, with or without mmap
+        for mmap in [False, True]:
+            for rows in [1, 2, 4, 64]:
+                data = Data(self.folder, periodN_x=3, periodN_z=2, mmap=mmap)
+                blocks = list(data.blocks(rows))
+                for block in blocks:
+                    self.assertEqual(block.shape[0], 8)
+                    self.assertLessEqual(block.shape[1], rows)
+                    self.assertEqual(block.shape[2], data.Length_x_displayed)
+                whole = np.concatenate(blocks, axis=1)
+                np.testing.assert_array_equal(whole, self.raw[::2, ::3, :].transpose(2, 0, 1))
+
+        # Partial reading of the lines
+        data = Data(self.folder, periodN_z=4)
+        whole = np.concatenate(list(data.blocks(2, start=1, stop=4)), axis=1)
+        np.testing.assert_array_equal(whole, self.raw[4:16:4].transpose(2, 0, 1))
+
+    def test_lines(self):
+        data = Data(self.folder, periodN_x=4, periodN_z=5, chunkRows=3)
+        lines = list(data.lines())
+        self.assertEqual(len(lines), data.Length_z_displayed)
+        for iz, line in enumerate(lines):
+            for i in range(8):
+                np.testing.assert_array_equal(line[i], self.raw[5*iz, ::4, i])
+
+    def test_Statistics(self):
+        for mmap in [False, True]:
+            data = Data(self.folder, periodN_x=3, periodN_z=2, mmap=mmap, chunkRows=4)
+            data.EvaluateStatistics()
+            sol = self.raw[::2, ::3, :].transpose(2, 0, 1)
+            np.testing.assert_allclose(data.Statistics.mean, np.mean(sol, axis=2), rtol=1e-14)
+            np.testing.assert_allclose(data.Statistics.var, np.var(sol, axis=2), rtol=1e-12)
+            np.testing.assert_array_equal(data.Statistics.min, np.min(sol, axis=2))
+            np.testing.assert_array_equal(data.Statistics.max, np.max(sol, axis=2))
+
+            symm = [[0.5*(l + r) for l, r in zip(data.Statistics.mean[f], data.Statistics.mean[f+4])] for f in range(4)]
+            np.testing.assert_allclose(data.Statistics.symm, symm, rtol=1e-14)
+            np.testing.assert_allclose(data.Statistics.nunubar, (sol[0] + sol[1] + sol[4] + sol[5]).mean(axis=1) /
+                                                                (sol[2] + sol[3] + sol[6] + sol[7]).mean(axis=1), rtol=1e-13)
+            # The averages come along with the statistics
+            for i in range(8):
+                np.testing.assert_array_equal(data.Averages[i], data.Statistics.mean[i])
+
+    def test_Follow(self):
+        # Pretend that only the part of the setup has been written, with the last line
+        # of the binaries being written partially and the last point of the z grid incomplete
+        rowsize = self.raw.shape[1]*4*8
+        for beam in ["left", "right"]:
+            with open(f"{self.folder}/bin/{beam}.bin", "r+b") as f:
+                f.truncate(7*rowsize + rowsize//2)
+        with open(f"{self.folder}/ZGrid.txt") as f:
+            zgrid = f.read()
+        with open(f"{self.folder}/ZGrid.txt", "w") as f:
+            f.write(zgrid[:zgrid.index("1.6") + 2])
+
+        for mmap in [False, True]:
+            data = Data(self.folder, periodN_x=3, periodN_z=2, mmap=mmap, follow=True)
+            self.assertEqual(list(data.Follow(timeout=0.0)), [4])
+            self.assertEqual(data.Length_z_displayed, 4)
+            self.assertEqual(len(data.ZGrid_displayed), 4)
+            np.testing.assert_allclose(data.Statistics.mean, np.mean(self.raw[:7:2, ::3, :], axis=1).T, rtol=1e-14)
+
+        # Then let's write the rest of the binaries and the grid
+        self.raw[:, :, :4].tofile(f"{self.folder}/bin/left.bin")
+        self.raw[:, :, 4:].tofile(f"{self.folder}/bin/right.bin")
+        with open(f"{self.folder}/ZGrid.txt", "w") as f:
+            f.write(zgrid)
+
+        self.assertEqual(list(data.Follow(timeout=0.0)), [7])
+        self.assertEqual(data.Length_z_displayed, 11)
+        np.testing.assert_allclose(data.Statistics.mean, np.mean(self.raw[::2, ::3, :], axis=1).T, rtol=1e-14)
+        np.testing.assert_allclose(data.ZGrid_displayed, [0.4*iz for iz in range(11)])
+
+    def test_Cache(self):
+        data = Data(self.folder, periodN_x=3, periodN_z=2)
+        self.assertFalse(data.LoadStatistics())
+        stats = data.CachedStatistics()
+
+        # A fresh cache is loaded with the same periods...
+        other = Data(self.folder, periodN_x=3, periodN_z=2)
+        self.assertTrue(other.LoadStatistics())
+        for field in stats.fields:
+            np.testing.assert_array_equal(getattr(other.Statistics, field), getattr(stats, field))
+        np.testing.assert_array_equal(cachedStatistics(self.folder).mean, stats.mean)
+
+        # ... but not with other ones
+        self.assertIsNone(loadCache(self.folder, periodN_x=1, periodN_z=2))
+
+        # And it's stale as soon as the binaries change
+        self.raw[:, :, :4].tofile(f"{self.folder}/bin/left.bin")
+        with open(f"{self.folder}/bin/left.bin", "ab") as f:
+            f.write(bytes(8))
+        self.assertIsNone(loadCache(self.folder))
+
+    def test_Tiles(self):
+        sol = self.raw[::2, :, :].transpose(2, 0, 1)
+        for codec in ["zlib", "lzma"]:
+            Data(self.folder, periodN_z=2).Tile(tileRows=4, tileCols=5, codec=codec)
+            tiles = Tiles(self.folder)
+            self.assertEqual((tiles.Length_z, tiles.Length_x), sol.shape[1:])
+
+            np.testing.assert_array_equal(tiles.region(0, 11, 0, 13), sol)
+            np.testing.assert_array_equal(tiles.region(3, 9, 4, 11), sol[:, 3:9, 4:11])
+            np.testing.assert_array_equal(tiles.row(7), sol[:, 7, :])
+            np.testing.assert_array_equal(tiles.column(12), sol[:, :, 12])
+            self.assertRaises(IndexError, tiles.region, 0, 12, 0, 13)
+
+            # Summaries obtained from the metadata only
+            mins, maxs, means = tiles.summary()
+            np.testing.assert_array_equal(mins, np.min(sol, axis=(1, 2)))
+            np.testing.assert_array_equal(maxs, np.max(sol, axis=(1, 2)))
+            np.testing.assert_allclose(means, np.mean(sol, axis=(1, 2)), rtol=1e-13)
+            mins, maxs, means = tiles.summary(4, 8, 5, 10)
+            np.testing.assert_allclose(means, np.mean(sol[:, 4:8, 5:10], axis=(1, 2)), rtol=1e-13)
+
+    def test_region(self):
+        for mmap in [False, True]:
+            data = Data(self.folder, periodN_x=2, periodN_z=4, mmap=mmap)
+            # The displayed grids are x = 0.0, 0.2, ..., 1.2 and z = 0.0, 0.8, ..., 4.0
+            xs, zs, values = data.region((0.3, 0.9), (0.7, 3.3), flavours=[1, 3], beams=["right"])
+            np.testing.assert_allclose(xs, [0.4, 0.6, 0.8])
+            np.testing.assert_allclose(zs, [0.8, 1.6, 2.4, 3.2])
+            self.assertEqual(values.shape, (1, 2, 4, 3))
+            np.testing.assert_array_equal(values[0, 0], self.raw[4:17:4, 4:9:2, 5])
+            np.testing.assert_array_equal(values[0, 1], self.raw[4:17:4, 4:9:2, 7])
+
+            xs, zs, values = data.region((0.0, 1.25), (0.0, 4.05))
+            np.testing.assert_array_equal(values.reshape(8, 6, 7), self.raw[::4, ::2, :].transpose(2, 0, 1))
+
+            self.assertRaises(ValueError, data.region, (0.25, 0.35), (0.0, 4.0))
+            self.assertRaises(ValueError, data.region, (0.0, 1.0), (0.0, 4.0), flavours=[4])
+
+    def test_probes(self):
+        for mmap in [False, True]:
+            for maxGap in [0, 4096]:
+                data = Data(self.folder, periodN_x=2, periodN_z=2, mmap=mmap)
+                xs, values = data.probes([1.15, 0.01, 0.5, 0.41], beams=["left", "right"], maxGap=maxGap)
+                np.testing.assert_allclose(xs, [1.2, 0.0, 0.4, 0.4])
+                self.assertEqual(values.shape, (2, 4, 11, 4))
+                for n, ix in enumerate([12, 0, 4, 4]):
+                    np.testing.assert_array_equal(values[0, :, :, n], self.raw[::2, ix, :4].T)
+                    np.testing.assert_array_equal(values[1, :, :, n], self.raw[::2, ix, 4:].T)
+
+    def test_Spectrum(self):
+        # A single harmonic along x (k = 2, i.e. q = 4pi/X) on top of the noise
+        x = np.arange(13) / 12
+        self.raw[:, :, 6] = 0.5 + 0.3*np.cos(4.0*np.pi*x)
+        self.raw[:, :, 4:].tofile(f"{self.folder}/bin/right.bin")
+
+        for mmap in [False, True]:
+            data = Data(self.folder, periodN_x=2, periodN_z=4, mmap=mmap, chunkRows=2)
+            data.EvaluateSpectrum()
+            sol = self.raw[::4, :12:2, :].transpose(2, 0, 1)
+            np.testing.assert_allclose(data.Spectrum.q, 2.0*np.pi*np.arange(4) / 1.2)
+            np.testing.assert_allclose(data.Spectrum.power, np.abs(np.fft.rfft(sol, axis=2))**2 / 36, rtol=1e-6)
+            np.testing.assert_allclose(data.Spectrum.power[6, :, 0], 0.25, rtol=1e-6)
+            np.testing.assert_allclose(data.Spectrum.dominant[6], 4.0*np.pi / 1.2)
+
+        data.DumpSpectrum()
+        with np.load(f"{self.folder}/averages/spectrum.npz") as spectrum:
+            np.testing.assert_array_equal(spectrum["power"], data.Spectrum.power)
+
+if __name__ == "__main__":
+    unittest.main()
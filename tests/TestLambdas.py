@@ -4,7 +4,7 @@ import unittest, sys
 import numpy as np
 
 sys.path.append("..")
-from Lambdas import su4Diag, su4Offdiag, su4Round, BiggestRealEigPart
+from Lambdas import su4Diag, su4Offdiag, su4Round, BiggestRealEigPart, su4SetEigenvalues
 
 class TestLambdas(unittest.TestCase):
 
@@ -40,5 +40,17 @@ class TestLambdas(unittest.TestCase):
         m = np.diag([1.0+1.0j, 2.0+4.0j, -3.0+5j])
         self.assertEqual(BiggestRealEigPart(m), 2.0)
 
+    def test_su4SetEigenvalues(self):
+        rng = np.random.default_rng(0)
+        a = rng.normal(size=(4,4)) + 1.0j*rng.normal(size=(4,4))
+        m = a + np.conj(a.T)
+        pre = np.diag([0.1, 0.2, 0.3, 0.4])
+        r = su4SetEigenvalues(m, pre)
+        np.testing.assert_allclose(np.linalg.eigvalsh(r), [0.1, 0.2, 0.3, 0.4], atol=1e-12)
+
+        # The antihermitian residue is dropped, whichever of the triangles it's in
+        residue = 1e-3*np.triu(rng.normal(size=(4,4)), 1)
+        np.testing.assert_allclose(su4SetEigenvalues(m + residue, pre), su4SetEigenvalues(m + residue.T, pre), atol=1e-12)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
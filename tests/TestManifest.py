@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import unittest, sys, os, shutil, tempfile
+import numpy as np
+
+sys.path.append("..")
+from Manifest import Manifest, LoadManifest, Backfill, MANIFEST_FILE
+from Constants import Constants
+from Data import Data
+from TestData import makeTestRun
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.folder = f"{self.dir}/NSSI NLM 0"
+        self.raw = makeTestRun(self.folder, Length_x=11, Length_z=9)
+        shutil.copy("./Parameters.json", f"{self.folder}/Parameters.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_Manifest(self):
+        self.assertIsNone(LoadManifest(self.folder, make=False))
+        manifest = LoadManifest(self.folder)
+        np.testing.assert_array_equal(manifest.XGrid, [0.1*ix for ix in range(11)])
+        np.testing.assert_array_equal(manifest.ZGrid, [0.2*iz for iz in range(9)])
+        self.assertEqual((manifest.Length_x_bin, manifest.Length_z_bin), (11, 9))
+
+        c = Constants(f"{self.folder}/Parameters.json")
+        self.assertEqual(manifest.muOverOmega, c.muOverOmega)
+        self.assertEqual(manifest.gPlus, c.gPlus)
+        self.assertEqual(manifest.eta, c.eta)
+        # The steps of the grids are 0.1 km and 0.2 km, while the ones of the scheme are 0.01 km and 0.02 km
+        self.assertEqual((manifest.periodN_x, manifest.periodN_z), (10, 10))
+
+        # Opening the setup through the manifest gives the same grids as parsing the text
+        with_manifest = Data(self.folder)
+        os.remove(f"{self.folder}/{MANIFEST_FILE}")
+        without = Data(self.folder)
+        self.assertEqual(with_manifest.XGrid, without.XGrid)
+        self.assertEqual(with_manifest.ZGrid, without.ZGrid)
+
+    def test_stale(self):
+        manifest = LoadManifest(self.folder)
+        self.assertFalse(manifest.stale())
+        with open(f"{self.folder}/ZGrid.txt", "a") as f:
+            f.write("1.8 ")
+        self.assertTrue(Manifest(self.folder).stale())
+        self.assertIsNone(LoadManifest(self.folder, make=False))
+
+        # A stale manifest is re-made with the new grid and hash
+        remade = LoadManifest(self.folder)
+        self.assertEqual(remade.Length_z_bin, 10)
+        self.assertNotEqual(remade.hash, manifest.hash)
+
+    def test_Backfill(self):
+        other = f"{self.dir}/IH/NSSI NLM 1"
+        os.makedirs(other)
+        shutil.copy("./Parameters.json", f"{other}/Parameters.json")
+        self.assertEqual(Backfill(self.dir), 2)
+        # A setup without the grids has the parameters only
+        manifest = Manifest(other)
+        self.assertIsNone(manifest.XGrid)
+        self.assertIsNone(manifest.periodN_x)
+        self.assertEqual(manifest.gPlus, 1.0)
+
+if __name__ == "__main__":
+    unittest.main()
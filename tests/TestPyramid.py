@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import unittest, sys, shutil, tempfile
+import numpy as np
+
+sys.path.append("..")
+from Pyramid import BuildPyramid, LoadPyramid, pyramidFactors
+from TestData import makeTestRun
+
+class TestPyramid(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.raw = makeTestRun(self.folder, Length_x=13, Length_z=21)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_pyramidFactors(self):
+        self.assertEqual(pyramidFactors(13, 21, minSide=2, maxSide=8), [4, 8, 16])
+        self.assertEqual(pyramidFactors(13, 21, minSide=8, maxSide=100), [1, 2, 4])
+        self.assertEqual(pyramidFactors(1000, 1000, minSide=64, maxSide=2048), [1, 2, 4, 8, 16])
+
+    def test_BuildPyramid(self):
+        for mmap in [False, True]:
+            pyramid = BuildPyramid(self.folder, minSide=2, maxSide=8, dtype=np.float64, mmap=mmap)
+            self.assertEqual(pyramid.factors, [4, 8, 16])
+            for factor in pyramid.factors:
+                level = pyramid.levels[factor]
+                Nz, Nx = -(-21 // factor), -(-13 // factor)
+                self.assertEqual(level.mean.shape, (8, Nz, Nx))
+                # Compare with the direct block reductions (including the incomplete blocks)
+                for iz in range(Nz):
+                    for ix in range(Nx):
+                        block = self.raw[iz*factor:(iz+1)*factor, ix*factor:(ix+1)*factor, :]
+                        np.testing.assert_allclose(level.mean[:, iz, ix], np.mean(block, axis=(0, 1)), rtol=1e-13)
+                        np.testing.assert_array_equal(level.min[:, iz, ix], np.min(block, axis=(0, 1)))
+                        np.testing.assert_array_equal(level.max[:, iz, ix], np.max(block, axis=(0, 1)))
+                np.testing.assert_allclose(level.XGrid[0], np.mean([0.1*ix for ix in range(min(factor, 13))]))
+
+    def test_closest(self):
+        pyramid = LoadPyramid(self.folder, minSide=2, maxSide=8)
+        self.assertFalse(pyramid.stale())
+        self.assertEqual(pyramid.closest(3, 5).factor, 4)
+        self.assertEqual(pyramid.closest(1, 1).factor, 16)
+
+        # The pyramid is rebuilt as soon as the binaries change
+        with open(f"{self.folder}/bin/left.bin", "ab") as f:
+            f.write(bytes(8))
+        self.assertTrue(pyramid.stale())
+
+    def test_fullResolution(self):
+        # The setup is smaller than maxSide, so its finest level is the setup itself
+        pyramid = LoadPyramid(self.folder, minSide=8, maxSide=100, dtype=np.float64)
+        self.assertEqual(pyramid.factors, [1, 2, 4])
+        level = pyramid.closest(50, 50)
+        self.assertEqual(level.factor, 1)
+        self.assertEqual((level.Length_z, level.Length_x), (21, 13))
+        np.testing.assert_array_equal(level.mean, np.moveaxis(self.raw, -1, 0))
+        np.testing.assert_array_equal(level.min, level.mean)
+        np.testing.assert_array_equal(level.max, level.mean)
+        np.testing.assert_allclose(level.XGrid, [0.1*ix for ix in range(13)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+import unittest, sys, json, shutil, tempfile, threading
+import numpy as np
+
+sys.path.append("..")
+from Constants import Constants, Noise
+from Lambdas import su4Diag, su4Offdiag, su4Round, G, su4Norm
+from Scheme import Scheme, Hamiltonians, VacuumHamiltonian, CentralDerivative, SpectralDerivative, RK4, RHSCentral, RHSSpectral, InitialConditions, ShiftedInitial, SlabWorker, LEFT, RIGHT
+from Data import Data
+
+class TestScheme(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        with open("./Parameters.json") as f:
+            parameters = json.load(f)
+        parameters["Scheme"].update({"N_x": 64, "N_z": 20, "Z": [0.2, "km"]})
+        with open(f"{self.dir}/Parameters.json", "w") as f:
+            json.dump(parameters, f)
+
+        # A couple of harmonics of the noise
+        rng = np.random.default_rng(0)
+        harmonics = {key: rng.normal(0.0, 1e-3, (2, 15)).tolist()
+                     for key in ["sinCoeffsLeft", "cosCoeffsLeft", "sinCoeffsRight", "cosCoeffsRight"]}
+        with open(f"{self.dir}/Noise.json", "w") as f:
+            json.dump({"Meta": {"N_Noise": 2, "sigma": 1e-3}, "Harmonics": harmonics}, f)
+
+        self.c = Constants(f"{self.dir}/Parameters.json")
+        self.n = Noise(f"{self.dir}/Noise.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_CentralDerivative(self):
+        # The errors of the derivative of a harmonic decrease as dx^2 and dx^4
+        for order, rate in [(2, 4.0), (4, 16.0)]:
+            errors = []
+            for N in [32, 64]:
+                x = np.arange(N) * 2.0*np.pi/N
+                line = np.sin(x)[None, :, None, None] * np.ones((2, N, 4, 4))
+                errors.append(np.max(np.abs(CentralDerivative(line, 2.0*np.pi/N, order) - np.cos(x)[None, :, None, None])))
+            self.assertAlmostEqual(errors[0]/errors[1], rate, delta=0.1*rate)
+
+    def test_SpectralDerivative(self):
+        # The harmonics (below the Nyquist one) are differentiated exactly, for the complex entries as well
+        N, X = 32, 3.0
+        x = np.arange(N) * X/N
+        k = 2.0*np.pi/X * np.arange(16).reshape(4, 4)
+        harmonics = np.exp(1.0j*k[None]*x[:, None, None])
+        line = np.array([harmonics, np.conj(harmonics)])
+        expected = np.array([1.0j*k*harmonics, -1.0j*k*np.conj(harmonics)])
+        np.testing.assert_allclose(SpectralDerivative(line, X), expected, atol=1e-10)
+
+    def test_Spectral(self):
+        # The spectral scheme on a coarse grid is closer to the fine one than the central differences
+        lines = {}
+        for N, rhs in [(16, RHSSpectral), (16, RHSCentral), (64, RHSSpectral)]:
+            self.c.N_x, self.c.dx = N, self.c.X / N
+            rho = InitialConditions(self.c, self.n)
+            for j in range(self.c.N_z):
+                rho = RK4(self.c, rho, j*self.c.dz, rhs)
+            lines[N, rhs] = rho
+        reference = lines[64, RHSSpectral][:, ::4]
+        spectral = np.max(np.abs(lines[16, RHSSpectral] - reference))
+        central  = np.max(np.abs(lines[16, RHSCentral] - reference))
+        self.assertLess(spectral, 1e-8)
+        self.assertLess(100*spectral, central)
+
+    def test_Hamiltonians(self):
+        # Each of the beams feels the other one, point by point
+        rho = InitialConditions(self.c, self.n)
+        H = Hamiltonians(self.c, rho, 0.0)
+        strength = self.c.V_Nu*(1 - self.c.cosOmega)
+        for beam in [LEFT, RIGHT]:
+            for i in [0, 17, 63]:
+                opp = rho[1 - beam, i]
+                expected = (VacuumHamiltonian(self.c) + strength*(np.trace(opp @ G)*G + su4Diag(su4Round(opp))) +
+                            strength*(self.c.gMinus*su4Diag(su4Round(opp)) + self.c.gPlus*su4Offdiag(su4Round(opp))).T)
+                np.testing.assert_allclose(H[beam, i], expected, atol=1e-12*np.max(np.abs(expected)))
+
+    def test_Solve(self):
+        setup = Scheme(f"{self.dir}/Parameters.json", f"{self.dir}/Noise.json", periodN_x=2, periodN_z=5,
+                       folder=f"{self.dir}/run", verbose=False)
+        setup.Solve()
+
+        data = Data(setup.location())
+        self.assertEqual(data.Length_x_bin, 33)
+        self.assertEqual(data.Length_z_bin, 5)
+        np.testing.assert_allclose(data.XGrid, np.linspace(0.0, 10.0, 33), atol=1e-6)
+        np.testing.assert_allclose(data.ZGrid, [0.0, 0.05, 0.1, 0.15, 0.2])
+
+        data.Map()
+        left, right = np.array(data.Views[:4]), np.array(data.Views[4:])
+        # The first line is the initial conditions, and the last point is the periodic continuation of the first one
+        rho = InitialConditions(self.c, self.n)
+        np.testing.assert_allclose(left[:, 0, :-1].T, np.real(np.diagonal(rho[LEFT, ::2], axis1=1, axis2=2)))
+        np.testing.assert_array_equal(left[:, :, -1], left[:, :, 0])
+        np.testing.assert_array_equal(right[:, :, -1], right[:, :, 0])
+        # The probabilities add up to one
+        np.testing.assert_allclose(np.sum(left, axis=0), 1.0, atol=1e-12)
+        np.testing.assert_allclose(np.sum(right, axis=0), 1.0, atol=1e-12)
+        # The lines are kept at the norms of the initial conditions carried along the beams
+        np.testing.assert_allclose(su4Norm(setup.RhoPrev), su4Norm(ShiftedInitial(self.c, self.n, self.c.Z)), rtol=1e-10)
+
+    def test_Adaptive(self):
+        with open(f"{self.dir}/Parameters.json") as f:
+            parameters = json.load(f)
+        parameters["Scheme"].update({"Z": [2.0, "km"], "N_z": 2000, "su4NormaliseFlag": False, "RegEigenvaluesFlag": False})
+        with open(f"{self.dir}/Parameters.json", "w") as f:
+            json.dump(parameters, f)
+
+        fixed = Scheme(f"{self.dir}/Parameters.json", f"{self.dir}/Noise.json", periodN_z=500, folder=f"{self.dir}/fixed", verbose=False)
+        fixed.Solve()
+        adaptive = Scheme(f"{self.dir}/Parameters.json", f"{self.dir}/Noise.json", periodN_z=500, folder=f"{self.dir}/adaptive",
+                          verbose=False, stepping="adaptive", rtol=1e-7)
+        adaptive.Solve()
+
+        # The saved lines are at the same positions, and the adaptive steps are much longer
+        self.assertEqual(Data(adaptive.location()).ZGrid, Data(fixed.location()).ZGrid)
+        self.assertLess(adaptive.accepted + adaptive.rejected, 200)
+        np.testing.assert_allclose(adaptive.RhoPrev, fixed.RhoPrev, atol=1e-7)
+        self.assertRaises(ValueError, Scheme, f"{self.dir}/Parameters.json", f"{self.dir}/Noise.json", stepping="implicit")
+
+    def test_Parallel(self):
+        # The slabs solved by the workers make exactly the same setup as the serial scheme
+        setups = [Scheme(f"{self.dir}/Parameters.json", f"{self.dir}/Noise.json", periodN_z=5, folder=f"{self.dir}/run{workers}",
+                         verbose=False, workers=workers) for workers in [1, 3]]
+        for setup in setups:
+            setup.Solve()
+        np.testing.assert_array_equal(setups[1].RhoPrev, setups[0].RhoPrev)
+        for filename in ["bin/left.bin", "bin/right.bin", "ZGrid.txt", "XGrid.txt"]:
+            with open(f"{self.dir}/run1/{filename}", "rb") as f1, open(f"{self.dir}/run3/{filename}", "rb") as f3:
+                self.assertEqual(f1.read(), f3.read())
+        self.assertRaises(ValueError, Scheme, f"{self.dir}/Parameters.json", f"{self.dir}/Noise.json", derivative="spectral", workers=2)
+
+        # A worker failing before it gets to the lines passes on its own error and releases the others
+        for fParams, names in [(f"{self.dir}/Missing.json", []), (f"{self.dir}/Parameters.json", ["nssi_missing_block"])]:
+            stages, lines = threading.Barrier(2), threading.Barrier(2)
+            with self.assertRaises(FileNotFoundError):
+                SlabWorker(fParams, f"{self.dir}/Noise.json", names, 0, 32, stages, lines, 5)
+            self.assertTrue(stages.broken and lines.broken)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,18 @@
 #!/usr/bin/env python3
 
 from copy import deepcopy
-import unittest, sys
+import unittest, sys, json, shutil, tempfile
 import numpy as np
 
 sys.path.append("..")
-from Stability import Pair, indexMapper, maskLeft, maskRight, LMatrix, Setup
+from Stability import Pair, ArrayPair, L, indexMapper, maskLeft, maskRight, LMatrix, Setup
 from Stability import LMatrixOffdiagonal, LMatrixOffdiagonal_Direct, MyFancyArrayToString, pmt
+from Stability import KMaxAdaptive, ResampleAdaptive, KMaxEnvelope, EigenContinuation
+from Stability import LMatrixBatch, LMatrixTerms, LMatrixBlocks, KMaxSector, sectors
+from Stability import NoiseModes, LinearModes, ModeAmplitudes, SetupOperators
+from Constants import Constants, Noise
+from Scheme import Scheme, xGrid, InitialConditions
+from Stability import KMax, KMaxGrid, KMaxBatch, KMaxBlocks, LMatrixOffdiagonalBatch, LMatrixOffdiagonalBlocks
 
 class TestStability(unittest.TestCase):
 
@@ -85,6 +91,42 @@ class TestStability(unittest.TestCase):
                         self.assertEqual(pairLeft[maskRight[a,b]], 0.0)
                         self.assertEqual(pairRight[maskLeft[a,b]], 0.0)
     
+    def test_ArrayPair(self):
+        mleft  = np.arange(16.0).reshape(4,4)
+        mright = np.arange(16.0, 32.0).reshape(4,4) + 1.0j
+        pair, arraypair = Pair(mleft, mright), ArrayPair(mleft, mright)
+        mleft[0,0] = -1.0 # (the matrices are copied)
+        for index in range(32):
+            self.assertEqual(arraypair[index], pair[index])
+
+        # Gathering and scattering all the components at once
+        components = arraypair.gather()
+        np.testing.assert_array_equal(components, [pair[index] for index in range(32)])
+        np.testing.assert_array_equal(ArrayPair.scatter(components).buffer, arraypair.buffer)
+        arraypair[maskRight[1,2]] = 5.0
+        self.assertEqual(arraypair.right[1,2], 5.0)
+
+        # Stacks of the single entries
+        stack = ArrayPair.singleEntry(np.arange(32))
+        self.assertEqual(stack.buffer.shape, (32,2,4,4))
+        for index in range(32):
+            np.testing.assert_array_equal(stack.buffer[index], ArrayPair.singleEntry(index).buffer)
+            np.testing.assert_array_equal(stack.left[index], Pair.singleEntry(index).left)
+            np.testing.assert_array_equal(stack.right[index], Pair.singleEntry(index).right)
+
+        # L acts on both of the types (and on the stacks) in the same way
+        rng = np.random.default_rng(0)
+        for rhoInit in [np.diag([0.5, 0.1, 0.3, 0.1]), rng.random((4,4))]:
+            setup = Setup(eta=-1.0, q=12.0, mu=7.0, gPlus=0.3, chi=15.0, rhoInit=rhoInit)
+            LM = np.zeros((32,32), dtype=np.complex128)
+            for i in range(32):
+                tmp = L(setup, Pair.singleEntry(i))
+                for j in range(32):
+                    LM[j,i] = tmp[j]
+                np.testing.assert_allclose(L(setup, ArrayPair.singleEntry(i)).gather(), LM[:,i], atol=1e-13)
+            np.testing.assert_allclose(LMatrix(setup), LM, atol=1e-13)
+            np.testing.assert_allclose(LMatrixOffdiagonal(setup), LM[:16,:16], atol=1e-13)
+
     def test_LDirect(self):
         rhoInit = np.diag([0.5, 0.1, 0.3, 0.1])
 
@@ -135,5 +177,210 @@ class TestStability(unittest.TestCase):
                         for j in range(16):
                             self.assertAlmostEqual(N[pmt(i),pmt(j)], D[i,j], 13, msg=f"{q=},{mu=},{gPlus=},{i=},{j=}")
 
+    def test_KMaxBatch(self):
+        rng = np.random.default_rng(0)
+        for rhoInit in [np.diag([0.5, 0.1, 0.3, 0.1]), np.diag([0.5, 0.0, 0.5, 0.0])]:
+            for eta in [1.0, -1.0]:
+                qs = rng.uniform(0.0, 100.0, 50)
+                mus = rng.uniform(0.0, 50.0, 50)
+                gPluses = rng.uniform(0.0, 1.0, 50)
+
+                # The stack of the operators is the same as the one evaluated point by point...
+                LOff = LMatrixOffdiagonalBatch(eta, qs, mus, gPluses, 15.0, rhoInit)
+                # ... as well as the growth rates
+                Grid = KMaxBatch(eta, qs, mus, gPluses, 15.0, rhoInit, batchSize=7)
+                for n in range(50):
+                    setup = Setup(eta=eta, q=qs[n], mu=mus[n], gPlus=gPluses[n], chi=15.0, rhoInit=rhoInit)
+                    np.testing.assert_allclose(LOff[n], LMatrixOffdiagonal(setup), atol=1e-12)
+                    self.assertAlmostEqual(Grid[n], KMax(setup), 10)
+
+        # Broadcasting of the parameters to a grid
+        Grid = KMaxBatch(1.0, qs[:5, None], mus[None, :4], 1.0, 15.0, rhoInit)
+        self.assertEqual(Grid.shape, (5, 4))
+
+    def test_KMaxBlocks(self):
+        rng = np.random.default_rng(1)
+        for rhoInit in [np.diag([0.5, 0.1, 0.3, 0.1]), np.diag([0.5, 0.0, 0.5, 0.0])]:
+            for eta in [1.0, -1.0]:
+                qs = rng.uniform(0.0, 100.0, 200)
+                mus = rng.uniform(0.0, 50.0, 200)
+                gPluses = rng.uniform(0.0, 1.0, 200)
+
+                # The blocks assemble into the direct formula...
+                L_A, L_B, L_C, L_D = LMatrixOffdiagonalBlocks(eta, qs, mus, gPluses, 15.0, rhoInit)
+                for n in range(5):
+                    setup = Setup(eta=eta, q=qs[n], mu=mus[n], gPlus=gPluses[n], chi=15.0, rhoInit=rhoInit)
+                    D = LMatrixOffdiagonal_Direct(setup)
+                    np.testing.assert_allclose(D[:4,:4], L_A[n], atol=1e-12)
+                    np.testing.assert_allclose(D[4:8,4:8], L_B[n], atol=1e-12)
+                    np.testing.assert_allclose(np.diag(D)[8:12], L_C[n], atol=1e-12)
+                    np.testing.assert_allclose(np.diag(D)[12:], L_D[n], atol=1e-12)
+
+                # ... and give the same growth rates as the whole operator
+                np.testing.assert_allclose(KMaxBlocks(eta, qs, mus, gPluses, 15.0, rhoInit, batchSize=33),
+                                           KMaxBatch(eta, qs, mus, gPluses, 15.0, rhoInit), atol=1e-9)
+
+        self.assertRaises(ValueError, KMaxBlocks, 1.0, 1.0, 1.0, 1.0, 15.0, np.full((4,4), 0.25))
+
+    def test_KMaxGrid(self):
+        rhoInit = np.diag([0.5, 0.1, 0.3, 0.1])
+        qs = np.linspace(0.0, 100.0, 13)
+        mus = np.linspace(0.0, 50.0, 11)
+        for engine in ["batch", "blocks", "point"]:
+            serial = KMaxGrid(engine, 1.0, qs, mus, 1.0, 15.0, rhoInit, chunkRows=3, progress=False)
+            parallel = KMaxGrid(engine, 1.0, qs, mus, 1.0, 15.0, rhoInit, workers=3, chunkRows=3, progress=False)
+            self.assertEqual(serial.shape, (13, 11))
+            # The parallel evaluation is the same bit for bit
+            np.testing.assert_array_equal(serial, parallel)
+            np.testing.assert_allclose(serial, KMaxBatch(1.0, qs[:,None], mus[None,:], 1.0, 15.0, rhoInit), atol=1e-9)
+
+        # The columns can go over gPlus as well
+        gPluses = np.linspace(0.0, 1.0, 7)
+        np.testing.assert_array_equal(KMaxGrid("blocks", -1.0, qs, 20.0, gPluses, 15.0, rhoInit, workers=2, progress=False),
+                                      KMaxGrid("blocks", -1.0, qs, 20.0, gPluses, 15.0, rhoInit, progress=False))
+        self.assertRaises(ValueError, KMaxGrid, "fast", 1.0, qs, mus, 1.0, 15.0, rhoInit, progress=False)
+
+    def test_KMaxAdaptive(self):
+        rhoInit = np.diag([0.5, 0.1, 0.3, 0.1])
+        qs, mus, kmaxs = KMaxAdaptive("blocks", 1.0, (0.0, 100.0), (0.0, 50.0), "mu", 1.0, 15.0, rhoInit, N0=9, levels=3)
+        # The points lie at the lattice 65 x 65, but only a part of it is evaluated
+        self.assertLess(len(kmaxs), 65*65 // 2)
+        np.testing.assert_allclose(kmaxs, KMaxBlocks(1.0, qs, mus, 1.0, 15.0, rhoInit))
+        lattice = np.linspace(0.0, 100.0, 65)
+        self.assertTrue(np.all(np.min(np.abs(qs[:,None] - lattice[None,:]), axis=1) < 1e-12))
+
+        # The boundary of the unstable region is resolved as at the full lattice
+        Grid = ResampleAdaptive(qs, mus, kmaxs, (0.0, 100.0), (0.0, 50.0), 65, 65)
+        Full = KMaxBlocks(1.0, lattice[:,None], np.linspace(0.0, 50.0, 65)[None,:], 1.0, 15.0, rhoInit)
+        self.assertFalse(np.any(np.isnan(Grid)))
+        self.assertLessEqual(np.sum((Grid > 1e-10) != (Full > 1e-10)), 2)
+
+        # The columns can go over gPlus as well
+        qs, gPluses, kmaxs = KMaxAdaptive("batch", -1.0, (0.0, 100.0), (0.0, 1.0), "gPlus", 20.0, 15.0, rhoInit, N0=5, levels=2)
+        np.testing.assert_allclose(kmaxs, KMaxBatch(-1.0, qs, 20.0, gPluses, 15.0, rhoInit))
+
+    def test_KMaxEnvelope(self):
+        rhoInit = np.diag([0.5, 0.1, 0.3, 0.1])
+        mus, gPluses = np.linspace(0.0, 50.0, 12)[None,:], np.linspace(0.0, 1.0, 9)[:,None]
+        for eta in [1.0, -1.0]:
+            kappa, qstar, evaluations = KMaxEnvelope("blocks", eta, (0.0, 100.0), mus, gPluses, 15.0, rhoInit, xtol=1e-4)
+            self.assertEqual(kappa.shape, (9, 12))
+            self.assertLess(evaluations, 100)
+
+            # The envelope is at least as high as the brute-force scan (within the tolerance),
+            # apart from the rare narrow bands of instability missed by the coarse scan
+            qs = np.linspace(0.0, 100.0, 1001)[:,None,None]
+            brute = np.max(KMaxBlocks(eta, qs, mus[None], gPluses[None], 15.0, rhoInit), axis=0)
+            self.assertLess(np.mean(kappa < brute - 1e-6), 0.05)
+
+            # And it's reached at q_star
+            unstable = kappa > 1e-10
+            np.testing.assert_array_equal(np.isnan(qstar), ~unstable)
+            np.testing.assert_allclose(KMaxBlocks(eta, qstar[unstable], np.broadcast_to(mus, kappa.shape)[unstable],
+                                                  np.broadcast_to(gPluses, kappa.shape)[unstable], 15.0, rhoInit), kappa[unstable])
+
+    def test_EigenContinuation(self):
+        rhoInit = np.diag([0.5, 0.1, 0.3, 0.1])
+        qs = np.linspace(0.0, 100.0, 1001)
+        ks, labels = EigenContinuation(1.0, qs, 25.0, 1.0, 15.0, rhoInit)
+        self.assertEqual(ks.shape, (1001, 16))
+        self.assertEqual(sorted(label[0] for label in labels), sorted("ABCD"*4))
+
+        # At each point the branches are the eigenvalues of the operator...
+        order = lambda k: k[np.lexsort((np.round(np.imag(k), 8), np.round(np.real(k), 8)))]
+        for n in [0, 500, 1000]:
+            setup = Setup(eta=1.0, q=qs[n], mu=25.0, gPlus=1.0, chi=15.0, rhoInit=rhoInit)
+            np.testing.assert_allclose(order(ks[n]), order(np.linalg.eigvals(LMatrixOffdiagonal(setup))), atol=1e-9)
+        np.testing.assert_allclose(np.max(np.real(ks), axis=1), KMaxBatch(1.0, qs, 25.0, 1.0, 15.0, rhoInit), atol=1e-9)
+
+        # ... and the branches are continuous, unlike the eigenvalues just sorted at each of the points
+        self.assertLess(np.max(np.abs(np.diff(ks, axis=0))), 1.0)
+        self.assertGreater(np.max(np.abs(np.diff(np.sort_complex(ks), axis=0))), 1.0)
+
+        # The branches of the diagonal blocks are stable
+        for i, label in enumerate(labels):
+            if label[0] in "CD":
+                np.testing.assert_allclose(np.real(ks[:,i]), 0.0, atol=1e-9)
+
+    def test_KMaxSector(self):
+        rng = np.random.default_rng(2)
+        qs, mus, gPluses = rng.uniform(0.0, 100.0, 40), rng.uniform(0.0, 50.0, 40), rng.uniform(0.0, 1.0, 40)
+        for rhoInit in [np.diag([0.5, 0.1, 0.3, 0.1]), rng.random((4,4))]:
+            LM = LMatrixBatch(-1.0, qs, mus, gPluses, 15.0, rhoInit)
+            for n in range(5):
+                setup = Setup(eta=-1.0, q=qs[n], mu=mus[n], gPlus=gPluses[n], chi=15.0, rhoInit=rhoInit)
+                np.testing.assert_allclose(LM[n], LMatrix(setup), atol=1e-12)
+
+            # The blocks split the operator exactly
+            blocks = LMatrixBlocks(LMatrixTerms(15.0, rhoInit))
+            np.testing.assert_array_equal(np.sort(np.concatenate(blocks)), np.arange(32))
+            mask = np.zeros((32,32), dtype=bool)
+            for block in blocks:
+                mask[np.ix_(block, block)] = True
+            np.testing.assert_array_equal(LM[:,~mask], 0.0)
+
+            full = KMaxSector(-1.0, qs, mus, gPluses, 15.0, rhoInit, sector="full", batchSize=16)
+            np.testing.assert_allclose(full, np.max(np.real(np.linalg.eigvals(LM)), axis=-1), atol=1e-9)
+
+        # For the diagonal rhoInit the sectors are independent
+        rhoInit = np.diag([0.5, 0.1, 0.3, 0.1])
+        blocks = LMatrixBlocks(LMatrixTerms(15.0, rhoInit), sectors["diagonal"])
+        self.assertTrue(all(np.all(block >= 16) for block in blocks))
+        offdiagonal = KMaxSector(1.0, qs, mus, gPluses, 15.0, rhoInit, sector="offdiagonal")
+        diagonal = KMaxSector(1.0, qs, mus, gPluses, 15.0, rhoInit, sector="diagonal")
+        np.testing.assert_allclose(offdiagonal, KMaxBatch(1.0, qs, mus, gPluses, 15.0, rhoInit), atol=1e-9)
+        np.testing.assert_allclose(KMaxSector(1.0, qs, mus, gPluses, 15.0, rhoInit, sector="full"), np.maximum(offdiagonal, diagonal))
+        self.assertRaises(ValueError, LMatrixBlocks, LMatrixTerms(15.0, rng.random((4,4))), sectors["diagonal"])
+
+        # The round-off residues off the diagonal of rhoInit don't couple the blocks
+        perturbed = rhoInit + 1e-17*rng.random((4,4))
+        for sector in ["diagonal", "full"]:
+            exact = LMatrixBlocks(LMatrixTerms(15.0, rhoInit), sectors[sector])
+            for chi in [15.0, 37.3]:
+                residue = LMatrixBlocks(LMatrixTerms(chi, perturbed), sectors[sector])
+                self.assertEqual([list(block) for block in residue], [list(block) for block in exact])
+        np.testing.assert_allclose(KMaxSector(1.0, qs, mus, gPluses, 15.0, perturbed, sector="diagonal"), diagonal, atol=1e-9)
+
+    def test_LinearModes(self):
+        # A setup with the vacuum mixing neglected, as in the linearized equations, and a small noise
+        dir = tempfile.mkdtemp()
+        with open("./Parameters.json") as f:
+            parameters = json.load(f)
+        parameters["Basic"]["theta"] = [0.0, "deg"]
+        parameters["Scheme"].update({"N_x": 32, "N_z": 400, "Z": [4.0, "km"], "su4NormaliseFlag": False, "RegEigenvaluesFlag": False})
+        with open(f"{dir}/Parameters.json", "w") as f:
+            json.dump(parameters, f)
+        rng = np.random.default_rng(1)
+        harmonics = {key: rng.normal(0.0, 1e-7, (3, 15)).tolist()
+                     for key in ["sinCoeffsLeft", "cosCoeffsLeft", "sinCoeffsRight", "cosCoeffsRight"]}
+        with open(f"{dir}/Noise.json", "w") as f:
+            json.dump({"Meta": {"N_Noise": 3, "sigma": 1e-7}, "Harmonics": harmonics}, f)
+        c, n = Constants(f"{dir}/Parameters.json"), Noise(f"{dir}/Noise.json")
+
+        # The perturbations at the lines given by the modes
+        def lines(qs, amplitudes):
+            phases = np.exp(1.0j*np.outer(xGrid(c)*c.omegaVac, qs))
+            components = phases @ amplitudes[:,0] + np.conj(phases) @ amplitudes[:,1]
+            return np.moveaxis(ArrayPair.scatter(components).buffer, -3, 0)
+        mean = np.array([c.MeanLeft, c.MeanRight])[:,None]
+
+        # The modes are the harmonics of the initial perturbations ...
+        qs, amplitudes = NoiseModes(c, n)
+        np.testing.assert_allclose(lines(qs, amplitudes), InitialConditions(c, n) - mean, atol=1e-15)
+
+        # ... and they grow as the perturbations of the nonlinear scheme
+        setup = Scheme(f"{dir}/Parameters.json", f"{dir}/Noise.json", folder=f"{dir}/run", verbose=False, derivative="spectral")
+        setup.Solve()
+        qs, zs, modes = LinearModes(c, n, periodN_z=100)
+        np.testing.assert_allclose(zs, np.linspace(0.0, c.Z, 5))
+        harmonics, total = ModeAmplitudes(modes)
+        self.assertGreater(total[-1], 10*total[0])
+        delta = setup.RhoPrev - mean
+        self.assertLess(np.max(np.abs(lines(qs, modes[-1]) - delta)), 1e-3*np.max(np.abs(delta)))
+        # The operators are the same for the two beams only when they start with the same probabilities
+        c.MeanRight = c.MeanRight[::-1, ::-1]
+        self.assertRaises(ValueError, SetupOperators, c, qs)
+        shutil.rmtree(dir)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
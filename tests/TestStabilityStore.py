@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import unittest, sys, os, shutil, tempfile
+import numpy as np
+
+sys.path.append("..")
+from StabilityStore import GridStore, KMaxMemo, VolumeStore
+from Stability import Stability, KMaxGrid, KMaxBatch, KMaxBlocks, KMaxSector, ScanVolume
+
+class TestStabilityStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.rhoInit = np.diag([0.5, 0.1, 0.3, 0.1])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_GridStore(self):
+        store = GridStore(f"{self.dir}/store")
+        meta = {"kind": "MuQ", "eta": 1.0, "qlims": [0.0, 100.0], "Nq": 3}
+        self.assertIsNone(store.load(meta))
+        Grid = np.arange(6.0).reshape(3, 2)
+        store.save(meta, Grid, qs=np.array([0.0, 50.0, 100.0]))
+
+        saved = GridStore(f"{self.dir}/store").load(meta)
+        np.testing.assert_array_equal(saved["Grid"], Grid)
+        np.testing.assert_array_equal(saved["qs"], [0.0, 50.0, 100.0])
+        self.assertIsNone(store.load(dict(meta, eta=-1.0)))
+        self.assertEqual(store.list(), [meta])
+
+    def test_KMaxMemo(self):
+        memo = KMaxMemo(f"{self.dir}/memo.sqlite")
+        calls = []
+        def function(qs, mus, gPluses):
+            calls.append(len(qs))
+            return KMaxBatch(1.0, qs, mus, gPluses, 15.0, self.rhoInit)
+
+        qs, mus = np.linspace(0.0, 100.0, 5)[:,None], np.linspace(0.0, 50.0, 4)[None,:]
+        first = memo.evaluate(function, "batch", 1.0, qs, mus, 1.0, 15.0, self.rhoInit)
+        np.testing.assert_array_equal(first, KMaxBatch(1.0, qs, mus, 1.0, 15.0, self.rhoInit))
+        self.assertEqual(calls, [20])
+
+        # The overlapping points are taken from the memo (even after reopening it) ...
+        memo.close()
+        memo = KMaxMemo(f"{self.dir}/memo.sqlite")
+        second = memo.evaluate(function, "batch", 1.0, np.linspace(0.0, 100.0, 9)[:,None], mus, 1.0, 15.0, self.rhoInit)
+        self.assertEqual(calls, [20, 16])
+        np.testing.assert_array_equal(second[::2], first)
+
+        # ... but not for the other parameters
+        memo.evaluate(function, "batch", -1.0, qs, mus, 1.0, 15.0, self.rhoInit)
+        self.assertEqual(calls, [20, 16, 20])
+        self.assertEqual(len(memo), 56)
+        # (nor for the other engines)
+        memo.evaluate(function, "blocks", 1.0, qs, mus, 1.0, 15.0, self.rhoInit)
+        self.assertEqual(calls, [20, 16, 20, 20])
+        self.assertEqual(len(memo), 76)
+        memo.close()
+
+        # The least recently used evaluations are evicted
+        memo = KMaxMemo(f"{self.dir}/memo.sqlite", maxEntries=30)
+        calls.clear()
+        memo.evaluate(function, "batch", 1.0, qs, mus, 1.0, 15.0, self.rhoInit)
+        self.assertEqual(len(memo), 30)
+        memo.evaluate(function, "batch", 1.0, qs, mus, 1.0, 15.0, self.rhoInit)
+        self.assertEqual(calls, [])
+        memo.close()
+
+    def test_memoized(self):
+        memo = KMaxMemo(f"{self.dir}/memo.sqlite")
+        qs, mus = np.linspace(0.0, 100.0, 7), np.linspace(0.0, 50.0, 6)
+        # (the engines share the memo, but the stable points are clamped at zero by "blocks" only)
+        for engine in ["batch", "blocks", "point"]:
+            np.testing.assert_allclose(KMaxGrid(engine, 1.0, qs, mus, 1.0, 15.0, self.rhoInit, progress=False, memo=memo),
+                                       KMaxGrid(engine, 1.0, qs, mus, 1.0, 15.0, self.rhoInit, progress=False), atol=1e-9)
+        memo.close()
+
+        # The sectors evaluated at the same points on a shared memo don't take each other's values
+        memo = KMaxMemo(f"{self.dir}/sectors.sqlite")
+        qs = np.linspace(-3.0, 3.0, 5)
+        for engine, sector in [("batch", "offdiagonal"), ("diagonal", "diagonal"), ("full", "full")]:
+            np.testing.assert_allclose(KMaxGrid(engine, 1.0, qs, 5.0, 1.0, 15.0, self.rhoInit, progress=False, memo=memo)[:,0],
+                                       KMaxSector(1.0, qs, 5.0, 1.0, 15.0, self.rhoInit, sector=sector), atol=1e-9)
+        memo.close()
+
+        # The diagrams are taken from the store the second time
+        stab = Stability(self.dir, store=GridStore(f"{self.dir}/store"))
+        Grid = stab.diagram("gPlusQ", -1.0, (0.0, 100.0), 5, (0.0, 1.0), 4, 20.0, "batch", 1, 8, 0, 17, 0.05)
+        # (no engine is needed then)
+        np.testing.assert_array_equal(stab.diagram("gPlusQ", -1.0, (0.0, 100.0), 5, (0.0, 1.0), 4, 20.0, None, 1, 8, 0, 17, 0.05), Grid)
+        self.assertRaises(ValueError, stab.diagram, "gPlusQ", 1.0, (0.0, 100.0), 5, (0.0, 1.0), 4, 20.0, None, 1, 8, 0, 17, 0.05)
+
+    def test_Volume(self):
+        axes = {"q": np.linspace(0.0, 100.0, 7), "mu": np.linspace(0.0, 50.0, 5), "gPlus": [0.5, 1.0],
+                "eta": [1.0, -1.0], "chi": [15.0], "probs": [[0.5, 0.1, 0.3, 0.1], [0.4, 0.2, 0.3, 0.1]]}
+        chunks = (3, 2, 2, 1, 1, 1)
+        volume = ScanVolume(f"{self.dir}/volume", axes, chunks, progress=False)
+        self.assertEqual(volume.shape, (7, 5, 2, 2, 1, 2))
+        self.assertTrue(all(volume.done(index) for index in volume.chunkIndices()))
+
+        # The cuts agree with the diagrams evaluated directly
+        volume = VolumeStore(f"{self.dir}/volume")
+        mus, qs, Grid = volume.cut("mu", "q", gPlus=1, eta=1, probs=1)
+        np.testing.assert_array_equal(qs, axes["q"])
+        np.testing.assert_allclose(Grid, KMaxBlocks(-1.0, np.array(qs)[:,None], np.array(mus)[None,:], 1.0, 15.0,
+                                                    np.diag([0.4, 0.2, 0.3, 0.1])), atol=1e-12)
+        gPluses, Line = volume.cut("gPlus", q=3, mu=2, eta=0, probs=0)
+        np.testing.assert_allclose(Line, KMaxBlocks(1.0, 50.0, 25.0, np.array(gPluses), 15.0, self.rhoInit), atol=1e-12)
+        self.assertRaises(ValueError, volume.cut, "mu", "q", gPlus=1)
+
+        # The slices of the volume are assembled from the chunks crossing them
+        part = volume.read(q=slice(2, 6), eta=0, chi=0)
+        self.assertEqual(part.shape, (4, 5, 2, 2))
+        np.testing.assert_array_equal(part[..., 1], volume.read(probs=1, chi=0, eta=0)[2:6])
+
+        # An interrupted scan is resumed with the missing chunks only
+        missing = volume.chunkIndices()[::3]
+        for index in missing:
+            os.remove(volume.chunkFile(index))
+        self.assertTrue(np.isnan(volume.read()).any())
+        ScanVolume(f"{self.dir}/volume", axes, chunks, progress=False)
+        np.testing.assert_array_equal(volume.cut("mu", "q", gPlus=1, eta=1, probs=1)[2], Grid)
+        self.assertRaises(ValueError, VolumeStore, f"{self.dir}/volume", dict(axes, chi=[30.0]), chunks)
+
+if __name__ == "__main__":
+    unittest.main()